@@ -9,31 +9,21 @@ from typing import Dict, Tuple, Generator, Optional, Iterable, List
 from tqdm import tqdm  # type: ignore
 import zipfile
 from lengths import L
+from ppo.control_flow.program import Program
 import csv
 
 
 def analyze_P(
     instruction: np.ndarray, P: np.ndarray, start, stop
 ) -> Generator[int, None, None]:
-    def line_type_generator():
-        yield from instruction[:, 0]
-
-    def go_to(it, val):
-        for j, i in enumerate(it):
-            if val == i:
-                return j
-
-    num_steps = None
-    line_type_iterator = line_type_generator()
-    while True:
-        i = go_to(line_type_iterator, start)
-        if i is None:
-            break
+    program = Program(instruction[:, 0])
+    offset = 0  # P is indexed from the line after the previous stop
+    for i, j in program.spans(L(start).value, L(stop).value):
         half = len(P) - 1
-        ex = np.arange(len(P[i])) @ P[i] - half
-        delta = go_to(line_type_iterator, stop)
-        if delta is not None:
-            yield delta, ex
+        ex = np.arange(len(P[i - offset])) @ P[i - offset] - half
+        if j is not None:
+            yield j - i - 1, ex
+            offset = j + 1
 
 
 def generate_offsets(
@@ -9,49 +9,13 @@ from enum import Enum, auto
 from typing import Dict, Tuple, Generator, Optional, Iterable, List
 from tqdm import tqdm  # type: ignore
 import zipfile
-
-
-class L(Enum):
-    Subtask = 0
-    If = 1
-    Else = 2
-    EndIf = 3
-    While = 4
-    EndWhile = 5
-    Loop = 6
-    EndLoop = 7
-    Padding = 8
-    Any = 9
-
-    def __eq__(self, i) -> bool:
-        return i == self.value
+from lengths import L
 
 
 def count(instruction: np.ndarray, line_type: L) -> Generator[int, None, None]:
     return int(np.sum(line_type == instruction[:, 0]))
 
 
-def measure_length(instruction: np.ndarray, start, stop) -> Generator[int, None, None]:
-    def line_type_generator():
-        yield from instruction[:, 0]
-
-    def go_to_stop(it):
-        for j, i in enumerate(it):
-            if stop == i:
-                return j
-
-    def go_to_start(it):
-        for i in it:
-            if start == i:
-                return True
-        return False
-
-    num_steps = None
-    line_type_iterator = line_type_generator()
-    while go_to_start(line_type_iterator):
-        yield go_to_stop(line_type_iterator)
-
-
 def generate_counts(
     instruction_paths: Iterable[Path],
     success_paths: Iterable[Path],
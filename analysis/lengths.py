@@ -10,6 +10,8 @@ from typing import Dict, Tuple, Generator, Optional, Iterable, List
 from tqdm import tqdm  # type: ignore
 import zipfile
 
+from ppo.control_flow.program import Program
+
 
 class L(Enum):
     Subtask = 0
@@ -28,24 +30,9 @@ class L(Enum):
 
 
 def measure_length(instruction: np.ndarray, start, stop) -> Generator[int, None, None]:
-    def line_type_generator():
-        yield from instruction[:, 0]
-
-    def go_to_stop(it):
-        for j, i in enumerate(it):
-            if stop == i:
-                return j
-
-    def go_to_start(it):
-        for i in it:
-            if start == i:
-                return True
-        return False
-
-    num_steps = None
-    line_type_iterator = line_type_generator()
-    while go_to_start(line_type_iterator):
-        yield go_to_stop(line_type_iterator)
+    program = Program(instruction[:, 0])
+    for i, j in program.spans(L(start).value, L(stop).value):
+        yield None if j is None else j - i - 1
 
 
 def generate_lengths(
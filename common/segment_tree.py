@@ -140,3 +140,19 @@ class MinSegmentTree(SegmentTree):
         """Returns min(arr[start], ...,  arr[end])"""
 
         return super(MinSegmentTree, self).reduce(start, end)
+
+    def find_min_idx(self):
+        """Find an index `i` such that arr[i] == self.min()
+
+        Returns
+        -------
+        idx: int
+            index of a smallest element of the array
+        """
+        idx = 1
+        while idx < self._capacity:  # while non-leaf
+            if self._value[2 * idx] <= self._value[2 * idx + 1]:
+                idx = 2 * idx
+            else:
+                idx = 2 * idx + 1
+        return idx - self._capacity
@@ -106,9 +106,13 @@ class DummyVecEnv(VecEnv):
         for env in self.envs:
             env.evaluate()
 
-    def increment_curriculum(self):
+    def set_curriculum(self, weights):
         for env in self.envs:
-            env.increment_curriculum()
+            env.set_curriculum(weights)
+
+    def seed(self, seeds):
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
 
     def train(self):
         for env in self.envs:
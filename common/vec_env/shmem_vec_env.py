@@ -2,173 +2,259 @@
 An interface for asynchronous vectorized environments.
 """
 
-import ctypes
-from multiprocessing import Array, Pipe, Process
+import collections.abc
+import functools
+import itertools
+import os
+import tempfile
 
 import numpy as np
 
-from baselines import logger
-
 # local
-from . import CloudpickleWrapper, VecEnv
-from .util import dict_to_obs, obs_space_info, obs_to_dict
+from .subproc_vec_env import StaticObs, SubprocVecEnv
+from .util import space_shape
+
 
-_NP_TO_CT = {
-    np.float32: ctypes.c_float,
-    np.int32: ctypes.c_int32,
-    np.int8: ctypes.c_int8,
-    np.uint8: ctypes.c_char,
-    np.bool: ctypes.c_bool,
-}
+def flat_size(space):
+    """
+    Number of floats in an observation of `space`, with the values of dict
+    observations flattened and concatenated.
+    """
+    shape = space_shape(space)
+    if isinstance(shape, dict):
+        return int(sum(np.prod(s) for s in shape.values()))
+    return int(np.prod(shape))
 
 
-class ShmemVecEnv(VecEnv):
+class SharedArray:
     """
-    Optimized version of SubprocVecEnv that uses shared variables to communicate observations.
+    An array of `shape` and `dtype` in a temporary file that the parent and
+    the workers map. Unlike a `multiprocessing.RawArray`, which workers can
+    only inherit when they start, it can be sized after they started and
+    reach them through a pipe: unpickling maps the file again.
     """
 
-    def __init__(self, env_fns, spaces=None):
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.path = None
+        if np.prod(shape):
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            fd, self.path = tempfile.mkstemp(prefix="shmem-vec-env-", dir=directory)
+            os.close(fd)
+        self.array = self.map("w+")
+
+    def map(self, mode):
+        if self.path is None:  # nothing to share, and empty files can't be mapped
+            return np.zeros(self.shape, dtype=self.dtype)
+        return np.memmap(
+            self.path, dtype=self.dtype, mode=mode, shape=self.shape
+        ).view(np.ndarray)
+
+    def unlink(self):
         """
-        If you don't specify observation_space, we'll have to create a dummy
-        environment to get it.
+        Removes the file, once every process that needs it has mapped it.
         """
-        if spaces:
-            observation_space, action_space = spaces
-        else:
-            logger.log("Creating dummy env object to get spaces")
-            with logger.scoped_configure(format_strs=[]):
-                dummy = env_fns[0]()
-                observation_space, action_space = (
-                    dummy.observation_space,
-                    dummy.action_space,
-                )
-                dummy.close()
-                del dummy
-        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
-        self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(
-            observation_space
+        if self.path is not None:
+            os.unlink(self.path)
+
+    def __getstate__(self):
+        return dict(shape=self.shape, dtype=self.dtype, path=self.path)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.array = self.map("r+")
+
+
+class SharedObs:
+    """
+    Writes the observations of env `index` into its row of a shared float32
+    buffer of shape [num_envs, size]. Values of dict observations are
+    flattened and concatenated in order, as `VecPyTorch.extract_numpy` does.
+    The `env.static_keys` of a row are only rewritten when they change (see
+    `StaticObs`).
+    """
+
+    def __init__(self, env, buffer, index):
+        self.static_obs = StaticObs(env)
+        self.row = buffer.array[index]
+
+    def encode(self, ob):
+        if not isinstance(ob, dict):
+            self.row[:] = np.ravel(ob)
+            return None
+        _, static = self.static_obs.encode(ob)
+        offset = 0
+        for k, v in ob.items():
+            size = np.size(v)
+            if static is not None or k not in self.static_obs.keys:
+                self.row[offset : offset + size] = np.ravel(v)
+            offset += size
+        assert offset == len(self.row)
+
+
+class SharedInfo:
+    """
+    Writes the scalars of the infos of env `index` into its row of a shared
+    float64 buffer of shape [num_envs, len(env.info_keys)], NaN where an info
+    lacks a key. The other items are sent through the pipe, as the raw bytes
+    of an array where the env declares its `(dtype, shape)` in
+    `env.info_payloads[key]` (see `decode`).
+    """
+
+    def __init__(self, env, buffer, index):
+        keys = getattr(env, "info_keys", ())
+        self.columns = {k: i for i, k in enumerate(keys)}
+        self.payload_types = {
+            k: np.dtype(dtype)
+            for k, (dtype, _) in getattr(env, "info_payloads", {}).items()
+        }
+        self.row = buffer.array[index]
+
+    def encode(self, info):
+        scalars = [np.nan] * len(self.columns)
+        payload = {}
+        for k, v in info.items():
+            i = self.columns.get(k)
+            if i is not None:
+                scalars[i] = v
+            elif k in self.payload_types:
+                payload[k] = np.asarray(v, dtype=self.payload_types[k]).tobytes()
+            else:
+                payload[k] = v
+        self.row[:] = scalars
+        return payload
+
+    @staticmethod
+    def decode(payload, info_payloads):
+        for k, (dtype, shape) in info_payloads.items():
+            if k in payload:
+                payload[k] = np.frombuffer(payload[k], dtype=dtype).reshape(shape)
+        return payload
+
+
+class InfoBatch(collections.abc.Sequence):
+    """
+    The infos of one step of a ShmemVecEnv: `scalars` [num_envs, len(keys)]
+    holds the values of `keys` (NaN where an info lacks one) and `payloads`
+    the other items of each info. Indexing builds info dicts; `info_items`
+    reads the scalars a key at a time.
+    """
+
+    def __init__(self, keys, scalars, payloads):
+        self.keys = keys
+        self.scalars = scalars
+        self.payloads = payloads
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return InfoBatch(self.keys, self.scalars[i], self.payloads[i])
+        row = self.scalars[i]
+        info = {
+            k: v
+            for k, v, present in zip(self.keys, row.tolist(), ~np.isnan(row))
+            if present
+        }
+        info.update(self.payloads[i])
+        return info
+
+
+def info_items(infos):
+    """
+    (key, value) pairs of the infos of a step, with the scalars of an
+    `InfoBatch` as one list of values per key.
+    """
+    if isinstance(infos, InfoBatch):
+        columns = infos.scalars.T.tolist()
+        present = (~np.isnan(infos.scalars)).T.tolist()
+        for k, column, p in zip(infos.keys, columns, present):
+            if any(p):
+                yield k, list(itertools.compress(column, p))
+        infos = infos.payloads
+    for info in infos:
+        yield from info.items()
+
+
+def concatenate_infos(groups):
+    """
+    Joins the infos of a step of several groups of envs, into one InfoBatch
+    if every group returned one with the same keys.
+    """
+    if all(isinstance(g, InfoBatch) and g.keys == groups[0].keys for g in groups):
+        return InfoBatch(
+            groups[0].keys,
+            np.concatenate([g.scalars for g in groups]),
+            [payload for g in groups for payload in g.payloads],
         )
-        self.obs_bufs = [
-            {
-                k: Array(
-                    _NP_TO_CT[self.obs_dtypes[k].type], int(np.prod(self.obs_shapes[k]))
-                )
-                for k in self.obs_keys
-            }
-            for _ in env_fns
-        ]
-        self.parent_pipes = []
-        self.procs = []
-        for env_fn, obs_buf in zip(env_fns, self.obs_bufs):
-            wrapped_fn = CloudpickleWrapper(env_fn)
-            parent_pipe, child_pipe = Pipe()
-            proc = Process(
-                target=_subproc_worker,
-                args=(
-                    child_pipe,
-                    parent_pipe,
-                    wrapped_fn,
-                    obs_buf,
-                    self.obs_shapes,
-                    self.obs_dtypes,
-                    self.obs_keys,
-                ),
+    return [info for infos in groups for info in infos]
+
+
+class ShmemVecEnv(SubprocVecEnv):
+    """
+    SubprocVecEnv whose workers write observations straight into one shared
+    float32 buffer instead of sending them through pipes. Dict observations
+    come back as a [num_envs, size] array laid out like `RolloutStorage.obs`,
+    other observations in the shape of the observation space.
+
+    The returned observations are views of the buffer, which the next call
+    to `step_async` or `reset` overwrites, so callers that keep them across
+    steps must copy them. Infos come back as an `InfoBatch`, with the
+    `env.info_keys` scalars read from a second shared buffer.
+    """
+
+    def __init__(self, env_fns, spaces=None, envs_per_worker=1, info_schema=None):
+        """
+        If you don't specify spaces and info_schema (the `info_keys` and
+        `info_payloads` of the envs), the first worker reports them. The
+        workers start with pipe encoders and switch to the shared buffers
+        once those are sized.
+        """
+        super().__init__(env_fns, spaces=spaces, envs_per_worker=envs_per_worker)
+        if info_schema is None:
+            self.remotes[0].send(("get_info_schema", None))
+            info_schema = self.remotes[0].recv()
+        info_keys, self.info_payloads = info_schema
+        self.info_keys = tuple(info_keys)
+        shape = (self.num_envs, flat_size(self.observation_space))
+        self.obs_buffer = SharedArray(shape, np.float32)
+        self.info_buffer = SharedArray((self.num_envs, len(self.info_keys)), np.float64)
+        try:
+            self.set_encoders()
+        finally:
+            self.obs_buffer.unlink()
+            self.info_buffer.unlink()
+        self.obs = self.obs_buffer.array
+        if not isinstance(space_shape(self.observation_space), dict):
+            self.obs = self.obs.reshape(
+                self.num_envs, *space_shape(self.observation_space)
             )
-            proc.daemon = True
-            self.procs.append(proc)
-            self.parent_pipes.append(parent_pipe)
-            proc.start()
-            child_pipe.close()
-        self.waiting_step = False
-        self.specs = [f().spec for f in env_fns]
-        self.viewer = None
+        self.infos = self.info_buffer.array
 
-    def reset(self):
-        if self.waiting_step:
-            logger.warn("Called reset() while waiting for the step to complete")
-            self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(("reset", None))
-        return self._decode_obses([pipe.recv() for pipe in self.parent_pipes])
-
-    def step_async(self, actions):
-        assert len(actions) == len(self.parent_pipes)
-        for pipe, act in zip(self.parent_pipes, actions):
-            pipe.send(("step", act))
+    def encoder(self, i):
+        return functools.partial(SharedObs, buffer=self.obs_buffer, index=i)
+
+    def info_encoder(self, i):
+        return functools.partial(SharedInfo, buffer=self.info_buffer, index=i)
 
     def step_wait(self):
-        outs = [pipe.recv() for pipe in self.parent_pipes]
-        obs, rews, dones, infos = zip(*outs)
-        return self._decode_obses(obs), np.array(rews), np.array(dones), infos
-
-    def close_extras(self):
-        if self.waiting_step:
-            self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(("close", None))
-        for pipe in self.parent_pipes:
-            pipe.recv()
-            pipe.close()
-        for proc in self.procs:
-            proc.join()
-
-    def get_images(self, mode="human"):
-        for pipe in self.parent_pipes:
-            pipe.send(("render", None))
-        return [pipe.recv() for pipe in self.parent_pipes]
-
-    def _decode_obses(self, obs):
-        result = {}
-        for k in self.obs_keys:
-
-            bufs = [b[k] for b in self.obs_bufs]
-            o = [
-                np.frombuffer(b.get_obj(), dtype=self.obs_dtypes[k]).reshape(
-                    self.obs_shapes[k]
-                )
-                for b in bufs
-            ]
-            result[k] = np.array(o)
-        return dict_to_obs(result)
-
-
-def _subproc_worker(
-    pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs_dtypes, keys
-):
-    """
-    Control a single environment instance using IPC and
-    shared memory.
-    """
-
-    def _write_obs(maybe_dict_obs):
-        flatdict = obs_to_dict(maybe_dict_obs)
-        for k in keys:
-            dst = obs_bufs[k].get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtypes[k]).reshape(
-                obs_shapes[k]
-            )  # pylint: disable=W0212
-            np.copyto(dst_np, flatdict[k])
-
-    env = env_fn_wrapper.x()
-    parent_pipe.close()
-    try:
-        while True:
-            cmd, data = pipe.recv()
-            if cmd == "reset":
-                pipe.send(_write_obs(env.reset()))
-            elif cmd == "step":
-                obs, reward, done, info = env.step(data)
-                if done:
-                    obs = env.reset()
-                pipe.send((_write_obs(obs), reward, done, info))
-            elif cmd == "render":
-                pipe.send(env.render(mode="rgb_array"))
-            elif cmd == "close":
-                pipe.send(None)
-                break
-            else:
-                raise RuntimeError("Got unrecognized cmd %s" % cmd)
-    except KeyboardInterrupt:
-        print("ShmemVecEnv worker: got KeyboardInterrupt")
-    finally:
-        env.close()
+        self._assert_not_closed()
+        results = [result for remote in self.remotes for result in remote.recv()]
+        self.waiting = False
+        _, rews, dones, payloads = zip(*results)
+        payloads = [
+            SharedInfo.decode(payload, self.info_payloads) if payload else payload
+            for payload in payloads
+        ]
+        infos = InfoBatch(self.info_keys, self.infos.copy(), payloads)
+        return self.obs, np.stack(rews), np.stack(dones), infos
+
+    def reset(self):
+        self._assert_not_closed()
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs
@@ -7,42 +7,123 @@ import numpy as np
 from . import CloudpickleWrapper, VecEnv
 
 
+class StaticObs:
+    """
+    Splits off the `env.static_keys` of dict observations, which only change
+    when `env.static_version` does. The worker sends them once per version
+    (and None in their place otherwise); the parent keeps the latest ones in
+    a per-slot table.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.keys = getattr(env, "static_keys", ())
+        self.version = None
+
+    def encode(self, ob):
+        if not self.keys or not isinstance(ob, dict):
+            return ob, None
+        static = None
+        version = self.env.static_version
+        if version != self.version:
+            self.version = version
+            static = {k: ob[k] for k in self.keys}
+        dynamic = collections.OrderedDict(
+            (k, None if k in self.keys else v) for k, v in ob.items()
+        )
+        return dynamic, static
+
+
+class PickledInfo:
+    """
+    Sends infos through the pipe as they are.
+    """
+
+    def __init__(self, env):
+        self.env = env
+
+    @staticmethod
+    def encode(info):
+        return info
+
+
 def worker(remote, parent_remote, env_fn_wrapper):
+    """
+    Runs the envs made by the functions in `env_fn_wrapper` one after the
+    other and answers each command with one message, holding a list with a
+    result per env. `encoder(env).encode` turns each observation, and
+    `info_encoder(env).encode` each info, into what is sent back to the
+    parent: `StaticObs` and `PickledInfo` until "set_encoders" replaces them.
+    """
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    envs = [env_fn() for env_fn in env_fn_wrapper.x]
+    obs_encoders = [StaticObs(env) for env in envs]
+    info_encoders = [PickledInfo(env) for env in envs]
+
+    def step(env, obs_encoder, info_encoder, action):
+        ob, reward, done, info = env.step(action)
+        if done:
+            ob = env.reset()
+        return obs_encoder.encode(ob), reward, done, info_encoder.encode(info)
+
     try:
         while True:
             cmd, data = remote.recv()
             if cmd == "step":
-                ob, reward, done, info = env.step(data)
-                if done:
-                    ob = env.reset()
-                remote.send((ob, reward, done, info))
+                remote.send(
+                    [
+                        step(*args)
+                        for args in zip(envs, obs_encoders, info_encoders, data)
+                    ]
+                )
             elif cmd == "reset":
-                ob = env.reset()
-                remote.send(ob)
+                obs = [e.encode(env.reset()) for env, e in zip(envs, obs_encoders)]
+                remote.send(obs)
             elif cmd == "render":
-                remote.send(env.render(mode="rgb_array"))
+                remote.send([env.render(mode="rgb_array") for env in envs])
             elif cmd == "close":
                 remote.close()
                 break
             elif cmd == "get_spaces":
-                remote.send((env.observation_space, env.action_space))
+                remote.send((envs[0].observation_space, envs[0].action_space))
+            elif cmd == "get_specs":
+                remote.send([env.spec for env in envs])
+            elif cmd == "get_info_schema":
+                remote.send(
+                    (
+                        getattr(envs[0], "info_keys", ()),
+                        getattr(envs[0], "info_payloads", {}),
+                    )
+                )
+            elif cmd == "set_encoders":
+                encoders, info_encoders = data
+                obs_encoders = [encoder(env) for encoder, env in zip(encoders, envs)]
+                info_encoders = [
+                    encoder(env) for encoder, env in zip(info_encoders, envs)
+                ]
+                remote.send(None)
             elif cmd == "evaluate":
-                env.evaluate()
-            elif cmd == "increment_curriculum":
-                env.increment_curriculum()
+                for env in envs:
+                    env.evaluate()
+            elif cmd == "set_curriculum":
+                for env in envs:
+                    env.set_curriculum(data)
+            elif cmd == "seed":
+                for env, seed in zip(envs, data):
+                    env.seed(seed)
             elif cmd == "train":
-                try:
-                    env.train()
-                except AttributeError:
-                    print("Attribute train undefined")
+                for env in envs:
+                    try:
+                        env.train()
+                    except AttributeError:
+                        print("Attribute train undefined")
             else:
                 raise NotImplementedError
     except KeyboardInterrupt:
         print("SubprocVecEnv worker: got KeyboardInterrupt")
     finally:
-        env.close()
+        for env in envs:
+            env.close()
 
 
 class SubprocVecEnv(VecEnv):
@@ -51,22 +132,33 @@ class SubprocVecEnv(VecEnv):
     Recommended to use when num_envs > 1 and step() can be a bottleneck.
     """
 
-    def __init__(self, env_fns, spaces=None):
+    def __init__(self, env_fns, spaces=None, envs_per_worker=1):
         """
         Arguments:
 
         env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
+        spaces: (observation_space, action_space), to skip asking the first worker for them
+        envs_per_worker: how many consecutive envs each subprocess steps, one after the other
         """
         self.waiting = False
         self.closed = False
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
+        self.slices = [
+            slice(i, min(i + envs_per_worker, nenvs))
+            for i in range(0, nenvs, envs_per_worker)
+        ]
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in self.slices])
         self.ps = [
             Process(
-                target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn))
+                target=worker,
+                args=(
+                    work_remote,
+                    remote,
+                    CloudpickleWrapper(env_fns[s]),
+                ),
             )
-            for (work_remote, remote, env_fn) in zip(
-                self.work_remotes, self.remotes, env_fns
+            for (work_remote, remote, s) in zip(
+                self.work_remotes, self.remotes, self.slices
             )
         ]
         for p in self.ps:
@@ -77,30 +169,75 @@ class SubprocVecEnv(VecEnv):
         for remote in self.work_remotes:
             remote.close()
 
-        self.remotes[0].send(("get_spaces", None))
-        observation_space, action_space = self.remotes[0].recv()
+        if spaces:
+            observation_space, action_space = spaces
+        else:
+            self.remotes[0].send(("get_spaces", None))
+            observation_space, action_space = self.remotes[0].recv()
         self.viewer = None
-        self.specs = [f().spec for f in env_fns]
+        for remote in self.remotes:
+            remote.send(("get_specs", None))
+        self.specs = [spec for remote in self.remotes for spec in remote.recv()]
+        self.static = [{} for _ in range(nenvs)]
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
 
+    def encoder(self, i):
+        """
+        Observation encoder of the worker for env `i` (see `worker`).
+        """
+        return StaticObs
+
+    def info_encoder(self, i):
+        """
+        Info encoder of the worker for env `i` (see `worker`).
+        """
+        return PickledInfo
+
+    def set_encoders(self):
+        """
+        Sends each worker the `encoder` and `info_encoder` of its envs and
+        waits until they are in place.
+        """
+        for remote, s in zip(self.remotes, self.slices):
+            envs = range(s.start, s.stop)
+            encoders = [self.encoder(i) for i in envs]
+            info_encoders = [self.info_encoder(i) for i in envs]
+            remote.send(("set_encoders", (encoders, info_encoders)))
+        for remote in self.remotes:
+            remote.recv()
+
     def step_async(self, actions):
         self._assert_not_closed()
-        for remote, action in zip(self.remotes, actions):
-            remote.send(("step", action))
+        for remote, s in zip(self.remotes, self.slices):
+            remote.send(("step", actions[s]))
         self.waiting = True
 
     def step_wait(self):
         self._assert_not_closed()
-        results = [remote.recv() for remote in self.remotes]
+        results = [result for remote in self.remotes for result in remote.recv()]
         self.waiting = False
         obs, rews, dones, infos = zip(*results)
+        obs = [self._merge_static(i, ob) for i, ob in enumerate(obs)]
         return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos
 
     def reset(self):
         self._assert_not_closed()
         for remote in self.remotes:
             remote.send(("reset", None))
-        return _flatten_obs([remote.recv() for remote in self.remotes])
+        obs = [ob for remote in self.remotes for ob in remote.recv()]
+        obs = [self._merge_static(i, ob) for i, ob in enumerate(obs)]
+        return _flatten_obs(obs)
+
+    def _merge_static(self, i, split):
+        ob, static = split
+        if static is not None:
+            self.static[i] = static
+        if not self.static[i]:
+            return ob
+        return collections.OrderedDict(
+            (k, self.static[i][k] if k in self.static[i] else v)
+            for k, v in ob.items()
+        )
 
     def close_extras(self):
         self.closed = True
@@ -116,7 +253,7 @@ class SubprocVecEnv(VecEnv):
         self._assert_not_closed()
         for pipe in self.remotes:
             pipe.send(("render", None))
-        imgs = [pipe.recv() for pipe in self.remotes]
+        imgs = [img for pipe in self.remotes for img in pipe.recv()]
         return imgs
 
     def _assert_not_closed(self):
@@ -132,9 +269,13 @@ class SubprocVecEnv(VecEnv):
         for remote in self.remotes:
             remote.send(("train", None))
 
-    def increment_curriculum(self):
+    def set_curriculum(self, weights):
         for remote in self.remotes:
-            remote.send(("increment_curriculum", None))
+            remote.send(("set_curriculum", weights))
+
+    def seed(self, seeds):
+        for remote, s in zip(self.remotes, self.slices):
+            remote.send(("seed", seeds[s]))
 
 
 def _flatten_obs(obs):
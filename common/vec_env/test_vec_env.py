@@ -2,13 +2,16 @@
 Tests for asynchronous vectorized environments.
 """
 
+import collections
+import os
+
 import gym
 import numpy as np
 import pytest
 
 # local
 from .dummy_vec_env import DummyVecEnv
-from .shmem_vec_env import ShmemVecEnv
+from .shmem_vec_env import InfoBatch, ShmemVecEnv, concatenate_infos, info_items
 from .subproc_vec_env import SubprocVecEnv
 
 
@@ -103,3 +106,205 @@ class SimpleEnv(gym.Env):
 
     def render(self, mode=None):
         raise NotImplementedError
+
+
+def flatten(obs):
+    """
+    Dict observations as the [num_envs, size] array that ShmemVecEnv returns.
+    """
+    if isinstance(obs, dict):
+        return np.hstack([x.reshape(len(x), -1) for x in obs.values()])
+    return obs
+
+
+@pytest.mark.parametrize("klass", (ShmemVecEnv, SubprocVecEnv))
+@pytest.mark.parametrize("envs_per_worker", (1, 2))
+def test_dict_obs(klass, envs_per_worker):
+    """
+    Test that dict observations, including static keys that are only sent
+    when they change, match DummyVecEnv.
+    """
+    num_envs = 4
+    fns = [lambda seed=seed: DictEnv(seed) for seed in range(num_envs)]
+    env1 = DummyVecEnv(fns, render=False)
+    env2 = klass(fns, envs_per_worker=envs_per_worker)
+    try:
+        obs1, obs2 = env1.reset(), env2.reset()
+        assert np.allclose(flatten(obs1), flatten(obs2))
+        np.random.seed(1337)
+        for _ in range(50):
+            actions = np.random.randint(0, 4, size=num_envs)
+            for env in [env1, env2]:
+                env.step_async(actions)
+            obs1, rews1, dones1, _ = env1.step_wait()
+            obs2, rews2, dones2, _ = env2.step_wait()
+            assert np.allclose(flatten(obs1), flatten(obs2))
+            assert np.allclose(rews1, rews2)
+            assert np.array_equal(dones1, dones2)
+    finally:
+        env1.close()
+        env2.close()
+
+
+@pytest.mark.parametrize("klass", (ShmemVecEnv, SubprocVecEnv))
+def test_envs_built_in_workers(klass):
+    """
+    Test that only the workers build envs: spaces, specs and the info schema
+    come from them through the pipes.
+    """
+    parent = os.getpid()
+
+    def make_env(seed):
+        assert os.getpid() != parent
+        return DictEnv(seed)
+
+    fns = [lambda seed=seed: make_env(seed) for seed in range(3)]
+    env = klass(fns, envs_per_worker=2)
+    try:
+        assert isinstance(env.observation_space, gym.spaces.Dict)
+        assert env.specs == [None] * 3
+        if klass is ShmemVecEnv:
+            assert env.info_keys == DictEnv.info_keys
+            assert env.info_payloads == DictEnv.info_payloads
+        env.reset()
+    finally:
+        env.close()
+
+
+def test_shmem_obs_are_views():
+    """
+    Test that ShmemVecEnv returns its shared buffer without copying, so the
+    next step overwrites observations that callers did not copy.
+    """
+    fns = [lambda seed=seed: DictEnv(seed) for seed in range(2)]
+    env1 = DummyVecEnv(fns, render=False)
+    env2 = ShmemVecEnv(fns)
+    try:
+        obs = env2.reset()
+        first = obs.copy()
+        assert np.array_equal(first, flatten(env1.reset()))
+        actions = np.ones(2, dtype=int)
+        for env in [env1, env2]:
+            env.step_async(actions)
+        obs1, *_ = env1.step_wait()
+        obs2, *_ = env2.step_wait()
+        assert np.shares_memory(obs, obs2)
+        assert np.array_equal(obs, flatten(obs1))
+        assert not np.array_equal(obs, first)
+    finally:
+        env1.close()
+        env2.close()
+
+
+@pytest.mark.parametrize("envs_per_worker", (1, 3))
+def test_shmem_infos(envs_per_worker):
+    """
+    Test that ShmemVecEnv sends declared scalars through shared memory and
+    payloads with their declared dtypes and shapes, and that the InfoBatch it returns
+    reads like the infos of DummyVecEnv.
+    """
+    num_envs = 3
+    fns = [lambda seed=seed: DictEnv(seed) for seed in range(num_envs)]
+    env1 = DummyVecEnv(fns, render=False)
+    env2 = ShmemVecEnv(fns, envs_per_worker=envs_per_worker)
+    try:
+        env1.reset()
+        env2.reset()
+        for t in range(30):
+            actions = np.full(num_envs, t % 4)
+            for env in [env1, env2]:
+                env.step_async(actions)
+            *_, infos1 = env1.step_wait()
+            *_, infos2 = env2.step_wait()
+            assert isinstance(infos2, InfoBatch)
+            assert infos2.scalars.shape == (num_envs, len(DictEnv.info_keys))
+            assert len(infos2) == num_envs
+            for info1, info2 in zip(infos1, infos2):
+                assert set(info1) == set(info2)
+                for k, v in info1.items():
+                    if k in DictEnv.info_payloads:
+                        dtype, _ = DictEnv.info_payloads[k]
+                        assert info2[k].dtype == dtype
+                        assert np.array_equal(info2[k], v)
+                    else:
+                        assert info2[k] == v
+            items1, items2 = collect_items(infos1), collect_items(infos2)
+            assert items1 == items2
+
+            joined = concatenate_infos([infos2[:1], infos2[1:]])
+            assert isinstance(joined, InfoBatch)
+            assert collect_items(joined) == items2
+    finally:
+        env1.close()
+        env2.close()
+
+
+def collect_items(infos):
+    """
+    The values of each info key, in env order.
+    """
+    items = collections.defaultdict(list)
+    for k, v in info_items(infos):
+        if k in DictEnv.info_payloads:
+            items[k].append(np.asarray(v).tolist())
+        elif isinstance(v, list):
+            items[k].extend(v)
+        else:
+            items[k].append(v)
+    return dict(items)
+
+
+class DictEnv(gym.Env):
+    """
+    An environment with dict observations, a static observation key and
+    infos that declare their scalar keys and payload dtypes and shapes.
+    """
+
+    static_keys = ("goal",)
+    info_keys = ("position", "success", "episode_len")
+    # the positions visited in the episode
+    info_payloads = {"trajectory": (np.int16, (-1, 2))}
+
+    def __init__(self, seed):
+        self.random = np.random.RandomState(seed)
+        self.observation_space = gym.spaces.Dict(
+            collections.OrderedDict(
+                position=gym.spaces.Box(low=0, high=9, shape=(2,), dtype=np.float32),
+                goal=gym.spaces.Box(low=0, high=9, shape=(2, 2), dtype=np.float32),
+            )
+        )
+        self.action_space = gym.spaces.Discrete(4)
+        self.static_version = 0
+        self.position = self.goal = self.trajectory = None
+
+    def observation(self):
+        return collections.OrderedDict(
+            position=np.array(self.position, dtype=np.float32),
+            goal=np.array(self.goal, dtype=np.float32),
+        )
+
+    def reset(self):
+        self.static_version += 1
+        self.position = self.random.randint(10, size=2)
+        self.goal = self.random.randint(10, size=(2, 2))
+        self.trajectory = []
+        return self.observation()
+
+    def step(self, action):
+        move = [(0, 1), (1, 0), (0, -1), (-1, 0)][int(action)]
+        self.position = np.clip(self.position + move, 0, 9)
+        self.trajectory.append(self.position.tolist())
+        success = bool((self.position == self.goal[0]).all())
+        done = success or len(self.trajectory) >= 5 + self.static_version % 3
+        info = dict(position=float(self.position.sum()))
+        if done:
+            info.update(
+                success=success,
+                episode_len=len(self.trajectory),
+                trajectory=self.trajectory,
+                note="pickled",
+            )
+        return self.observation(), float(success), done, info
+
+    def render(self, mode=None):
+        raise NotImplementedError
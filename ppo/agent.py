@@ -10,7 +10,7 @@ from ppo.control_flow.multi_step.env import Obs, subtasks, Env
 from ppo.control_flow.lines import Subtask
 from ppo.control_flow.recurrence import get_obs_sections
 from ppo.distributions import Categorical, DiagGaussian
-from ppo.layers import Flatten
+from ppo.layers import Flatten, ObjectList, Sum
 from ppo.utils import init, init_normc_, init_
 
 AgentValues = namedtuple(
@@ -310,42 +310,31 @@ class LowerLevel(NNBase):
                 [Env.preprocess_line(Subtask(s)) for s in subtasks()] + [[0, 0, 0, 0]]
             ),
         )
-        (d, h, w) = obs_space.obs.shape
         inventory_size = obs_space.inventory.n
         line_nvec = torch.tensor(obs_space.lines.nvec)
         offset = F.pad(line_nvec[0, :-1].cumsum(0), [1, 0])
         self.register_buffer("offset", offset)
         self.obs_spaces = obs_space
         self.obs_sections = get_obs_sections(self.obs_spaces)
-        padding = (kernel_size // 2) % stride
-
-        self.conv = nn.Sequential()
-        in_size = d
-        assert num_conv_layers > 0
-        for i in range(num_conv_layers):
-            self.conv.add_module(
-                name=f"conv{i}",
-                module=nn.Sequential(
-                    init_(
-                        nn.Conv2d(
-                            in_size,
-                            hidden_size,
-                            kernel_size=kernel_size,
-                            stride=stride,
-                            padding=padding,
-                        )
-                    ),
-                    activation,
-                ),
-            )
-            in_size = hidden_size
-            h = w = (h + (2 * padding) - (kernel_size - 1) - 1) // stride + 1
-            kernel_size = min(h, kernel_size)
-        self.conv.add_module(name="flatten", module=Flatten())
         init2 = lambda m: init(m, init_normc_, lambda x: nn.init.constant_(x, 0))
 
+        if len(obs_space.obs.shape) == 2:
+            # object-list observation: encode objects and sum them
+            self.conv = nn.Sequential(
+                ObjectList(obs_space.obs, hidden_size, activation), Sum(dim=1)
+            )
+            conv_size = hidden_size
+        else:
+            self.conv, conv_size = self.build_conv(
+                obs_space.obs.shape,
+                hidden_size,
+                num_conv_layers,
+                kernel_size,
+                stride,
+                activation,
+            )
         self.conv_projection = nn.Sequential(
-            init2(nn.Linear(h * w * hidden_size, hidden_size)), activation
+            init2(nn.Linear(conv_size, hidden_size)), activation
         )
         self.line_embed = nn.EmbeddingBag(line_nvec[0].sum(), hidden_size)
         self.inventory_embed = nn.Sequential(
@@ -367,6 +356,42 @@ class LowerLevel(NNBase):
         self._output_size = in_size
         self.train()
 
+    @staticmethod
+    def build_conv(
+        obs_shape, hidden_size, num_conv_layers, kernel_size, stride, activation
+    ):
+        """
+        Convolutions over the one-hot grid, flattened. Returns the module and
+        its output size.
+        """
+        (d, h, w) = obs_shape
+        padding = (kernel_size // 2) % stride
+
+        conv = nn.Sequential()
+        in_size = d
+        assert num_conv_layers > 0
+        for i in range(num_conv_layers):
+            conv.add_module(
+                name=f"conv{i}",
+                module=nn.Sequential(
+                    init_(
+                        nn.Conv2d(
+                            in_size,
+                            hidden_size,
+                            kernel_size=kernel_size,
+                            stride=stride,
+                            padding=padding,
+                        )
+                    ),
+                    activation,
+                ),
+            )
+            in_size = hidden_size
+            h = w = (h + (2 * padding) - (kernel_size - 1) - 1) // stride + 1
+            kernel_size = min(h, kernel_size)
+        conv.add_module(name="flatten", module=Flatten())
+        return conv, h * w * hidden_size
+
     def parse_inputs(self, inputs: torch.Tensor):
         return torch.split(inputs, self.obs_sections, dim=-1)
 
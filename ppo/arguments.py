@@ -63,11 +63,33 @@ def build_parser():
         "--eval-interval", type=int, help="eval interval, one eval per n updates"
     )
     parser.add_argument("--load-path", type=Path)
+    parser.add_argument(
+        "--eval-cache-dir",
+        type=Path,
+        help="reuse evaluation results of identical parameters from this directory",
+    )
+    parser.add_argument(
+        "--curriculum-interval",
+        type=int,
+        metavar="N",
+        help="every N updates, reweight training tasks by learning progress",
+    )
     parser.add_argument("--log-dir", type=Path, help="directory to save agent logs")
     parser.add_argument(
         "--no-cuda", dest="cuda", action="store_false", help="enables CUDA training"
     )
     parser.add_argument("--synchronous", action="store_true")
+    parser.add_argument(
+        "--envs-per-worker",
+        type=int,
+        default=1,
+        help="how many envs each subprocess steps, one after the other",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="let the agent act for half of the envs while the other half steps",
+    )
     parser.add_argument(
         "--num-batch", type=int, help="number of batches for ppo", required=True
     )
@@ -0,0 +1,309 @@
+"""
+Reset and step throughput of the environments, without any model or logging
+in the loop:
+
+    python -m ppo.bench.throughput --env multi-step gridworld \
+        --world-size 6 10 --max-lines 10 30 --out bench.json
+    python -m ppo.bench.throughput --env multi-step --compare bench.json
+
+Results are written as JSON. With --compare, every config that is also in
+the baseline file is checked, and the command exits with status 1 if any
+rate dropped by more than --tolerance.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+from gym import spaces
+from rl_utils import hierarchical_parse_args
+
+from ppo.control_flow.lines import Subtask, If, Else, While, Line
+
+ENVS = ["control-flow", "multi-step", "one-line", "gridworld"]
+RATES = ["resets_per_sec", "steps_per_sec"]
+
+# the sweep dimensions that each environment depends on
+SWEEPS = {
+    "control-flow": ["max_lines", "max_nesting_depth", "lower_level"],
+    "multi-step": ["world_size", "max_lines", "max_nesting_depth", "lower_level"],
+    "one-line": ["world_size", "max_lines", "max_nesting_depth", "lower_level"],
+    "gridworld": ["world_size", "max_lines"],
+}
+
+
+def make_env(env, world_size, max_lines, max_nesting_depth, lower_level, seed):
+    if env == "gridworld":
+        from ppo.oh_et_al import GridWorld
+
+        gridworld = GridWorld(
+            text_map=[" " * world_size] * world_size,
+            min_objects=1,
+            n_obstacles=world_size // 2,
+            random_obstacles=True,
+            n_subtasks=max_lines,
+            interactions=["visit", "pick-up", "transform"],
+            max_task_count=2,
+            object_types=["pig", "sheep", "cat", "greenbot"],
+        )
+        gridworld.seed(seed)
+        return gridworld
+
+    args = dict(
+        min_eval_lines=1,
+        max_eval_lines=max_lines,
+        min_lines=1,
+        max_lines=max_lines,
+        flip_prob=0.5,
+        num_subtasks=12,
+        max_nesting_depth=max_nesting_depth,
+        eval_condition_size=False,
+        single_control_flow_type=False,
+        no_op_limit=30,
+        time_to_waste=0,
+        subtasks_only=False,
+        break_on_fail=False,
+        max_loops=3,
+        rank=0,
+        lower_level=lower_level,
+        control_flow_types=[Subtask, If, Else, While],
+        seed=seed,
+    )
+    if env == "control-flow":
+        import ppo.control_flow.env
+
+        return ppo.control_flow.env.Env(**args)
+
+    args.update(
+        temporal_extension=True,
+        term_on=["mine", "sell"],
+        max_world_resamples=50,
+        max_while_loops=10,
+        use_water=True,
+        max_failure_sample_prob=0.3,
+        one_condition=False,
+        failure_buffer_size=500,
+        reject_while_prob=0.6,
+        long_jump=False,
+        world_size=world_size,
+    )
+    if env == "one-line":
+        import ppo.control_flow.multi_step.one_line
+
+        return ppo.control_flow.multi_step.one_line.Env(**args)
+    import ppo.control_flow.multi_step.env
+
+    return ppo.control_flow.multi_step.env.Env(**args)
+
+
+def random_actions(action_space, random, n):
+    if isinstance(action_space, spaces.MultiDiscrete):
+        return random.randint(action_space.nvec, size=(n, len(action_space.nvec)))
+    return random.randint(action_space.n, size=n)
+
+
+def hardcoded_action(env, obs, action):
+    """
+    Points the upper-level part of a random `action` at the active subtask,
+    so that episodes progress through their programs. For the gridworld,
+    walks to the nearest object of the active subtask and interacts with it.
+    """
+    if hasattr(env, "subtask") and hasattr(env, "transitions"):
+        subtask = env.subtask
+        targets = [np.array(p) for p, o in env.objects.items() if o == subtask.object]
+        if not targets:
+            return action
+        offset = min(targets, key=lambda p: np.abs(p - env.pos).sum()) - env.pos
+        if not offset.any():
+            n_transitions = len(env.transitions)
+            return [0, n_transitions, n_transitions + 1][subtask.interaction]
+        i = int(np.abs(offset).argmax())
+        step = np.zeros(2, dtype=int)
+        step[i] = np.sign(offset[i])
+        return int(np.all(env.transitions == step, axis=-1).argmax())
+
+    action = np.array(action)
+    active = int(obs["active"])
+    if active >= len(obs["lines"]):
+        return action
+    line = obs["lines"][active]
+    if hasattr(env, "subtasks"):  # multi-step lines are [type, behavior, item, loop]
+        line_type, behavior, item, _ = line
+        if line_type == Line.types.index(Subtask):
+            behavior, item = env.behaviors[behavior - 1], env.items[item - 1]
+            action[0] = env.subtasks.index((behavior, item))
+    else:
+        line = env.possible_lines[line]
+        if type(line) is Subtask:
+            action[0] = line.id
+    return action
+
+
+def measure(env, actions, steps, resets, seed):
+    random = np.random.RandomState(seed)
+    env_time = 0
+
+    tick = time.perf_counter()
+    for _ in range(resets):
+        env.reset()
+    reset_time = time.perf_counter() - tick
+
+    episodes = 0
+    planned = random_actions(env.action_space, random, steps)
+    tick = time.perf_counter()
+    obs = env.reset()
+    env_time += time.perf_counter() - tick
+    for action in planned:
+        if actions == "hardcoded":
+            action = hardcoded_action(env.unwrapped, obs, action)
+        tick = time.perf_counter()
+        obs, _, done, _ = env.step(action)
+        if done:
+            obs = env.reset()
+        env_time += time.perf_counter() - tick
+        episodes += done
+    return dict(
+        resets_per_sec=resets / reset_time,
+        steps_per_sec=steps / env_time,
+        episodes=int(episodes),
+    )
+
+
+def configs(env, world_size, max_lines, max_nesting_depth, lower_level, actions):
+    sweep = dict(
+        world_size=world_size,
+        max_lines=max_lines,
+        max_nesting_depth=max_nesting_depth,
+        lower_level=lower_level,
+    )
+    seen = set()
+    for name in env:
+        for values in itertools.product(*sweep.values()):
+            config = dict(zip(sweep, values))
+            config = {k: v for k, v in config.items() if k in SWEEPS[name]}
+            for a in actions:
+                config.update(env=name, actions=a)
+                key = config_key(config)
+                if key not in seen:
+                    seen.add(key)
+                    yield dict(config)
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def run(config, steps, resets, seed):
+    defaults = dict(world_size=6, max_lines=10, max_nesting_depth=1)
+    env_args = {**defaults, "lower_level": "hardcoded", **config}
+    actions = env_args.pop("actions")
+    try:
+        env = make_env(**env_args, seed=seed)
+        result = measure(env, actions=actions, steps=steps, resets=resets, seed=seed)
+    except Exception as e:
+        traceback.print_exc()
+        result = dict(error=f"{type(e).__name__}: {e}")
+    return dict(config=config, **result)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Yields (config, rate, baseline rate, new rate) for every rate that fell
+    by more than `tolerance` (a fraction of the baseline rate).
+    """
+    baseline = {config_key(r["config"]): r for r in baseline["results"]}
+    for result in results:
+        old = baseline.get(config_key(result["config"]))
+        if old is None:
+            continue
+        for rate in RATES:
+            if rate not in old:
+                continue
+            new = result.get(rate, 0)
+            if new < (1 - tolerance) * old[rate]:
+                yield result["config"], rate, old[rate], new
+
+
+def main(
+    env,
+    world_size,
+    max_lines,
+    max_nesting_depth,
+    lower_level,
+    actions,
+    steps,
+    resets,
+    seed,
+    out,
+    compare_to,
+    tolerance,
+):
+    results = []
+    for config in configs(
+        env, world_size, max_lines, max_nesting_depth, lower_level, actions
+    ):
+        result = run(config, steps=steps, resets=resets, seed=seed)
+        rates = " ".join(f"{k}={result[k]:.0f}" for k in RATES if k in result)
+        print(config_key(config), rates or result["error"], file=sys.stderr)
+        results.append(result)
+    report = dict(
+        meta=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            machine=platform.machine(),
+            steps=steps,
+            resets=resets,
+            seed=seed,
+        ),
+        results=results,
+    )
+    if out is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with Path(out).open("w") as f:
+            json.dump(report, f, indent=2)
+
+    if compare_to is not None:
+        with Path(compare_to).open() as f:
+            baseline = json.load(f)
+        regressions = list(compare(results, baseline, tolerance))
+        for config, rate, old, new in regressions:
+            print(
+                f"REGRESSION {config_key(config)} {rate}: {old:.0f} -> {new:.0f}",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+def build_parser(parser):
+    parser.add_argument("--env", nargs="+", choices=ENVS, default=["multi-step"])
+    parser.add_argument("--world-size", nargs="+", type=int, default=[6])
+    parser.add_argument("--max-lines", nargs="+", type=int, default=[10])
+    parser.add_argument("--max-nesting-depth", nargs="+", type=int, default=[1])
+    parser.add_argument(
+        "--lower-level",
+        nargs="+",
+        choices=["train-alone", "train-with-upper", "hardcoded"],
+        default=["hardcoded"],
+    )
+    parser.add_argument(
+        "--actions", nargs="+", choices=["random", "hardcoded"], default=["random"]
+    )
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--resets", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--compare", dest="compare_to", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    build_parser(PARSER)
+    main(**hierarchical_parse_args(PARSER))
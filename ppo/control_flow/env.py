@@ -1,7 +1,6 @@
 import functools
 from abc import ABC
-from collections import defaultdict, namedtuple
-from typing import List, Tuple, Iterator
+from collections import namedtuple
 import numpy as np
 from gym.utils import seeding
 from gym.vector.utils import spaces
@@ -20,6 +19,8 @@ from ppo.control_flow.lines import (
     Loop,
     EndLoop,
 )
+from ppo.control_flow.program import Program, compile_program
+from ppo.control_flow.program_sampler import program_sampler
 
 Obs = namedtuple("Obs", "active lines obs")
 Last = namedtuple("Last", "action active reward terminal selected")
@@ -29,7 +30,99 @@ State = namedtuple(
 Action = namedtuple("Action", "upper lower delta dg ptr")
 
 
+class EnvState:
+    """
+    Everything that changes during an episode. `Env.step` advances it with
+    plain method calls, and it holds no generators or closures, so it can be
+    pickled along with the env.
+    """
+
+    __slots__ = (
+        "lines",
+        "program",
+        "obs",
+        "prev",
+        "ptr",
+        "term",
+        "subtask_complete",
+        "use_failure_buf",
+        "condition_evaluations",
+        "if_evaluations",
+        "loops",
+        "time_remaining",
+        # bookkeeping of `Env.step`
+        "done",
+        "success",
+        "reward",
+        "cumulative_reward",
+        "subtasks_complete",
+        "no_ops",
+        "actions",
+        "program_counter",
+        "action",
+        "lower_level_action",
+        "agent_ptr",
+    )
+
+    def __init__(self, lines, program, obs=None, use_failure_buf=False):
+        self.lines = lines
+        self.program = program
+        self.obs = obs
+        self.prev = 0
+        self.ptr = None
+        self.term = False
+        self.subtask_complete = False
+        self.use_failure_buf = use_failure_buf
+        self.condition_evaluations = []
+        self.if_evaluations = np.zeros(len(lines), dtype=bool)
+        self.loops = None
+        self.time_remaining = 0
+        self.done = False
+        self.success = False
+        self.reward = 0
+        self.cumulative_reward = 0
+        self.subtasks_complete = 0
+        self.no_ops = 0
+        self.actions = []
+        self.program_counter = []
+        self.action = None
+        self.lower_level_action = None
+        self.agent_ptr = 0
+
+
 class Env(gym.Env, ABC):
+    # observation keys that only change between episodes (see SubprocVecEnv)
+    static_keys = ("lines",)
+    # scalar info keys of every step and of the last step of an episode, which
+    # ShmemVecEnv sends through shared memory (see `info_keys`)
+    step_info_keys = (
+        "use_failure_buf",
+        "len_failure_buffer",
+        "successes_per_episode",
+        "feasibility_rejection_rate",
+        "program_rejection_rate",
+        "primitive_steps",
+        "regret",
+        "subtask_complete",
+    )
+    episode_info_keys = (
+        "success",
+        "cumulative_reward",
+        "instruction_len",
+        "success_line",
+        "progress",
+        "subtasks_complete",
+        "subtasks_attempted",
+    )
+    # array info items of the last step of an episode at `info_verbosity` 2,
+    # as (dtype, shape) that they are sent in, -1 for the episode length
+    info_payloads = dict(
+        instruction=(np.int16, (-1,)),
+        actions=(np.int16, (-1,)),
+        program_counter=(np.int16, (-1,)),
+    )
+    failure_buffer = ()
+
     def __init__(
         self,
         min_eval_lines,
@@ -49,8 +142,10 @@ class Env(gym.Env, ABC):
         rank,
         lower_level,
         control_flow_types,
+        uniform_programs=False,
         seed=0,
         evaluating=False,
+        info_verbosity=2,
     ):
         super().__init__()
         self.min_eval_lines = min_eval_lines
@@ -66,14 +161,15 @@ class Env(gym.Env, ABC):
         self.no_op_limit = no_op_limit
         self._eval_condition_size = eval_condition_size
         self.single_control_flow_type = single_control_flow_type
+        self.uniform_programs = uniform_programs
+        self.macro_step = False
         self.max_nesting_depth = max_nesting_depth
         self.num_subtasks = num_subtasks
         self.time_to_waste = time_to_waste
-        self.time_remaining = None
+        self.info_verbosity = info_verbosity
         self.i = 0
         self.success_count = 0
 
-        self.loops = None
         self.min_lines = min_lines
         self.max_lines = max_lines
         if evaluating:
@@ -81,13 +177,21 @@ class Env(gym.Env, ABC):
         else:
             self.n_lines = max_lines
         self.n_lines += 1
-        self.random, self.seed = seeding.np_random(seed)
+        self.random, self.random_seed = seeding.np_random(seed)
         self.flip_prob = flip_prob
         self.evaluating = evaluating
-        self.iterator = None
-        self._render = None
+        self.state = None  # type: EnvState
+        self.encoded_program = None
         self.action_space = spaces.MultiDiscrete(
-            np.array([self.num_subtasks + 1, 2 * self.n_lines, self.n_lines])
+            np.array(
+                Action(
+                    upper=self.num_subtasks + 1,
+                    lower=1,
+                    delta=2 * self.n_lines,
+                    dg=2,
+                    ptr=self.n_lines,
+                )
+            )
         )
 
         def possible_lines():
@@ -115,141 +219,184 @@ class Env(gym.Env, ABC):
         return [If, Else, EndIf, While, EndWhile, EndLoop, Subtask, Padding, Loop]
         # return list(Line.types)
 
+    @property
+    def static_version(self):
+        return self.i
+
+    @property
+    def info_keys(self):
+        """
+        Scalar info keys, including the program-length specific ones of
+        `line_specific_info`.
+        """
+        keys = self.step_info_keys + self.episode_info_keys
+        if self.info_verbosity < 1:
+            return keys
+        lengths = range(
+            min(self.min_lines, self.min_eval_lines),
+            max(self.max_lines, self.max_eval_lines) + 1,
+        )
+        decades = sorted({10 * (n // 10) for n in lengths})
+        return keys + tuple(f"{k}_{d}" for d in decades for k in keys)
+
+    def line_specific_info(self, info, n_lines):
+        """
+        At `info_verbosity` 1 and up, repeats the scalars of `info` under keys
+        suffixed with the decade of the program length `n_lines`.
+        """
+        if self.info_verbosity >= 1:
+            info.update(
+                {
+                    f"{k}_{10 * (n_lines // 10)}": v
+                    for k, v in info.items()
+                    if k not in self.info_payloads
+                }
+            )
+        return info
+
     def reset(self):
         self.i += 1
-        self.iterator = self.generator()
-        s, r, t, i = next(self.iterator)
+        self.state = self.initial_state()
+        s, r, t, i = self.outcome(info={})
         return s
 
     def step(self, action):
-        return self.iterator.send(action)
-
-    def generator(self):
-        step = 0
-        n = 0
-        state_iterator, lines = self.generators()
-        state = next(state_iterator)
-        actions = []
-        program_counter = []
-        condition_evaluations = []
-
-        subtasks_complete = 0
-        agent_ptr = 0
-        info = {}
-        term = False
-        action = None
-        lower_level_action = None
-        cumulative_reward = 0
-        while True:
-            if state.ptr is not None:
-                program_counter.append(state.ptr)
-            success = state.ptr is None
-            self.success_count += success
-
-            term = term or success or state.term
-            if self.lower_level == "train-alone":
-                reward = 1 if state.subtask_complete else 0
-            else:
-                reward = int(success)
-            cumulative_reward += reward
-            subtasks_complete += state.subtask_complete
-            if term:
-                if not success and self.break_on_fail:
-                    import ipdb
+        return self.outcome(self.apply_action(action))
+
+    def outcome(self, info):
+        """
+        Reward, termination and info for the current state (the `obs,
+        reward, done, info` returned by `reset` and `step`).
+        """
+        state = self.state
+        lines = state.lines
+        if state.ptr is not None:
+            state.program_counter.append(state.ptr)
+        success = state.ptr is None
+        self.success_count += success
+
+        state.done = state.done or success or state.term
+        if self.lower_level == "train-alone":
+            reward = 1 if state.subtask_complete else 0
+        else:
+            reward = int(success)
+        state.success, state.reward = success, reward
+        state.cumulative_reward += reward
+        state.subtasks_complete += state.subtask_complete
+        if state.done:
+            if not success and self.break_on_fail:
+                import ipdb
 
-                    ipdb.set_trace()
+                ipdb.set_trace()
 
+            if self.info_verbosity >= 2:
                 info.update(
                     instruction=[self.preprocess_line(l) for l in lines],
-                    actions=actions,
-                    program_counter=program_counter,
-                    success=success,
-                    cumulative_reward=cumulative_reward,
-                    instruction_len=len(lines),
+                    actions=state.actions,
+                    program_counter=state.program_counter,
                 )
-                if success:
-                    info.update(success_line=len(lines), progress=1)
-                else:
-                    info.update(
-                        success_line=state.prev, progress=state.prev / len(lines),
-                    )
-                subtasks_attempted = subtasks_complete + (not success)
+            info.update(
+                success=success,
+                cumulative_reward=state.cumulative_reward,
+                instruction_len=len(lines),
+            )
+            if success:
+                info.update(success_line=len(lines), progress=1)
+            else:
                 info.update(
-                    subtasks_complete=subtasks_complete,
-                    subtasks_attempted=subtasks_attempted,
+                    success_line=state.prev, progress=state.prev / len(lines),
                 )
-
+            subtasks_attempted = state.subtasks_complete + (not success)
             info.update(
-                regret=1 if term and not success else 0,
-                subtask_complete=state.subtask_complete,
-                condition_evaluations=state.condition_evaluations,
+                subtasks_complete=state.subtasks_complete,
+                subtasks_attempted=subtasks_attempted,
             )
 
-            def render():
-                if term:
-                    print(GREEN if success else RED)
-                indent = 0
-                for i, line in enumerate(lines):
-                    if i == state.ptr and i == agent_ptr:
-                        pre = "+ "
-                    elif i == agent_ptr:
-                        pre = "- "
-                    elif i == state.ptr:
-                        pre = "| "
-                    else:
-                        pre = "  "
-                    indent += line.depth_change[0]
-                    print(
-                        "{:2}{}{}{}".format(i, pre, " " * indent, self.line_str(line))
-                    )
-                    indent += line.depth_change[1]
-                if action is not None and action < len(self.subtasks):
-                    print("Selected:", self.subtasks[action], action)
-                print("Action:", action)
-                if lower_level_action is not None:
-                    print(
-                        "Lower Level Action:",
-                        self.lower_level_actions[lower_level_action],
-                    )
-                print("Reward", reward)
-                print("Cumulative", cumulative_reward)
-                print("Time remaining", self.time_remaining)
-                print("Obs:")
-                print(RESET)
-                self.print_obs(state.obs)
-
-            self._render = render
-            obs = self.get_observation(obs=state.obs, active=state.ptr, lines=lines)
-            line_specific_info = {
-                f"{k}_{10 * (len(lines) // 10)}": v for k, v in info.items()
-            }
-            action = (yield obs, reward, term, dict(**info, **line_specific_info))
-            if action.size == 1:
-                action = Action(upper=0, lower=action, delta=0, dg=0, ptr=0)
-            actions.extend([int(a) for a in action])
-            action = Action(*action)
-            action, lower_level_action, agent_ptr = (
-                int(action.upper),
-                int(action.lower),
-                int(action.ptr),
-            )
+        info.update(
+            regret=1 if state.done and not success else 0,
+            subtask_complete=state.subtask_complete,
+        )
 
-            info = dict(
-                use_failure_buf=state.use_failure_buf,
-                len_failure_buffer=len(self.failure_buffer),
-                successes_per_episode=self.success_count / self.i,
-            )
+        obs = self.get_observation(
+            obs=self.state_obs(state), active=state.ptr, lines=lines
+        )
+        return obs, reward, state.done, self.line_specific_info(info, len(lines))
+
+    def apply_action(self, action):
+        """
+        Counts no-ops and otherwise advances the state by one (or, in
+        macro-step mode, several) steps. Returns the info of the step.
+        """
+        state = self.state
+        if action.size == 1:
+            action = Action(upper=0, lower=action, delta=0, dg=0, ptr=0)
+        state.actions.extend([int(a) for a in action])
+        action = Action(*action)
+        state.action, state.lower_level_action, state.agent_ptr = (
+            int(action.upper),
+            int(action.lower),
+            int(action.ptr),
+        )
 
-            if action == self.num_subtasks:
-                n += 1
-                no_op_limit = 200 if self.evaluating else self.no_op_limit
-                if self.no_op_limit is not None and self.no_op_limit < 0:
-                    no_op_limit = len(lines)
-                if n >= no_op_limit:
-                    term = True
-            elif state.ptr is not None:
-                step += 1
-                state = state_iterator.send((action, lower_level_action))
+        info = dict(
+            use_failure_buf=state.use_failure_buf,
+            len_failure_buffer=len(self.failure_buffer),
+            successes_per_episode=self.success_count / self.i,
+            **self.rejection_rates(),
+        )
+
+        if state.action == self.num_subtasks:
+            state.no_ops += 1
+            no_op_limit = 200 if self.evaluating else self.no_op_limit
+            if self.no_op_limit is not None and self.no_op_limit < 0:
+                no_op_limit = len(state.lines)
+            if state.no_ops >= no_op_limit:
+                state.done = True
+        elif state.ptr is not None:
+            self.advance(state)
+            primitive_steps = 1
+            # in macro-step mode, one step runs the selected subtask until
+            # it completes or the episode terminates
+            while self.macro_step and not (
+                state.subtask_complete or state.term or state.ptr is None
+            ):
+                self.advance(state)
+                primitive_steps += 1
+            info.update(primitive_steps=primitive_steps)
+        return info
+
+    def _render(self):
+        state = self.state
+        if state.done:
+            print(GREEN if state.success else RED)
+        indent = 0
+        for i, line in enumerate(state.lines):
+            if i == state.ptr and i == state.agent_ptr:
+                pre = "+ "
+            elif i == state.agent_ptr:
+                pre = "- "
+            elif i == state.ptr:
+                pre = "| "
+            else:
+                pre = "  "
+            indent += line.depth_change[0]
+            print("{:2}{}{}{}".format(i, pre, " " * indent, self.line_str(line)))
+            indent += line.depth_change[1]
+        action = state.action
+        if action is not None and action < len(self.subtasks):
+            print("Selected:", self.subtasks[action], action)
+        print("Action:", action)
+        if state.lower_level_action is not None:
+            print(
+                "Lower Level Action:",
+                self.lower_level_actions[state.lower_level_action],
+            )
+        print("Reward", state.reward)
+        print("Cumulative", state.cumulative_reward)
+        print("Time remaining", state.time_remaining)
+        print("Obs:")
+        print(RESET)
+        self.print_obs(self.state_obs(state))
 
     @property
     def eval_condition_size(self):
@@ -272,16 +419,19 @@ class Env(gym.Env, ABC):
             line_types = self.control_flow_types
             if self.single_control_flow_type:
                 line_types = [self.random.choice(self.control_flow_types), Subtask]
-            lines = list(
-                Line.generate_types(
-                    n_lines,
-                    remaining_depth=self.max_nesting_depth,
-                    random=self.random,
-                    legal_lines=line_types,
-                )
-            )
+            lines = self.sample_line_types(n_lines, legal_lines=line_types)
         return lines
 
+    def sample_line_types(self, n_lines, legal_lines, accept=None, features=()):
+        sampler = program_sampler(
+            tuple(legal_lines),
+            max(self.max_lines, self.max_eval_lines),
+            self.max_nesting_depth,
+            uniform=self.uniform_programs,
+            features=tuple(features),
+        )
+        return sampler.sample(n_lines, self.random, accept=accept)
+
     def assign_line_ids(self, lines):
         for line in lines:
             if line is Subtask:
@@ -291,106 +441,73 @@ class Env(gym.Env, ABC):
             else:
                 yield line(0)
 
-    def line_generator(self, lines):
-        line_transitions = defaultdict(list)
-        for _from, _to in self.get_transitions(lines):
-            line_transitions[_from].append(_to)
-        i = 0
-        if_evaluations = []
-        while True:
-            condition_bit = yield None if i >= len(lines) else i
-            if type(lines[i]) is Else:
-                evaluation = not if_evaluations.pop()
+    def rejection_rates(self):
+        return {}
+
+    def compile(self, lines) -> Program:
+        return compile_program(tuple(lines), self.preprocess_line)
+
+    def initial_state(self) -> EnvState:
+        lines = list(self.assign_line_ids(self.choose_line_types()))
+        condition_bit = 0 if self.eval_condition_size else self.random.choice(2)
+        state = EnvState(lines, self.compile(lines), obs=condition_bit)
+        state.time_remaining = self.time_to_waste
+        state.ptr = self.next_subtask(state, None)
+        return state
+
+    def next_subtask(self, state, l):
+        """
+        Advances the program from line `l` (from the start if None) to the
+        next subtask. Returns None once the program is complete.
+        """
+        lines, program = state.lines, state.program
+        if l is None:
+            l = program.start
+        else:
+            l = program.next(l, state.obs, state.if_evaluations)
+        while not (l is None or type(lines[l]) is Subtask):
+            line = lines[l]
+            if type(line) is Loop:
+                if state.loops is None:
+                    state.loops = line.id
+                else:
+                    state.loops -= 1
+                l = program.next(l, state.loops > 0, state.if_evaluations)
+                if state.loops == 0:
+                    state.loops = None
             else:
-                evaluation = bool(condition_bit)
-            if type(lines[i]) is If:
-                if_evaluations.append(evaluation)
-            i = line_transitions[i][evaluation]
+                l = program.next(l, state.obs, state.if_evaluations)
+        state.time_remaining += 1
+        return l
+
+    def advance(self, state):
+        """
+        Applies `state.action` to the current subtask.
+        """
+        if not state.time_remaining or state.action != state.lines[state.ptr].id:
+            state.term = True
+        else:
+            state.time_remaining -= 1
+            state.obs = abs(state.obs - int(self.random.rand() < self.flip_prob))
+            state.prev, state.ptr = state.ptr, self.next_subtask(state, state.ptr)
 
     @staticmethod
-    def get_transitions(lines):
-        conditions = []
-        for i, line in enumerate(lines):
-            yield from line.transitions(i, conditions)
-
-    def generators(self) -> Tuple[Iterator[State], List[Line]]:
-        line_types = self.choose_line_types()
-
-        def line_generator():
-            for line_type in line_types:
-                if line_type is Subtask:
-                    line_id = self.random.choice(self.num_subtasks)
-                elif line_type is Loop:
-                    line_id = self.random.randint(1, 1 + self.max_loops)
-                else:
-                    line_id = 0
-                yield line_type(line_id)
-
-        lines = list(line_generator())  # type List[Line]
-        line_transitions = defaultdict(list)
-        for _from, _to in self.get_transitions(lines):
-            line_transitions[_from].append(_to)
-
-        def line_generator():
-            i = 0
-            if_evaluations = []
-            while True:
-                condition_bit = yield None if i >= len(lines) else i
-                if type(lines[i]) is Else:
-                    evaluation = not if_evaluations.pop()
-                else:
-                    evaluation = bool(condition_bit)
-                if type(lines[i]) is If:
-                    if_evaluations.append(evaluation)
-                i = line_transitions[i][evaluation]
-
-        def state_generator():
-            line_iterator = line_generator()
-            condition_bit = 0 if self.eval_condition_size else self.random.choice(2)
-            self.time_remaining = self.time_to_waste
-            self.loops = None
-
-            def next_subtask(msg=condition_bit):
-                l = line_iterator.send(msg)
-                while not (l is None or type(lines[l]) is Subtask):
-                    line = lines[l]
-                    if type(line) is Loop:
-                        if self.loops is None:
-                            self.loops = line.id
-                        else:
-                            self.loops -= 1
-                        l = line_iterator.send(self.loops > 0)
-                        if self.loops == 0:
-                            self.loops = None
-                    else:
-                        l = line_iterator.send(condition_bit)
-                self.time_remaining += 1
-                return l
-
-            prev, ptr = 0, next_subtask(None)
-            term = False
-            while True:
-                action = yield State(obs=condition_bit, prev=prev, ptr=ptr, term=term)
-                if not self.time_remaining or action != lines[ptr].id:
-                    term = True
-                else:
-                    self.time_remaining -= 1
-                    condition_bit = abs(
-                        condition_bit - int(self.random.rand() < self.flip_prob)
-                    )
-                    prev, ptr = ptr, next_subtask()
-
-        return state_generator(), lines
+    def state_obs(state):
+        return state.obs
 
     @functools.lru_cache(maxsize=120)
     def preprocess_line(self, line):
         return self.possible_lines.index(line)
 
     def get_observation(self, obs, active, lines):
-        padded = lines + [Padding(0)] * (self.n_lines - len(lines))
-        lines = [self.preprocess_line(p) for p in padded]
+        # the program is encoded once per episode
+        if self.encoded_program is None or self.encoded_program[0] is not lines:
+            padded = lines + [Padding(0)] * (self.n_lines - len(lines))
+            self.encoded_program = lines, [self.preprocess_line(p) for p in padded]
         obs = Obs(
-            obs=obs, lines=lines, active=self.n_lines if active is None else active
+            obs=obs,
+            lines=self.encoded_program[1],
+            active=self.n_lines if active is None else active,
         )._asdict()
         # if not self.observation_space.contains(obs):
         #     import ipdb
@@ -404,7 +521,11 @@ class Env(gym.Env, ABC):
         print(obs)
 
     def seed(self, seed=None):
-        assert self.seed == seed
+        """
+        Restarts the env's random stream as if it had been made with `seed`.
+        """
+        self.random, self.random_seed = seeding.np_random(seed)
+        return [self.random_seed]
 
     def render(self, mode="human", pause=True):
         self._render()
@@ -437,9 +558,18 @@ def build_parser(
     p.add_argument("--flip-prob", type=float, default=0.5)
     p.add_argument("--eval-condition-size", action="store_true")
     p.add_argument("--single-control-flow-type", action="store_true")
+    p.add_argument("--uniform-programs", action="store_true")
     p.add_argument("--max-nesting-depth", type=int, default=1)
     p.add_argument("--subtasks-only", action="store_true")
     p.add_argument("--no-break-on-fail", dest="break_on_fail", action="store_false")
+    p.add_argument(
+        "--info-verbosity",
+        type=int,
+        choices=[0, 1, 2],
+        default=2,
+        help="0: scalar infos only, 1: also per program length, "
+        "2: also the programs, actions and pointers of episodes",
+    )
     p.add_argument(
         "--time-to-waste",
         type=int,
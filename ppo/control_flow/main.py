@@ -5,6 +5,7 @@ import numpy as np
 from gym import spaces
 from rl_utils import hierarchical_parse_args
 
+from common.vec_env.shmem_vec_env import InfoBatch, info_items
 import ppo.agent
 import ppo.control_flow.agent
 import ppo.control_flow.env
@@ -13,6 +14,9 @@ import ppo.control_flow.multi_step.minimal_gru
 import ppo.control_flow.multi_step.one_line
 from ppo import control_flow
 from ppo.arguments import build_parser
+from ppo.control_flow.multi_step.batched_env import BatchedEnv
+from ppo.control_flow.multi_step.eval_suite import EvalSuite
+from ppo.control_flow.tensor_env import TensorEnv
 from ppo.train import Train
 
 NAMES = ["instruction", "actions", "program_counter", "evaluations"]
@@ -27,10 +31,13 @@ def main(
     lower_level,
     lower_level_load_path,
     render,
+    num_processes,
     **kwargs,
 ):
     if lower_level_load_path:
         lower_level = "pre-trained"
+    if one_line and kwargs["env_args"]["batched_env"]:
+        raise ValueError("--batched-env does not support --one-line")
 
     class _Train(Train):
         def build_agent(self, envs, debug=False, **agent_args):
@@ -73,27 +80,47 @@ def main(
             args["break_on_fail"] = args["break_on_fail"] and render
             del args["time_limit"]
             if one_line:
-                return control_flow.multi_step.one_line.Env(**args)
+                return control_flow.multi_step.one_line.Env(
+                    **args, num_ranks=num_processes
+                )
             elif not gridworld:
-                del args["max_while_objects"]
-                del args["num_excluded_objects"]
-                del args["temporal_extension"]
-                return control_flow.env.Env(**args)
+                # the env args also hold the arguments of the multi-step env
+                params = inspect.signature(control_flow.env.Env).parameters
+                return control_flow.env.Env(
+                    **{k: v for k, v in args.items() if k in params}
+                )
             else:
-                return control_flow.multi_step.env.Env(**args)
+                return control_flow.multi_step.env.Env(**args, num_ranks=num_processes)
+
+        @staticmethod
+        def eval_version(env_args):
+            if env_args.get("eval_suite") is None:
+                return None
+            return EvalSuite.read_version(env_args["eval_suite"])
+
+        @staticmethod
+        def episode_bucket(info):
+            return control_flow.multi_step.env.Env.curriculum_bucket(info)
+
+        @staticmethod
+        def make_batched_env(env_fns, gridworld, **env_args):
+            if gridworld:
+                return BatchedEnv(env_fns)
+            return TensorEnv(env_fns)
 
         def process_infos(self, episode_counter, done, infos, **act_log):
-            for d in infos:
-                for k, v in d.items():
-                    if k.startswith("cumulative_reward"):
-                        episode_counter[k].append(v)
+            for k, v in info_items(infos):
+                if k.startswith("cumulative_reward"):
+                    episode_counter[k] += v if type(v) is list else [v]
             if lower_level != "train-alone":
                 P = act_log.pop("P")
                 P = P[done]
                 if P.size(0) > 0:
                     P = P.cpu().numpy()
                     episode_counter["P"] += np.split(P, P.shape[0])
-                for d in infos:
+                # NAMES are payloads, which an InfoBatch keeps apart from scalars
+                payloads = infos.payloads if isinstance(infos, InfoBatch) else infos
+                for d in payloads:
                     for name in NAMES:
                         if name in d:
                             episode_counter[name].append(d.pop(name))
@@ -113,12 +140,14 @@ def main(
                     result["subtask_success"] = (
                         sum(result["subtasks_complete"]) / subtasks_attempted
                     )
-            try:
-                result["condition_evaluations"] = sum(
-                    result["condition_evaluations"]
-                ) / len(result["condition_evaluations"])
-            except (KeyError, ZeroDivisionError):
-                pass
+            if "conditions_evaluated" in result:
+                # fraction of If/While conditions that held, over all the
+                # conditions evaluated in the episodes of this update
+                conditions_evaluated = sum(result["conditions_evaluated"])
+                if conditions_evaluated > 0:
+                    result["condition_evaluations"] = (
+                        sum(result["conditions_true"]) / conditions_evaluated
+                    )
             if lower_level != "train-alone":
                 names = NAMES + ["P"]
                 for name in names + ["eval_" + n for n in names]:
@@ -136,7 +165,14 @@ def main(
 
             super().log_result(result)
 
-    _Train(**kwargs, seed=seed, log_dir=log_dir, render=render, time_limit=None).run()
+    _Train(
+        **kwargs,
+        seed=seed,
+        log_dir=log_dir,
+        render=render,
+        num_processes=num_processes,
+        time_limit=None,
+    ).run()
 
 
 def control_flow_args():
@@ -154,6 +190,7 @@ def control_flow_args():
     )
     parser.add_argument("--lower-level-load-path")
     parsers.env.add_argument("--gridworld", action="store_true")
+    parsers.env.add_argument("--batched-env", action="store_true")
     ppo.control_flow.multi_step.env.build_parser(parsers.env)
     parsers.agent.add_argument("--lower-level-config", type=Path)
     parsers.agent.add_argument("--no-debug", dest="debug", action="store_false")
@@ -10,7 +10,6 @@ from ppo.utils import init_
 
 class Recurrence:
     def __init__(self):
-        d, h, _ = self.obs_spaces.obs.shape
         ones = torch.ones(1, dtype=torch.long)
         self.register_buffer("ones", ones)
         line_nvec = torch.tensor(self.obs_spaces.lines.nvec[0, :-1])
@@ -0,0 +1,555 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from common.vec_env import VecEnv
+from ppo.control_flow.env import Action
+from ppo.control_flow.lines import Subtask, Padding
+from ppo.control_flow.multi_step.env import Env
+from ppo.control_flow.multi_step.eval_suite import kind_code
+from ppo.control_flow.program import Programs, SUBTASK, LOOP, WHILE, IF
+from ppo.djikstra import grid_distances, grid_moves
+
+# kinds of lower-level action
+MINE, SELL, GOTO, MOVE, NONE = range(5)
+
+
+class BatchedEnv(VecEnv):
+    """
+    Steps N copies of `multi_step.env.Env` in a single process. The world of
+    each copy lives in a shared int8 grid of shape [N, C, H, W] together with
+    agent positions [N, 2], inventories [N, 3] and program pointers [N], so
+    that mine/sell/goto/move/bridge are applied to all worlds at once. The
+    wrapped `Env` instances are only used to sample tasks on reset (and to
+    hold the failure buffer), so sampling semantics are unchanged.
+    """
+
+    def __init__(self, env_fns):
+        self.envs = [fn() for fn in env_fns]
+        env = self.envs[0]
+        assert all(isinstance(e, Env) for e in self.envs)
+        VecEnv.__init__(self, len(self.envs), env.observation_space, env.action_space)
+        self.specs = [e.spec for e in self.envs]
+        self.env = env
+        N = self.num_envs
+        C, H, W = env.world_shape
+        n_lines = env.n_lines
+        self.agent_channel = Env.world_contents.index(Env.agent)
+        self.wood = Env.world_contents.index(Env.wood)
+        self.merchant = Env.world_contents.index(Env.merchant)
+        self.wall = Env.world_contents.index(Env.wall)
+        self.water = Env.world_contents.index(Env.water)
+        self.hardcoded = env.lower_level == "hardcoded"
+        self.train_alone = env.lower_level == "train-alone"
+        self.macro_step = env.macro_step
+        self.term_on = np.array([b in env.term_on for b in Env.behaviors])
+
+        # lookup tables
+        self.subtask_behavior = np.array(
+            [Env.behaviors.index(b) for b, _ in env.subtasks] + [NONE]
+        )
+        self.subtask_item = np.array(
+            [Env.items.index(i) for _, i in env.subtasks] + [0]
+        )
+        self.lower_kind = np.array(
+            [
+                Env.behaviors.index(a) if type(a) is str else MOVE
+                for a in env.lower_level_actions
+            ]
+        )
+        self.lower_move = np.array(
+            [[0, 0] if type(a) is str else a for a in env.lower_level_actions]
+        )
+
+        # world state
+        self.grid = np.zeros((N, C, H, W), dtype=np.int8)
+        self.agent_pos = np.zeros((N, 2), dtype=int)
+        self.inventory = np.zeros((N, len(Env.items)), dtype=np.int8)
+        # objects per channel below the agent's, kept up to date by mine/bridge
+        self.counts = np.zeros((N, self.agent_channel), dtype=int)
+        self.ptr = np.zeros(N, dtype=int)  # -1 means the program is complete
+        self.prev = np.zeros(N, dtype=int)
+
+        # distance fields toward every item and the merchant (hardcoded only)
+        self.fields = self.hardcoded and env.temporal_extension
+        self.distances = np.zeros((N, self.merchant + 1, H, W))
+        self.moves = np.zeros((N, self.merchant + 1, H, W, 2), dtype=int)
+
+        # program state
+        self.encoded_lines = np.zeros((N, n_lines, 4), dtype=int)
+        self.line_behavior = np.zeros((N, n_lines), dtype=int)
+        self.line_item = np.zeros((N, n_lines), dtype=int)
+        self.programs = Programs(N, n_lines, ids_shape=(4,))
+        self.if_evaluations = np.zeros((N, n_lines + 1), dtype=bool)
+        self.no_op_limit = np.zeros(N, dtype=int)
+        self.lines = [None] * N
+        self.loops = np.zeros(N, dtype=int)  # -1 means no loop is active
+        self.whiles = np.zeros(N, dtype=int)
+        self.initial = [None] * N
+        self.world_sizes = [None] * N  # None for tasks decoded from a snapshot
+
+        # episode statistics
+        self.time_remaining = np.zeros(N, dtype=int)
+        self.no_ops = np.zeros(N, dtype=int)
+        self.cumulative_reward = np.zeros(N)
+        self.subtasks_complete = np.zeros(N, dtype=int)
+        self.subtask_complete = np.zeros(N, dtype=bool)
+        self.use_failure_buf = np.zeros(N, dtype=bool)
+        self.condition_evaluations = [None] * N
+        self.actions = [None] * N
+        self.program_counter = [None] * N
+        self._actions = None
+
+    def reset_world(self, i):
+        env = self.envs[i]
+        env.i += 1
+        lines, objects, agent_pos, use_failure_buf, world_size = env.sample_task()
+        self.initial[i] = env.snapshot_task(lines, objects, agent_pos)
+        self.world_sizes[i] = world_size
+        self.grid[i] = 0
+        for p, o in objects.items():
+            self.grid[(i, Env.world_contents.index(o), *p)] = 1
+        self.agent_pos[i] = agent_pos
+        self.grid[(i, self.agent_channel, *self.agent_pos[i])] = 1
+        self.counts[i] = self.grid[i, : self.agent_channel].sum(axis=(-1, -2))
+        self.inventory[i] = 0
+        if self.fields:
+            self.update_fields(np.array([i]))
+
+        padded = lines + [Padding(0)] * (env.n_lines - len(lines))
+        self.encoded_lines[i] = [Env.preprocess_line(l) for l in padded]
+        self.line_behavior[i] = NONE
+        self.line_item[i] = 0
+        for j, line in enumerate(lines):
+            if type(line) is Subtask:
+                behavior, item = line.id
+                self.line_behavior[i, j] = Env.behaviors.index(behavior)
+                self.line_item[i, j] = Env.items.index(item)
+        self.lines[i] = lines
+        self.programs[i] = env.compile(lines)
+        self.if_evaluations[i] = False
+        no_op_limit = 200 if env.evaluating else env.no_op_limit
+        if env.no_op_limit is not None and env.no_op_limit < 0:
+            no_op_limit = len(lines)
+        self.no_op_limit[i] = no_op_limit
+        self.loops[i] = -1
+        self.whiles[i] = 0
+
+        if env.lower_level == "train-alone":
+            self.time_remaining[i] = 0
+        else:
+            self.time_remaining[i] = 200 if env.evaluating else env.time_to_waste
+        self.no_ops[i] = 0
+        self.cumulative_reward[i] = 0
+        self.subtasks_complete[i] = 0
+        self.subtask_complete[i] = False
+        self.use_failure_buf[i] = use_failure_buf
+        self.condition_evaluations[i] = []
+        self.actions[i] = []
+        self.prev[i] = 0
+        self.ptr[i] = 0
+        self.next_subtask(np.array([i]), start=True)
+        success = self.ptr[i] < 0
+        env.success_count += success
+        if not self.train_alone:
+            self.cumulative_reward[i] = success
+        self.program_counter[i] = [] if success else [int(self.ptr[i])]
+
+    def next_subtask(self, idx, start=False):
+        """
+        Advances the pointers of the worlds in `idx` to their next subtask
+        (-1 once the program is complete), evaluating loops and conditions of
+        all worlds at once.
+        """
+        env = self.env
+        programs = self.programs
+        ptr = self.ptr[idx]
+        if start:
+            pending = ~self.stopped(idx, ptr)
+        else:
+            pending = np.ones(len(idx), dtype=bool)
+        while pending.any():
+            rows, l = idx[pending], ptr[pending]
+            t = programs.types[rows, l]
+            ids = programs.ids[rows, l]
+
+            loop = t == LOOP
+            loops = self.loops[rows[loop]]
+            self.loops[rows[loop]] = np.where(loops < 0, ids[loop, 3], loops - 1)
+            is_while = t == WHILE
+            self.whiles[rows[is_while]] += 1
+            exceeded = is_while & (self.whiles[rows] > env.max_while_loops)
+            ptr[np.flatnonzero(pending)[exceeded]] = -1
+
+            evaluation = np.zeros(len(rows), dtype=bool)
+            evaluation[loop] = self.loops[rows[loop]] > 0
+            condition = ((t == IF) | is_while) & ~exceeded
+            if condition.any():
+                counts = self.counts[rows[condition]]
+                item = ids[condition, 2]
+                R = np.arange(len(item))
+                evaluation[condition] = (
+                    counts[R, env.condition_lhs[item]]
+                    > counts[R, env.condition_rhs[item]]
+                )
+                for i, e in zip(rows[condition], evaluation[condition]):
+                    self.condition_evaluations[i].append(bool(e))
+
+            advance = ~exceeded
+            rows, l = rows[advance], l[advance]
+            l = programs.next(rows, l, evaluation[advance], self.if_evaluations)
+            self.loops[rows[self.loops[rows] == 0]] = -1
+            ptr[np.flatnonzero(pending)[advance]] = l
+            pending[pending] = advance
+            pending[pending] = ~self.stopped(idx[pending], ptr[pending])
+
+        complete = self.programs.terminal(idx, ptr) | (ptr < 0)
+        ptr[complete] = -1
+        self.ptr[idx] = ptr
+        time_delta = 3 * env.world_size
+        if self.train_alone:
+            self.time_remaining[idx[~complete]] = time_delta + env.time_to_waste
+        else:
+            self.time_remaining[idx[~complete]] += time_delta
+
+    def stopped(self, idx, ptr):
+        terminal = self.programs.terminal(idx, ptr)
+        return terminal | (self.programs.types[idx, ptr] == SUBTASK)
+
+    def update_fields(self, idx):
+        """
+        Recomputes the distance fields of the worlds in `idx` in one batched
+        search.
+        """
+        passable = self.grid[idx, self.wall] == 0
+        distances = grid_distances(
+            self.grid[idx, : self.merchant + 1] == 1, passable[:, None]
+        )
+        self.distances[idx] = distances
+        self.moves[idx] = grid_moves(distances)
+
+    def hardcoded_actions(self, idx, interaction, resource):
+        """
+        Vectorized version of `Env.get_lower_level_action`.
+        """
+        target = np.where(interaction == SELL, self.merchant, resource)
+        i, j = self.agent_pos[idx].T
+        kind = np.full(len(idx), NONE)
+        move = np.zeros((len(idx), 2), dtype=int)
+        on_target = self.grid[idx, target, i, j] == 1
+        kind[on_target] = interaction[on_target]
+        channels = self.grid[idx, target]  # type: np.ndarray
+        present = channels.any(axis=(-1, -2))
+        search = present & ~on_target
+        if self.fields:
+            reachable = search & (self.distances[idx, target, i, j] < np.inf)
+            kind[reachable] = MOVE
+            move[reachable] = self.moves[idx, target, i, j][reachable]
+            search &= ~reachable
+        if search.any():
+            H, W = channels.shape[-2:]
+            I, J = np.meshgrid(np.arange(H), np.arange(W), indexing="ij")
+            distance = np.maximum(
+                np.abs(I[None] - i[search, None, None]),
+                np.abs(J[None] - j[search, None, None]),
+            )
+            distance = np.where(channels[search] == 1, distance, H * W)
+            nearest = distance.reshape(search.sum(), -1).argmin(-1)
+            nearest = np.stack(np.unravel_index(nearest, (H, W)), axis=-1)
+            kind[search] = MOVE
+            move[search] = nearest - self.agent_pos[idx][search]
+        return kind, move
+
+    def apply_actions(self, idx, upper, lower):
+        """
+        Applies mine/sell/goto/move/bridge to the worlds in `idx`.
+        Returns the termination flags and the worlds whose subtask is complete.
+        """
+        env = self.env
+        R = np.arange(len(idx))
+        interaction = self.subtask_behavior[upper]
+        resource = self.subtask_item[upper]
+        if self.hardcoded:
+            kind, move = self.hardcoded_actions(idx, interaction, resource)
+        else:
+            kind, move = self.lower_kind[lower], self.lower_move[lower]
+        self.time_remaining[idx] -= 1
+
+        ptr = self.ptr[idx]
+        tgt_interaction = self.line_behavior[idx, ptr]
+        tgt_obj = self.line_item[idx, ptr]
+        counts = self.counts[idx]
+        inventory = self.inventory[idx]
+        term = (counts[R, tgt_obj] == 0) & (
+            (tgt_interaction != SELL) | (inventory[R, tgt_obj] == 0)
+        )
+
+        # what the agent is standing on
+        i, j = self.agent_pos[idx].T
+        cell = self.grid[idx, : self.agent_channel, i, j]
+        standing_on = np.where(cell.any(-1), cell.argmax(-1), -1)
+        objective = np.where(tgt_interaction == SELL, self.merchant, tgt_obj)
+        done = (kind == tgt_interaction) & (standing_on == objective)
+
+        # mine
+        mine = (kind == MINE) & (standing_on >= 0)
+        expected = (
+            done
+            | ((tgt_interaction == SELL) & (standing_on == tgt_obj))
+            | (standing_on == self.wood)
+        )
+        term |= mine & ~expected & self.term_on[MINE]
+        pick_up = mine & (standing_on < len(Env.items))
+        pick_up[pick_up] &= inventory[pick_up, standing_on[pick_up]] == 0
+        self.inventory[idx[pick_up], standing_on[pick_up]] = 1
+        self.grid[idx[mine], standing_on[mine], i[mine], j[mine]] = 0
+        self.counts[idx[mine], standing_on[mine]] -= 1
+        if self.fields:
+            patch = mine & ((standing_on <= self.merchant) | (standing_on == self.wall))
+            if patch.any():
+                self.update_fields(idx[patch])
+
+        # sell
+        sell = kind == SELL
+        if not self.hardcoded:
+            done &= ~sell | (inventory[R, tgt_obj] > 0)
+        sold = sell & done
+        self.inventory[idx[sold], tgt_obj[sold]] -= 1
+        term |= sell & ~done & self.term_on[SELL]
+
+        # goto
+        term |= (kind == GOTO) & ~done & self.term_on[GOTO]
+
+        # move
+        moving = kind == MOVE
+        if moving.any():
+            if env.temporal_extension:
+                move = np.clip(move, -1, 1)
+            new_pos = self.agent_pos[idx] + move
+            H, W = self.grid.shape[-2:]
+            in_bounds = np.all((0 <= new_pos) & (new_pos < [H, W]), axis=-1)
+            moving &= in_bounds
+            ni, nj = np.where(moving[:, None], new_pos, 0).T
+            wall = self.grid[idx, self.wall, ni, nj] == 1
+            water = self.grid[idx, self.water, ni, nj] == 1
+            if not self.hardcoded:
+                moving &= ~wall & (~water | (self.inventory[idx, self.wood] > 0))
+            m = idx[moving]
+            self.grid[m, self.agent_channel, i[moving], j[moving]] = 0
+            self.grid[m, self.agent_channel, ni[moving], nj[moving]] = 1
+            self.agent_pos[m] = new_pos[moving]
+            bridge = moving & water
+            b = idx[bridge]
+            self.grid[b, self.water, ni[bridge], nj[bridge]] = 0
+            self.counts[b, self.water] -= 1
+            self.inventory[b, self.wood] -= 1
+
+        completed = done & (kind < MOVE)
+        return term, completed
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions)
+
+    def step_wait(self):
+        actions = self._actions.astype(int)
+        if actions.ndim == 1:
+            actions = np.stack(
+                Action(
+                    upper=np.zeros_like(actions),
+                    lower=actions,
+                    delta=np.zeros_like(actions),
+                    dg=np.zeros_like(actions),
+                    ptr=np.zeros_like(actions),
+                ),
+                axis=-1,
+            )
+        infos = []
+        for i, action in enumerate(actions):
+            self.actions[i].extend(action.tolist())
+            env = self.envs[i]
+            infos.append(
+                dict(
+                    use_failure_buf=self.use_failure_buf[i],
+                    len_failure_buffer=len(env.failure_buffer),
+                    successes_per_episode=env.success_count / env.i,
+                    **env.rejection_rates(),
+                )
+            )
+        action = Action(*actions.T)
+        N = self.num_envs
+        term = np.zeros(N, dtype=bool)
+
+        # no-ops
+        no_op = action.upper == self.env.num_subtasks
+        self.no_ops += no_op
+        term |= no_op & (self.no_ops >= self.no_op_limit)
+
+        # world dynamics
+        active = ~no_op & (self.ptr >= 0)
+        idx = np.flatnonzero(active)
+        self.subtask_complete[idx] = False
+        primitive_steps = np.zeros(N, dtype=int)
+        while len(idx):
+            state_term, completed = self.apply_actions(
+                idx, action.upper[idx], action.lower[idx]
+            )
+            primitive_steps[idx] += 1
+            self.prev[idx[completed]] = self.ptr[idx[completed]]
+            self.next_subtask(idx[completed])
+            self.subtask_complete[idx[completed]] = True
+            state_term |= self.time_remaining[idx] == 0
+            for i in idx[state_term & (self.ptr[idx] >= 0)]:
+                self.envs[i].failure_buffer.append(self.initial[i])
+            term[idx] |= state_term
+            if not self.macro_step:
+                break
+            # keep running the subtasks that are still in progress
+            idx = idx[~state_term & ~completed]
+
+        success = self.ptr < 0
+        term |= success
+        if self.train_alone:
+            reward = self.subtask_complete.astype(float)
+        else:
+            reward = success.astype(float)
+        self.cumulative_reward += reward
+        self.subtasks_complete += self.subtask_complete
+
+        for i, info in enumerate(infos):
+            self.envs[i].success_count += success[i]
+            if not success[i]:
+                self.program_counter[i].append(int(self.ptr[i]))
+            if active[i]:
+                info.update(primitive_steps=int(primitive_steps[i]))
+            infos[i] = self.info(info, i, success[i], term[i])
+        obs = self.observation()
+        for i in np.flatnonzero(term):
+            self.reset_world(i)
+            self.write_observation(obs, i)
+        return obs, reward, term, infos
+
+    def info(self, info, i, success, term):
+        env = self.envs[i]
+        lines = self.lines[i]
+        if term:
+            if env.info_verbosity >= 2:
+                info.update(
+                    instruction=[env.preprocess_line(l) for l in lines],
+                    actions=self.actions[i],
+                    program_counter=self.program_counter[i],
+                )
+            info.update(
+                success=success,
+                cumulative_reward=self.cumulative_reward[i],
+                instruction_len=len(lines),
+            )
+            if success:
+                info.update(success_line=len(lines), progress=1)
+            else:
+                info.update(
+                    success_line=self.prev[i], progress=self.prev[i] / len(lines)
+                )
+            info.update(
+                subtasks_complete=self.subtasks_complete[i],
+                subtasks_attempted=self.subtasks_complete[i] + (not success),
+            )
+        info.update(
+            regret=1 if term and not success else 0,
+            subtask_complete=self.subtask_complete[i],
+        )
+        info = env.line_specific_info(info, len(lines))
+        if term:
+            info.update(
+                control_flow=kind_code({type(l) for l in lines}),
+                conditions_evaluated=len(self.condition_evaluations[i]),
+                conditions_true=sum(self.condition_evaluations[i]),
+            )
+            if self.world_sizes[i] is not None:
+                info.update(world_size=self.world_sizes[i])
+        return info
+
+    def observation(self):
+        return OrderedDict(
+            active=np.where(self.ptr < 0, self.env.n_lines, self.ptr),
+            lines=self.encoded_lines.copy(),
+            obs=self.env.world_obs(self.grid),
+            inventory=self.inventory.copy(),
+        )
+
+    def write_observation(self, obs, i):
+        obs["active"][i] = self.env.n_lines if self.ptr[i] < 0 else self.ptr[i]
+        obs["lines"][i] = self.encoded_lines[i]
+        obs["obs"][i] = self.env.world_obs(self.grid[i : i + 1])[0]
+        obs["inventory"][i] = self.inventory[i]
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_world(i)
+        return self.observation()
+
+    def render(self, mode="human"):
+        for i, line in enumerate(self.lines[0]):
+            pre = "| " if i == self.ptr[0] else "  "
+            print("{:2}{}{}".format(i, pre, self.env.line_str(line)))
+        print("Time remaining", self.time_remaining[0])
+        self.env.print_obs((self.grid[0], self.inventory[0]))
+
+    def evaluate(self):
+        for env in self.envs:
+            env.evaluate()
+
+    def train(self):
+        for env in self.envs:
+            try:
+                env.train()
+            except AttributeError:
+                print("Attribute train undefined")
+
+    def set_curriculum(self, weights):
+        for env in self.envs:
+            env.set_curriculum(weights)
+
+    def seed(self, seeds):
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
+
+    def close_extras(self):
+        pass
+
+
+def check(env_fn, num_envs, num_steps, seed=0):
+    """
+    Steps `Env` and `BatchedEnv` side by side on the same seeds and actions
+    and asserts that observations, rewards, terminations and the infos of
+    terminal steps match.
+    """
+    from common.vec_env.dummy_vec_env import DummyVecEnv
+
+    env_fns = [lambda i=i: env_fn(seed=seed + i) for i in range(num_envs)]
+    reference = DummyVecEnv(env_fns, render=False)
+    batched = BatchedEnv(env_fns)
+    env = batched.env
+    random = np.random.RandomState(seed)
+    obs1, obs2 = reference.reset(), batched.reset()
+    nvec = batched.action_space.nvec
+    for _ in range(num_steps):
+        assert obs1.keys() == obs2.keys()
+        for k in obs2:
+            ob1, ob2 = (np.reshape(o[k], (num_envs, -1)) for o in (obs1, obs2))
+            assert np.array_equal(ob1, ob2), k
+        actions = random.randint(nvec, size=(num_envs, len(nvec)))
+        # mostly pick the active subtask, so that programs make progress
+        for i, (active, lines) in enumerate(zip(obs2["active"], obs2["lines"])):
+            if active < env.n_lines and random.rand() < 0.8:
+                line = env.decode_line(lines[int(active)])
+                if type(line) is Subtask:
+                    actions[i, 0] = env.subtasks.index(line.id)
+        obs1, reward1, done1, infos1 = reference.step(actions)
+        obs2, reward2, done2, infos2 = batched.step(actions)
+        assert np.array_equal(reward1, reward2)
+        assert np.array_equal(done1, done2)
+        for i in np.flatnonzero(done2):
+            info1, info2 = infos1[i], infos2[i]
+            assert info1.keys() == info2.keys(), set(info1) ^ set(info2)
+            for k, v in info1.items():
+                assert np.array_equal(v, info2[k]), k
@@ -0,0 +1,63 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+def demo_dtype(world_shape, n_items):
+    """
+    Layout of one demonstration step: the one-hot world packed into bits, the
+    active line as encoded by `Env.preprocess_line`, the inventory count of
+    every item and the index of the demonstrated lower-level action.
+    """
+    world_bytes = -(-int(np.prod(world_shape)) // 8)
+    return np.dtype(
+        [
+            ("world", np.uint8, (world_bytes,)),
+            ("line", np.int8, (4,)),
+            ("inventory", np.int8, (n_items,)),
+            ("action", np.int8),
+        ]
+    )
+
+
+class Demonstrations:
+    """
+    Lower-level demonstrations (see `oracle.Oracle`), one .npy file of
+    `demo_dtype` records per worker that generated them:
+
+        <path>/meta.json
+        <path>/worker<k>.npy
+    """
+
+    def __init__(self, path):
+        with Path(path, "meta.json").open() as f:
+            self.meta = json.load(f)
+        self.world_shape = tuple(self.meta["world_shape"])
+        shards = sorted(Path(path).glob("worker*.npy"))
+        assert shards, f"No demonstrations in {path}"
+        self.records = np.concatenate([np.load(p) for p in shards])
+
+    def __len__(self):
+        return len(self.records)
+
+    def worlds(self, idx):
+        """
+        One-hot worlds [len(idx), C, H, W] of the records at `idx`.
+        """
+        size = int(np.prod(self.world_shape))
+        bits = np.unpackbits(self.records["world"][idx], axis=-1, count=size)
+        return bits.reshape(-1, *self.world_shape)
+
+    @staticmethod
+    def write(path, worker, records):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        np.save(Path(path, f"worker{worker}.npy"), records)
+
+    @staticmethod
+    def write_meta(path, **meta):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        with Path(path, "meta.json").open("w") as f:
+            json.dump(
+                meta, f, indent=2, default=lambda x: getattr(x, "__name__", str(x))
+            )
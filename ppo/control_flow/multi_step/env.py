@@ -1,15 +1,13 @@
 import functools
 import itertools
-from collections import Counter, namedtuple, deque
-from copy import deepcopy
-from typing import Iterator, List, Tuple
+from collections import Counter, namedtuple
+from pathlib import Path
 
 import numpy as np
 from gym import spaces
 from rl_utils import hierarchical_parse_args
 
 import ppo.control_flow.env
-from ppo.control_flow.env import State
 from ppo.control_flow.lines import (
     Subtask,
     Padding,
@@ -22,6 +20,12 @@ from ppo.control_flow.lines import (
     Loop,
     EndLoop,
 )
+from ppo.control_flow.program import SUBTASK, IF, WHILE, LOOP
+from ppo.djikstra import grid_distances, grid_moves
+from ppo.control_flow.multi_step import snapshot
+from ppo.control_flow.multi_step.eval_suite import EvalSuite, code_kind, kind, kind_code
+from ppo.control_flow.multi_step.failure_buffer import FailureBuffer
+from ppo.control_flow.multi_step.task_bank import TaskBank
 
 BLACK = "\033[30m"
 RED = "\033[31m"
@@ -44,12 +48,96 @@ Obs = namedtuple("Obs", "active lines obs inventory")
 
 
 def get_nearest(_from, _to, objects):
-    items = [(np.array(p), o) for p, o in objects.items()]
+    items = [(np.array(p), o) for p, o in sorted(objects.items())]  # ties by row
     candidates = [(p, np.max(np.abs(_from - p))) for p, o in items if o == _to]
     if candidates:
         return min(candidates, key=lambda c: c[1])
 
 
+def object_list(worlds, capacity, agent_channel):
+    """
+    Lists the objects of one-hot worlds [N, C, H, W] as zero-padded arrays
+    [N, capacity, 3] of (channel + 1, row, col) rows: the agent first, then
+    the other objects nearest first (Chebyshev distance, ties by row, column
+    and channel). Objects beyond `capacity` are dropped.
+    """
+    n, c, i, j = np.nonzero(worlds)
+    agent = c == agent_channel
+    agent_i = np.zeros(len(worlds), dtype=int)
+    agent_j = np.zeros(len(worlds), dtype=int)
+    agent_i[n[agent]], agent_j[n[agent]] = i[agent], j[agent]
+    distance = np.maximum(np.abs(i - agent_i[n]), np.abs(j - agent_j[n]))
+    order = np.lexsort((c, j, i, distance, ~agent, n))
+    n, rows = n[order], np.stack([c + 1, i, j], axis=-1)[order]
+    rank = np.arange(len(n)) - np.searchsorted(n, n)
+    keep = rank < capacity
+    objects = np.zeros((len(worlds), capacity, 3), dtype=np.float32)
+    objects[n[keep], rank[keep]] = rows[keep]
+    return objects
+
+
+FeasibilityRules = namedtuple(
+    "FeasibilityRules",
+    "num_objects wood merchant mine sell condition_lhs condition_rhs "
+    "max_while_loops long_jump",
+)
+
+
+@functools.lru_cache(maxsize=100000)
+def feasibility(program, counts: bytes, rules: FeasibilityRules):
+    """
+    Runs `program` on object counts, given as the bytes of an int64 array
+    (hashable, so results are memoized across envs with the same `rules`).
+    Returns whether the program can be completed and whether its first While
+    is reached with a false condition (such worlds are rejected with
+    probability `reject_while_prob`).
+    """
+    counts = np.frombuffer(counts, dtype=np.int64).tolist()
+    minimum = [0] * rules.num_objects
+    minimum[rules.wood] = 1
+    inventory = [0] * len(Env.items)
+    if_evaluations = [False] * len(program)
+    loops = 0
+    whiles = 0
+    while_false = False
+    l = program.start
+    while l is not None:
+        t = program.types[l]
+        _, behavior, item, _ = program.ids[l]
+        evaluation = False
+        if t == SUBTASK:
+            behavior, resource = behavior - 1, item - 1
+            if counts[resource] <= minimum[resource]:
+                return False, while_false
+            if behavior == rules.sell:
+                if counts[rules.merchant] <= 0:
+                    return False, while_false
+                if inventory[resource] == 0:
+                    # collect from environment
+                    counts[resource] -= 1
+                    inventory[resource] += 1
+                inventory[resource] -= 1
+            elif behavior == rules.mine:
+                counts[resource] -= 1
+                inventory[resource] += 1
+        elif t == LOOP:
+            loops += 1
+            evaluation = loops > 0
+        elif t in (IF, WHILE):
+            lhs, rhs = rules.condition_lhs[item], rules.condition_rhs[item]
+            evaluation = counts[lhs] > counts[rhs]
+            if t == WHILE:
+                if whiles == 0 and not evaluation:
+                    while_false = True
+                whiles += 1
+                if whiles > rules.max_while_loops:
+                    return False, while_false
+        if evaluation and rules.long_jump:
+            return False, while_false
+        l = program.next(l, evaluation, if_evaluations)
+    return True, while_false
+
+
 def objective(interaction, obj):
     if interaction == Env.sell:
         return Env.merchant
@@ -62,6 +150,24 @@ def subtasks():
             yield interaction, obj
 
 
+class EnvState(ppo.control_flow.env.EnvState):
+    """
+    `EnvState` plus the world of a multi-step episode.
+    """
+
+    __slots__ = (
+        "objects",
+        "agent_pos",
+        "inventory",
+        "counts",
+        "world",
+        "fields",
+        "whiles",
+        "initial",
+        "world_size",
+    )
+
+
 class Env(ppo.control_flow.env.Env):
     wood = "wood"
     gold = "gold"
@@ -77,7 +183,12 @@ class Env(ppo.control_flow.env.Env):
     items = [wood, gold, iron]
     terrain = [merchant, water, wall, bridge, agent]
     world_contents = items + terrain
+    object_index = {o: i for i, o in enumerate(world_contents)}
     behaviors = [mine, sell, goto]
+    # lines are encoded as 4 numbers (see `preprocess_line`)
+    info_payloads = dict(
+        ppo.control_flow.env.Env.info_payloads, instruction=(np.int16, (-1, 4))
+    )
     colors = {
         wood: GREEN,
         gold: YELLOW,
@@ -103,26 +214,74 @@ class Env(ppo.control_flow.env.Env):
         reject_while_prob,
         long_jump,
         world_size=6,
+        min_world_size=None,
+        task_bank=None,
+        macro_step=False,
+        sparse_obs=None,
+        eval_suite=None,
+        num_ranks=1,
         **kwargs,
     ):
         self.reject_while_prob = reject_while_prob
         self.one_condition = one_condition
         self.max_failure_sample_prob = max_failure_sample_prob
-        self.failure_buffer = deque(maxlen=failure_buffer_size)
+        self.failure_buffer = FailureBuffer(failure_buffer_size)
         self.max_world_resamples = max_world_resamples
         self.max_while_loops = max_while_loops
         self.term_on = term_on
         self.temporal_extension = temporal_extension
-        self.loops = None
-        self.whiles = None
         self.use_water = use_water
+        self.restored = None  # task to start the next episode from
+        self.feasibility_checks = 0
+        self.feasibility_rejections = 0
+        self.programs_sampled = 0
+        self.programs_rejected = 0
+        # channels compared by If/While, indexed by the encoded condition item
+        conditions = [(0, 0)] + [
+            tuple(map(self.object_index.get, self.condition_objects(item)))
+            for item in self.items
+        ]
+        self.condition_lhs, self.condition_rhs = np.array(conditions).T
 
         self.subtasks = list(subtasks())
         num_subtasks = len(self.subtasks)
         super().__init__(num_subtasks=num_subtasks, **kwargs)
         self.long_jump = long_jump and self.evaluating
+        # everything besides the program and counts that `feasibility` reads
+        self.feasibility_rules = FeasibilityRules(
+            num_objects=len(self.world_contents),
+            wood=self.object_index[self.wood],
+            merchant=self.object_index[self.merchant],
+            mine=self.behaviors.index(self.mine),
+            sell=self.behaviors.index(self.sell),
+            condition_lhs=tuple(self.condition_lhs.tolist()),
+            condition_rhs=tuple(self.condition_rhs.tolist()),
+            max_while_loops=self.max_while_loops,
+            long_jump=self.long_jump,
+        )
+        assert not macro_step or self.lower_level == "hardcoded"
+        self.macro_step = macro_step
         self.world_size = world_size
         self.world_shape = (len(self.world_contents), self.world_size, self.world_size)
+        # sides of the squares that training tasks are sampled in
+        self.world_sizes = list(range(min_world_size or world_size, world_size + 1))
+        # buckets and their probabilities, see `set_curriculum`
+        self.curriculum = None
+        # capacity of the object-list observation (None for the one-hot grid)
+        self.sparse_obs = sparse_obs
+        self.task_bank = None
+        if task_bank is not None:
+            self.task_bank = TaskBank(
+                task_bank, rank=self.rank, evaluating=self.evaluating
+            )
+            assert self.task_bank.meta["world_size"] == world_size
+        # frozen evaluation tasks, shared out among `num_ranks` eval envs
+        self.eval_suite = None
+        if eval_suite is not None and self.evaluating:
+            self.eval_suite = EvalSuite(eval_suite)
+            assert self.eval_suite.meta["world_size"] == world_size
+            self.eval_tasks = self.eval_suite.cycle(self.rank, num_ranks)
+        self.num_ranks = num_ranks
 
         def lower_level_actions():
             yield from self.behaviors
@@ -143,7 +302,7 @@ class Env(ppo.control_flow.env.Env):
             )
         )
         self.observation_space.spaces.update(
-            obs=spaces.Box(low=0, high=1, shape=self.world_shape),
+            obs=self.world_space(),
             lines=spaces.MultiDiscrete(
                 np.array(
                     [
@@ -160,6 +319,22 @@ class Env(ppo.control_flow.env.Env):
             inventory=spaces.MultiBinary(len(self.items)),
         )
 
+    def world_space(self):
+        if self.sparse_obs is None:
+            return spaces.Box(low=0, high=1, shape=self.world_shape)
+        # rows of (type id + 1, row, col), see `object_list`
+        high = [len(self.world_contents), self.world_size - 1, self.world_size - 1]
+        high = np.array([high] * self.sparse_obs, dtype=np.float32)
+        return spaces.Box(low=np.zeros_like(high), high=high)
+
+    def world_obs(self, worlds):
+        """
+        Observations of one-hot worlds [N, C, H, W].
+        """
+        if self.sparse_obs is None:
+            return worlds.astype(np.float32)
+        return object_list(worlds, self.sparse_obs, self.object_index[self.agent])
+
     def print_obs(self, obs):
         obs, inventory = obs
         obs = obs.transpose(1, 2, 0).astype(int)
@@ -187,15 +362,8 @@ class Env(ppo.control_flow.env.Env):
         if type(line) is Subtask:
             return f"{line} {self.subtasks.index(line.id)}"
         elif type(line) in (If, While):
-            if self.one_condition:
-                evaluation = "counts[iron] > counts[gold]"
-            elif line.id == Env.iron:
-                evaluation = "counts[iron] > counts[gold]"
-            elif line.id == Env.gold:
-                evaluation = "counts[gold] > counts[merchant]"
-            elif line.id == Env.wood:
-                evaluation = "counts[merchant] > counts[iron]"
-            return f"{line} {evaluation}"
+            lhs, rhs = self.condition_objects(line.id)
+            return f"{line} counts[{lhs}] > counts[{rhs}]"
         return line
 
     @staticmethod
@@ -220,8 +388,82 @@ class Env(ppo.control_flow.env.Env):
         else:
             raise RuntimeError()
 
+    @staticmethod
+    def decode_line(code):
+        line_type, behavior, item, loops = code
+        line_type = Line.types[line_type]
+        if line_type is Subtask:
+            return Subtask((Env.behaviors[behavior - 1], Env.items[item - 1]))
+        elif line_type in (If, While):
+            return line_type(Env.items[item - 1])
+        elif line_type is Loop:
+            return Loop(loops)
+        return line_type(0)
+
+    def encode_task(self, lines, objects, agent_pos):
+        world = np.zeros((self.world_size, self.world_size), dtype=np.int8)
+        for p, o in objects.items():
+            world[p] = self.object_index[o] + 1
+        return [self.preprocess_line(l) for l in lines], world, agent_pos
+
+    def decode_task(self, record):
+        lines = [self.decode_line(l) for l in record["lines"].tolist()]
+        objects = {
+            (i, j): self.world_contents[o - 1]
+            for (i, j), o in np.ndenumerate(record["world"])
+            if o
+        }
+        return lines, objects, tuple(record["agent_pos"].tolist())
+
+    def snapshot_task(self, lines, objects, agent_pos, inventory=None) -> bytes:
+        lines, world, agent_pos = self.encode_task(lines, objects, agent_pos)
+        inventory = Counter() if inventory is None else inventory
+        inventory = [inventory[i] for i in self.items]
+        return snapshot.pack(lines, world, agent_pos, inventory)
+
+    def snapshot(self, include_random=False) -> bytes:
+        """
+        Packs the program, world, agent position and inventory of the current
+        episode (and optionally the state of `self.random`) for `restore`.
+        """
+        state = self.state
+        lines, world, inventory = state.lines, state.world, state.inventory
+        agent = self.object_index[self.agent]
+        objects = world.copy()
+        objects[agent] = 0
+        grid = np.where(objects.any(0), objects.argmax(0) + 1, 0)
+        return snapshot.pack(
+            [self.preprocess_line(l) for l in lines],
+            grid,
+            np.argwhere(world[agent])[0],
+            [inventory[i] for i in self.items],
+            self.random.get_state() if include_random else None,
+        )
+
+    def decode_snapshot(self, data: bytes):
+        """
+        Returns the lines, objects, agent position, inventory and RNG state
+        (or None) packed by `snapshot`.
+        """
+        record, random_state = snapshot.unpack(data, self.world_size, len(self.items))
+        lines, objects, agent_pos = self.decode_task(record)
+        inventory = Counter(
+            {i: int(n) for i, n in zip(self.items, record["inventory"]) if n}
+        )
+        return lines, objects, agent_pos, inventory, random_state
+
+    def restore(self, data: bytes):
+        """
+        Starts an episode from a `snapshot` and returns its observation.
+        """
+        *task, random_state = self.decode_snapshot(data)
+        if random_state is not None:
+            self.random.set_state(random_state)
+        self.restored = task
+        return self.reset()
+
     def world_array(self, objects, agent_pos):
-        world = np.zeros(self.world_shape)
+        world = np.zeros(self.world_shape, dtype=np.float32)
         for p, o in list(objects.items()) + [(agent_pos, self.agent)]:
             p = np.array(p)
             world[tuple((self.world_contents.index(o), *p))] = 1
@@ -234,82 +476,66 @@ class Env(ppo.control_flow.env.Env):
         elif type(line) is Loop:
             return loops > 0
         elif type(line) in (If, While):
-            if self.one_condition:
-                evaluation = counts[Env.iron] > counts[Env.gold]
-            elif line.id == Env.iron:
-                evaluation = counts[Env.iron] > counts[Env.gold]
-            elif line.id == Env.gold:
-                evaluation = counts[Env.gold] > counts[Env.merchant]
-            elif line.id == Env.wood:
-                evaluation = counts[Env.merchant] > counts[Env.iron]
-            else:
-                raise RuntimeError
+            lhs, rhs = self.condition_objects(line.id)
+            evaluation = counts[self.object_index[lhs]] > counts[self.object_index[rhs]]
             condition_evaluations += [evaluation]
             return evaluation
 
-    def feasible(self, objects, lines):
-        line_iterator = self.line_generator(lines)
-        l = next(line_iterator)
-        loops = 0
-        whiles = 0
-        inventory = Counter()
-        counts = Counter()
-        for o in objects:
-            counts[o] += 1
-        while l is not None:
-            line = lines[l]
-            if type(line) is Subtask:
-                behavior, resource = line.id
-                if behavior == self.sell:
-                    required = {self.merchant, resource}
-                elif behavior == self.mine:
-                    required = {resource}
-                else:
-                    required = {resource}
-                for r in required:
-                    if counts[r] <= (1 if r == self.wood else 0):
-                        return False
-                if behavior in self.sell:
-                    if inventory[resource] == 0:
-                        # collect from environment
-                        counts[resource] -= 1
-                        inventory[resource] += 1
-                    inventory[resource] -= 1
-                elif behavior == self.mine:
-                    counts[resource] -= 1
-                    inventory[resource] += 1
-            elif type(line) is Loop:
-                loops += 1
-            elif type(line) is While:
-                if all(
-                    (
-                        whiles == 0,  # first loop
-                        not self.evaluate_line(
-                            line, counts, [], loops
-                        ),  # evaluates false
-                        not self.evaluating,
-                        self.random.random() < self.reject_while_prob,
-                    )
-                ):
-                    return False
-                whiles += 1
-                if whiles > self.max_while_loops:
-                    return False
-            evaluation = self.evaluate_line(line, counts, [], loops)
-            if evaluation is True and self.long_jump:
-                assert self.evaluating
-                return False
-            l = line_iterator.send(evaluation)
-        return True
+    def condition_objects(self, item):
+        if self.one_condition or item == Env.iron:
+            return Env.iron, Env.gold
+        elif item == Env.gold:
+            return Env.gold, Env.merchant
+        elif item == Env.wood:
+            return Env.merchant, Env.iron
+        else:
+            raise RuntimeError
+
+    def feasible(self, counts, lines):
+        """
+        Scores candidate worlds, given as object counts of shape
+        [K, len(world_contents)], against one program and returns the index
+        of the first feasible one (or None). The deterministic part of the
+        check is memoized on (program, counts) by `feasibility`; the
+        `reject_while_prob` coin is flipped afresh for every candidate.
+        """
+        program = self.compile(lines)
+        counts = np.ascontiguousarray(counts, dtype=np.int64)
+        for k, c in enumerate(counts):
+            feasible, while_false = feasibility(
+                program, c.tobytes(), self.feasibility_rules
+            )
+            if feasible and while_false and not self.evaluating:
+                feasible = self.random.random() >= self.reject_while_prob
+            self.feasibility_checks += 1
+            if feasible:
+                return k
+            self.feasibility_rejections += 1
+        return None
+
+    def rejection_rates(self):
+        return dict(
+            feasibility_rejection_rate=self.feasibility_rejections
+            / max(1, self.feasibility_checks),
+            program_rejection_rate=self.programs_rejected
+            / max(1, self.programs_sampled),
+        )
 
     @staticmethod
     def count_objects(objects):
-        counts = Counter()
+        counts = [0] * len(Env.world_contents)
         for o in objects.values():
-            counts[o] += 1
+            counts[Env.object_index[o]] += 1
         return counts
 
-    def generators(self) -> Tuple[Iterator[State], List[Line]]:
+    def sample_task(self):
+        """
+        Returns the lines, objects and agent position of a task, whether it
+        came from the failure buffer, and the side of the square its world
+        was sampled in (None for tasks decoded from a snapshot).
+        """
+        if self.eval_suite is not None:
+            return (*self.decode_task(next(self.eval_tasks)), False, None)
         use_failure_buf = (
             not self.evaluating
             and len(self.failure_buffer) > 0
@@ -318,11 +544,29 @@ class Env(ppo.control_flow.env.Env):
                 < self.max_failure_sample_prob * self.success_count / self.i
             )
         )
+        record = None
+        world_size = None
+        if self.task_bank is not None and not use_failure_buf:
+            if self.evaluating:
+                bounds = self.min_eval_lines, self.max_eval_lines
+            else:
+                bounds = self.min_lines, self.max_lines
+            record = self.task_bank.sample(self.random, *bounds)
         if use_failure_buf:
-            choice = self.random.choice(len(self.failure_buffer))
-            lines, objects, _agent_pos = self.failure_buffer[choice]
-            del self.failure_buffer[choice]
+            failure = self.failure_buffer.sample(self.random)
+            lines, objects, _agent_pos, *_ = self.decode_snapshot(failure)
+        elif record is not None:
+            lines, objects, _agent_pos = self.decode_task(record)
         else:
+            bucket = None
+            if self.curriculum is not None and not self.evaluating:
+                buckets, p = self.curriculum
+                bucket = buckets[self.random.choice(len(buckets), p=p)]
+            world_size = self.world_size
+            if bucket is not None:
+                world_size = bucket[2]
+            elif len(self.world_sizes) > 1 and not self.evaluating:
+                world_size = self.random.choice(self.world_sizes)
             while True:
                 n_lines = (
                     self.random.random_integers(
@@ -331,7 +575,22 @@ class Env(ppo.control_flow.env.Env):
                     if self.evaluating
                     else self.random.random_integers(self.min_lines, self.max_lines)
                 )
-                if self.long_jump:
+                if bucket is not None:
+                    n_lines, control_flow, _ = bucket
+
+                    def accept(present):
+                        # the Else feature stands for an If with an Else
+                        if Else in present:
+                            present = present | {If}
+                        return kind(present) == control_flow
+
+                    line_types = self.sample_line_types(
+                        n_lines,
+                        legal_lines=self.control_flow_types,
+                        accept=accept,
+                        features=(If, Else, While, Loop),
+                    )
+                elif self.long_jump:
                     assert self.evaluating
                     len_jump = self.random.randint(
                         self.min_eval_lines - 3, self.max_eval_lines - 3
@@ -345,22 +604,13 @@ class Env(ppo.control_flow.env.Env):
                     ]
                 elif self.single_control_flow_type and self.evaluating:
                     assert n_lines >= 6
-                    while True:
-                        line_types = list(
-                            Line.generate_types(
-                                n_lines,
-                                remaining_depth=self.max_nesting_depth,
-                                random=self.random,
-                                legal_lines=self.control_flow_types,
-                            )
-                        )
-                        criteria = [
-                            Else in line_types,  # Else
-                            While in line_types,  # While
-                            line_types.count(If) > line_types.count(Else),  # If
-                        ]
-                        if sum(criteria) >= 2:
-                            break
+                    # at least two of: Else, While, If without Else
+                    line_types = self.sample_line_types(
+                        n_lines,
+                        legal_lines=self.control_flow_types,
+                        accept=lambda present: len(present) >= 2,
+                        features=(Else, While, If),
+                    )
                 else:
                     legal_lines = (
                         [
@@ -372,221 +622,257 @@ class Env(ppo.control_flow.env.Env):
                         if (self.single_control_flow_type and not self.evaluating)
                         else self.control_flow_types
                     )
-                    line_types = list(
-                        Line.generate_types(
-                            n_lines,
-                            remaining_depth=self.max_nesting_depth,
-                            random=self.random,
-                            legal_lines=legal_lines,
-                        )
+                    line_types = self.sample_line_types(
+                        n_lines, legal_lines=legal_lines
                     )
                 lines = list(self.assign_line_ids(line_types))
                 assert self.max_nesting_depth == 1
-                result = self.populate_world(lines)
+                result = self.populate_world(lines, world_size)
+                self.programs_sampled += 1
                 if result is not None:
                     _agent_pos, objects = result
                     break
+                self.programs_rejected += 1
+        return lines, objects, _agent_pos, use_failure_buf, world_size
 
-        def state_generator(agent_pos) -> State:
-            initial_objects = deepcopy(objects)
-            initial_agent_pos = deepcopy(agent_pos)
-            line_iterator = self.line_generator(lines)
-            condition_evaluations = []
-            if self.lower_level == "train-alone":
-                self.time_remaining = 0
+    def initial_state(self) -> EnvState:
+        if self.restored is None:
+            lines, objects, agent_pos, use_failure_buf, world_size = self.sample_task()
+            initial_inventory = Counter()
+        else:
+            lines, objects, agent_pos, initial_inventory = self.restored
+            use_failure_buf = False
+            world_size = None
+            self.restored = None
+
+        state = EnvState(lines, self.compile(lines), use_failure_buf=use_failure_buf)
+        state.initial = self.snapshot_task(
+            lines, objects, agent_pos, initial_inventory
+        )
+        state.world_size = world_size
+        if self.lower_level == "train-alone":
+            state.time_remaining = 0
+        else:
+            state.time_remaining = 200 if self.evaluating else self.time_to_waste
+        state.whiles = 0
+        state.objects = objects
+        state.agent_pos = agent_pos
+        state.inventory = Counter(initial_inventory)
+        # object counts, updated with every insertion and deletion
+        state.counts = self.count_objects(objects)
+        # one-hot world, updated in place for the rest of the episode
+        state.world = self.world_array(objects, agent_pos)
+        # distances and first moves toward every item and the merchant,
+        # recomputed only when an object is mined
+        state.fields = None
+        if self.lower_level == "hardcoded" and self.temporal_extension:
+            state.fields = self.distance_fields(state.world)
+        state.ptr = self.next_subtask(state, None)
+        self.check_time(state)
+        return state
+
+    def outcome(self, info):
+        obs, reward, done, info = super().outcome(info)
+        if done:
+            info.update(
+                control_flow=kind_code({type(l) for l in self.state.lines}),
+                conditions_evaluated=len(self.state.condition_evaluations),
+                conditions_true=sum(self.state.condition_evaluations),
+            )
+            if self.state.world_size is not None:
+                info.update(world_size=self.state.world_size)
+        return obs, reward, done, info
+
+    @property
+    def info_keys(self):
+        return super().info_keys + (
+            "world_size",
+            "control_flow",
+            "conditions_evaluated",
+            "conditions_true",
+        )
+
+    def state_obs(self, state):
+        # the world is updated in place, so observations get their own copy
+        return state.world.copy(), state.inventory
+
+    def next_subtask(self, state, l):
+        lines, program = state.lines, state.program
+        while True:
+            if l is None:
+                l = program.start
             else:
-                self.time_remaining = 200 if self.evaluating else self.time_to_waste
-            self.loops = None
-            self.whiles = 0
-            inventory = Counter()
-            subtask_complete = False
-
-            def next_subtask(l):
-                while True:
-                    if l is None:
-                        l = line_iterator.send(None)
-                    else:
-                        if type(lines[l]) is Loop:
-                            if self.loops is None:
-                                self.loops = lines[l].id
-                            else:
-                                self.loops -= 1
-                        elif type(lines[l]) is While:
-                            self.whiles += 1
-                            if self.whiles > self.max_while_loops:
-                                return None
-                        counts = self.count_objects(objects)
-                        l = line_iterator.send(
-                            self.evaluate_line(
-                                lines[l], counts, condition_evaluations, self.loops
-                            )
-                        )
-                        if self.loops == 0:
-                            self.loops = None
-                    if l is None or type(lines[l]) is Subtask:
-                        break
-                if l is not None:
-                    assert type(lines[l]) is Subtask
-                    time_delta = 3 * self.world_size
-                    if self.lower_level == "train-alone":
-                        self.time_remaining = time_delta + self.time_to_waste
+                if type(lines[l]) is Loop:
+                    if state.loops is None:
+                        state.loops = lines[l].id
                     else:
-                        self.time_remaining += time_delta
-                    return l
+                        state.loops -= 1
+                elif type(lines[l]) is While:
+                    state.whiles += 1
+                    if state.whiles > self.max_while_loops:
+                        return None
+                l = program.next(
+                    l,
+                    self.evaluate_line(
+                        lines[l], state.counts, state.condition_evaluations, state.loops
+                    ),
+                    state.if_evaluations,
+                )
+                if state.loops == 0:
+                    state.loops = None
+            if l is None or type(lines[l]) is Subtask:
+                break
+        if l is not None:
+            assert type(lines[l]) is Subtask
+            time_delta = 3 * self.world_size
+            if self.lower_level == "train-alone":
+                state.time_remaining = time_delta + self.time_to_waste
+            else:
+                state.time_remaining += time_delta
+            return l
 
-            prev, ptr = 0, next_subtask(None)
-            term = False
-            while True:
-                term |= not self.time_remaining
-                if term and ptr is not None:
-                    self.failure_buffer.append(
-                        (lines, initial_objects, initial_agent_pos)
-                    )
+    def check_time(self, state):
+        state.term |= not state.time_remaining
+        if state.term and state.ptr is not None:
+            self.failure_buffer.append(state.initial)
 
-                subtask_id, lower_level_index = yield State(
-                    obs=(self.world_array(objects, agent_pos), inventory),
-                    prev=prev,
-                    ptr=ptr,
-                    term=term,
-                    subtask_complete=subtask_complete,
-                    use_failure_buf=use_failure_buf,
-                    condition_evaluations=condition_evaluations,
-                )
-                subtask_complete = False
-                # for i, a in enumerate(self.lower_level_actions):
-                # print(i, a)
-                # try:
-                # lower_level_index = int(input("go:"))
-                # except ValueError:
-                # pass
-                if self.lower_level == "train-alone":
-                    interaction, resource = lines[ptr].id
-                # interaction, obj = lines[agent_ptr].id
-                interaction, resource = self.subtasks[subtask_id]
-
-                if self.lower_level == "hardcoded":
-                    lower_level_action = self.get_lower_level_action(
-                        interaction=interaction,
-                        resource=resource,
-                        agent_pos=agent_pos,
-                        objects=objects,
-                    )
-                    # print("lower level action:", lower_level_action)
-                else:
-                    lower_level_action = self.lower_level_actions[lower_level_index]
-                self.time_remaining -= 1
-                tgt_interaction, tgt_obj = lines[ptr].id
-                if tgt_obj not in objects.values() and (
-                    tgt_interaction != Env.sell or inventory[tgt_obj] == 0
-                ):
-                    term = True
-
-                if type(lower_level_action) is str:
-                    standing_on = objects.get(tuple(agent_pos), None)
-                    done = (
-                        lower_level_action == tgt_interaction
-                        and standing_on == objective(*lines[ptr].id)
-                    )
-                    if lower_level_action == self.mine:
-                        if tuple(agent_pos) in objects:
-                            if (
-                                done
-                                or (
-                                    tgt_interaction == self.sell
-                                    and standing_on == tgt_obj
-                                )
-                                or standing_on == self.wood
-                            ):
-                                pass  # TODO
-                            elif self.mine in self.term_on:
-                                term = True
-                            if (
-                                standing_on in self.items
-                                and inventory[standing_on] == 0
-                            ):
-                                inventory[standing_on] = 1
-                            del objects[tuple(agent_pos)]
-                    elif lower_level_action == self.sell:
-                        done = done and (
-                            self.lower_level == "hardcoded" or inventory[tgt_obj] > 0
-                        )
-                        if done:
-                            inventory[tgt_obj] -= 1
-                        elif self.sell in self.term_on:
-                            term = True
-                    elif (
-                        lower_level_action == self.goto
-                        and not done
-                        and self.goto in self.term_on
-                    ):
-                        term = True
-                    if done:
-                        prev, ptr = ptr, next_subtask(ptr)
-                        subtask_complete = True
-
-                elif type(lower_level_action) is np.ndarray:
-                    if self.temporal_extension:
-                        lower_level_action = np.clip(lower_level_action, -1, 1)
-                    new_pos = agent_pos + lower_level_action
-                    moving_into = objects.get(tuple(new_pos), None)
+    def advance(self, state):
+        """
+        Applies one lower-level action (chosen by the hardcoded lower level or
+        by `state.lower_level_action`) toward `state.action`.
+        """
+        state.subtask_complete = False
+        lines, ptr = state.lines, state.ptr
+        objects, inventory, world = state.objects, state.inventory, state.world
+        agent_pos = state.agent_pos
+        interaction, resource = self.subtasks[state.action]
+
+        if self.lower_level == "hardcoded":
+            lower_level_action = self.get_lower_level_action(
+                interaction=interaction,
+                resource=resource,
+                agent_pos=agent_pos,
+                objects=objects,
+                fields=state.fields,
+            )
+        else:
+            lower_level_action = self.lower_level_actions[state.lower_level_action]
+        state.time_remaining -= 1
+        tgt_interaction, tgt_obj = lines[ptr].id
+        if state.counts[self.object_index[tgt_obj]] == 0 and (
+            tgt_interaction != Env.sell or inventory[tgt_obj] == 0
+        ):
+            state.term = True
+
+        if type(lower_level_action) is str:
+            standing_on = objects.get(tuple(agent_pos), None)
+            done = (
+                lower_level_action == tgt_interaction
+                and standing_on == objective(*lines[ptr].id)
+            )
+            if lower_level_action == self.mine:
+                if tuple(agent_pos) in objects:
                     if (
-                        np.all(0 <= new_pos)
-                        and np.all(new_pos < self.world_size)
-                        and (
-                            self.lower_level == "hardcoded"
-                            or (
-                                moving_into != self.wall
-                                and (
-                                    moving_into != self.water
-                                    or inventory[self.wood] > 0
-                                )
-                            )
-                        )
+                        done
+                        or (tgt_interaction == self.sell and standing_on == tgt_obj)
+                        or standing_on == self.wood
                     ):
-                        agent_pos = new_pos
-                        if moving_into == self.water:
-                            # build bridge
-                            del objects[tuple(new_pos)]
-                            inventory[self.wood] -= 1
-                else:
-                    assert lower_level_action is None
-
-        return state_generator(_agent_pos), lines
-
-    def populate_world(self, lines):
-        feasible = False
-        use_water = False
-        max_random_objects = 0
-        object_list = []
-        for i in range(self.max_world_resamples):
-            max_random_objects = self.world_size ** 2
-            num_random_objects = np.random.randint(max_random_objects)
-            object_list = [self.agent] + list(
-                self.random.choice(
-                    self.items + [self.merchant], size=num_random_objects
+                        pass  # TODO
+                    elif self.mine in self.term_on:
+                        state.term = True
+                    if standing_on in self.items and inventory[standing_on] == 0:
+                        inventory[standing_on] = 1
+                    del objects[tuple(agent_pos)]
+                    channel = self.object_index[standing_on]
+                    state.counts[channel] -= 1
+                    world[(channel, *agent_pos)] = 0
+                    if state.fields is not None:
+                        state.fields = self.distance_fields(
+                            world, state.fields, channel
+                        )
+            elif lower_level_action == self.sell:
+                done = done and (
+                    self.lower_level == "hardcoded" or inventory[tgt_obj] > 0
                 )
-            )
-            feasible = self.feasible(object_list, lines)
+                if done:
+                    inventory[tgt_obj] -= 1
+                elif self.sell in self.term_on:
+                    state.term = True
+            elif (
+                lower_level_action == self.goto
+                and not done
+                and self.goto in self.term_on
+            ):
+                state.term = True
+            if done:
+                state.prev, state.ptr = ptr, self.next_subtask(state, ptr)
+                state.subtask_complete = True
 
-            if feasible:
-                use_water = (
-                    self.use_water
-                    and num_random_objects < max_random_objects - self.world_size
+        elif type(lower_level_action) is np.ndarray:
+            if self.temporal_extension:
+                lower_level_action = lower_level_action.clip(-1, 1)
+            new_pos = agent_pos + lower_level_action
+            i, j = new_pos.tolist()
+            moving_into = objects.get((i, j), None)
+            if (
+                0 <= i < self.world_size
+                and 0 <= j < self.world_size
+                and (
+                    self.lower_level == "hardcoded"
+                    or (
+                        moving_into != self.wall
+                        and (moving_into != self.water or inventory[self.wood] > 0)
+                    )
                 )
-                break
+            ):
+                world[(self.object_index[self.agent], *agent_pos)] = 0
+                world[(self.object_index[self.agent], *new_pos)] = 1
+                state.agent_pos = new_pos
+                if moving_into == self.water:
+                    # build bridge
+                    del objects[tuple(new_pos)]
+                    state.counts[self.object_index[self.water]] -= 1
+                    world[(self.object_index[self.water], *new_pos)] = 0
+                    inventory[self.wood] -= 1
+        else:
+            assert lower_level_action is None
+        self.check_time(state)
 
-        if not feasible:
+    def populate_world(self, lines, world_size=None):
+        """
+        Samples a world for `lines` in the top-left `world_size` square
+        (all of the grid by default) and walls off the rest of the grid.
+        Returns the agent position and the objects, or None if no sampled
+        world was feasible.
+        """
+        size = self.world_size if world_size is None else world_size
+        K = self.max_world_resamples
+        max_random_objects = size ** 2
+        resources = self.items + [self.merchant]
+        num_random_objects = self.random.randint(max_random_objects, size=K)
+        choices = self.random.choice(len(resources), size=(K, max_random_objects))
+        sampled = np.arange(max_random_objects) < num_random_objects[:, None]
+        counts = np.zeros((K, len(self.world_contents)), dtype=int)
+        counts[:, self.object_index[self.agent]] = 1
+        for i, o in enumerate(resources):
+            counts[:, self.object_index[o]] = np.sum(sampled & (choices == i), axis=-1)
+        k = self.feasible(counts, lines)
+        if k is None:
             return None
 
+        object_list = [self.agent] + [
+            resources[i] for i in choices[k, : num_random_objects[k]]
+        ]
+        use_water = (
+            self.use_water
+            and num_random_objects[k] < max_random_objects - size
+        )
+
         if use_water:
             vertical_water = self.random.choice(2)
-            world_shape = (
-                [self.world_size, self.world_size - 1]
-                if vertical_water
-                else [self.world_size - 1, self.world_size]
-            )
+            world_shape = [size, size - 1] if vertical_water else [size - 1, size]
         else:
-            world_shape = (self.world_size, self.world_size)
+            world_shape = (size, size)
         indexes = self.random.choice(
             np.prod(world_shape),
             size=min(np.prod(world_shape), max_random_objects),
@@ -604,7 +890,7 @@ class Env(ppo.control_flow.env.Env):
             wall_positions = wall_positions[:num_walls]
         positions = np.concatenate([object_positions, wall_positions])
         if use_water:
-            water_index = self.random.randint(1, self.world_size - 1)
+            water_index = self.random.randint(1, size - 1)
             positions[positions[:, vertical_water] >= water_index] += np.array(
                 [0, 1] if vertical_water else [1, 0]
             )
@@ -629,7 +915,7 @@ class Env(ppo.control_flow.env.Env):
                                 **objects,
                                 **{
                                     (i, water_index): self.water
-                                    for i in range(self.world_size)
+                                    for i in range(size)
                                 },
                             }
                     else:
@@ -640,12 +926,52 @@ class Env(ppo.control_flow.env.Env):
                                 **objects,
                                 **{
                                     (water_index, i): self.water
-                                    for i in range(self.world_size)
+                                    for i in range(size)
                                 },
                             }
+        if size < self.world_size:
+            objects.update(
+                {
+                    (i, j): self.wall
+                    for i in range(self.world_size)
+                    for j in range(self.world_size)
+                    if max(i, j) >= size
+                }
+            )
 
         return agent_pos, objects
 
+    def seed(self, seed=None):
+        seeds = super().seed(seed)
+        if self.eval_suite is not None:
+            self.eval_tasks = self.eval_suite.cycle(self.rank, self.num_ranks)
+        return seeds
+
+    def set_curriculum(self, weights):
+        """
+        `weights` maps buckets (see `curriculum_bucket`) to the probability
+        of sampling training tasks from them. The None bucket stands for the
+        usual task distribution.
+        """
+        buckets = list(weights)
+        p = np.array([weights[b] for b in buckets], dtype=float)
+        self.curriculum = buckets, p / p.sum()
+
+    @staticmethod
+    def curriculum_bucket(info):
+        """
+        Program length, control-flow type and world size of an episode, from
+        the info of its last step, or None if the episode was not sampled
+        afresh.
+        """
+        if "world_size" not in info or info.get("use_failure_buf", False):
+            return None
+        return (
+            int(info["instruction_len"]),
+            code_kind(info["control_flow"]),
+            int(info["world_size"]),
+        )
+
     def assign_line_ids(self, line_types):
         behaviors = self.random.choice(self.behaviors, size=len(line_types))
         items = self.random.choice(self.items, size=len(line_types))
@@ -676,6 +1002,8 @@ class Env(ppo.control_flow.env.Env):
 
     def get_observation(self, obs, **kwargs):
         obs, inventory = obs
+        if self.sparse_obs is not None:
+            obs = self.world_obs(obs[None])[0]
         obs = super().get_observation(obs=obs, **kwargs)
         obs.update(inventory=np.array([inventory[i] for i in self.items]))
         # if not self.observation_space.contains(obs):
@@ -685,16 +1013,43 @@ class Env(ppo.control_flow.env.Env):
         #     self.observation_space.contains(obs)
         return obs
 
+    def distance_fields(self, world, fields=None, mined=None):
+        """
+        BFS distances [T, H, W] from every cell to the nearest of each item
+        and the merchant (walls are impassable; water can be bridged), with
+        the first move [T, H, W, 2] of a shortest path. Given the previous
+        `fields` and the channel of a `mined` object, only the affected
+        fields are recomputed.
+        """
+        targets = self.object_index[self.merchant] + 1
+        passable = world[self.object_index[self.wall]] == 0
+        if fields is None or mined == self.object_index[self.wall]:
+            channels = slice(targets)
+        elif mined < targets:
+            channels = slice(mined, mined + 1)
+        else:
+            return fields
+        distances = grid_distances(world[channels] == 1, passable)
+        moves = grid_moves(distances)
+        if fields is not None:
+            fields[0][channels], fields[1][channels] = distances, moves
+            distances, moves = fields
+        return distances, moves
+
     @staticmethod
-    def get_lower_level_action(interaction, resource, agent_pos, objects):
+    def get_lower_level_action(interaction, resource, agent_pos, objects, fields=None):
         resource = objective(interaction, resource)
         if objects.get(tuple(agent_pos), None) == resource:
             return interaction
-        else:
-            nearest = get_nearest(_from=agent_pos, _to=resource, objects=objects)
-            if nearest:
-                n, d = nearest
-                return n - agent_pos
+        if fields is not None:
+            distances, moves = fields
+            cell = (Env.object_index[resource], *agent_pos)
+            if distances[cell] < np.inf:
+                return moves[cell]
+        nearest = get_nearest(_from=agent_pos, _to=resource, objects=objects)
+        if nearest:
+            n, d = nearest
+            return n - agent_pos
 
 
 def build_parser(
@@ -723,6 +1078,20 @@ def build_parser(
         default=default_max_while_loops,
     )
     p.add_argument("--world-size", type=int, required=True)
+    p.add_argument(
+        "--min-world-size",
+        type=int,
+        help="sample training worlds of every size from this to --world-size",
+    )
+    p.add_argument("--task-bank", type=Path)
+    p.add_argument("--eval-suite", type=Path)
+    p.add_argument("--macro-step", action="store_true")
+    p.add_argument(
+        "--sparse-obs",
+        type=int,
+        metavar="CAPACITY",
+        help="observe the world as a list of at most CAPACITY objects",
+    )
     p.add_argument(
         "--term-on", nargs="+", choices=[Env.sell, Env.mine, Env.goto], required=True
     )
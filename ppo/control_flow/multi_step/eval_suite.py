@@ -0,0 +1,111 @@
+import hashlib
+import itertools
+import json
+from pathlib import Path
+
+import numpy as np
+
+from ppo.control_flow.lines import If, Else, While, Loop
+from ppo.control_flow.multi_step.snapshot import task_dtype
+
+CONTROL_FLOW = [If, Else, While, Loop]
+
+
+def kind(line_types):
+    """
+    Control-flow types among `line_types`, e.g. "If+While" or "Subtask".
+    """
+    return "+".join(t.__name__ for t in CONTROL_FLOW if t in line_types) or "Subtask"
+
+
+def kind_code(line_types):
+    """
+    Bitmask of the `CONTROL_FLOW` types among `line_types`, which `code_kind`
+    turns back into their `kind`.
+    """
+    return sum(1 << i for i, t in enumerate(CONTROL_FLOW) if t in line_types)
+
+
+def code_kind(code):
+    return kind({t for i, t in enumerate(CONTROL_FLOW) if int(code) >> i & 1})
+
+
+def stratum(lines):
+    """
+    Program length and control-flow type, e.g. "12-If+While" or "5-Subtask".
+    """
+    return f"{len(lines)}-{kind({type(l) for l in lines})}"
+
+
+class EvalSuite:
+    """
+    A frozen set of evaluation tasks (program plus world), stratified by
+    program length and control-flow type:
+
+        <path>/meta.json
+        <path>/<length>-<type>.npy   records of `snapshot.task_dtype`
+
+    `version` is a hash of the tasks, so results computed on one suite are
+    never confused with another. Tasks are interleaved across strata, and
+    eval env `rank` of `num_ranks` plays tasks rank, rank + num_ranks, ...
+    (cycling), so every evaluation sees the same tasks in the same order.
+    """
+
+    def __init__(self, path):
+        with Path(path, "meta.json").open() as f:
+            self.meta = json.load(f)
+        self.version = self.meta["version"]
+        self.strata = {
+            p.stem: np.load(p, mmap_mode="r") for p in sorted(Path(path).glob("*.npy"))
+        }
+        # one task of every stratum before the second of any
+        self.tasks = [
+            record
+            for records in itertools.zip_longest(*self.strata.values())
+            for record in records
+            if record is not None
+        ]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def cycle(self, rank, num_ranks):
+        tasks = self.tasks[rank % len(self) :: num_ranks] or self.tasks
+        return itertools.cycle(tasks)
+
+    @staticmethod
+    def read_version(path):
+        with Path(path, "meta.json").open() as f:
+            return json.load(f)["version"]
+
+    @staticmethod
+    def write(path, strata, world_size, n_items, **meta):
+        """
+        `strata` maps `stratum` names to (lines, world, agent_pos) triples as
+        produced by `Env.encode_task`. Inventories start empty.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        version = hashlib.sha256()
+        for name, records in sorted(strata.items()):
+            n = len(records[0][0])
+            array = np.array(
+                [(*r, np.zeros(n_items)) for r in records],
+                dtype=task_dtype(n, world_size, n_items),
+            )
+            np.save(Path(path, f"{name}.npy"), array)
+            version.update(name.encode())
+            version.update(array.tobytes())
+        counts = {name: len(records) for name, records in sorted(strata.items())}
+        with Path(path, "meta.json").open("w") as f:
+            json.dump(
+                dict(
+                    version=version.hexdigest()[:16],
+                    counts=counts,
+                    world_size=world_size,
+                    **meta,
+                ),
+                f,
+                indent=2,
+                default=lambda x: getattr(x, "__name__", str(x)),
+            )
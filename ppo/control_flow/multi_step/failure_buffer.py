@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+from common.segment_tree import SumSegmentTree, MinSegmentTree
+
+
+class FailureBuffer:
+    """
+    Bounded store of failed tasks with O(log n) prioritized sampling, removal
+    and priority updates. A task's priority is
+
+        failures ** alpha * 2 ** (time of last failure / half_life)
+
+    so tasks that fail often and recently are replayed first. Sampling
+    removes the task (it is re-appended if it fails again); when full, the
+    lowest-priority task is evicted. Tasks are byte snapshots
+    (`Env.snapshot_task`), so a task is its own key.
+    """
+
+    def __init__(self, capacity, alpha=0.6, half_life=None):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.half_life = half_life or max(1, capacity)
+        tree_capacity = 1
+        while tree_capacity < capacity:
+            tree_capacity *= 2
+        self.sum_tree = SumSegmentTree(tree_capacity)
+        self.min_tree = MinSegmentTree(tree_capacity)
+        self.tasks = [None] * capacity
+        self.keys = [None] * capacity
+        self.slots = {}  # task key -> slot
+        self.free = list(reversed(range(capacity)))
+        self.failures = OrderedDict()  # task key -> number of failures
+        self.t = 0
+        self.t0 = 0  # priorities are stored relative to 2 ** (t0 / half_life)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def priority(self, failures):
+        recency = 2 ** ((self.t - self.t0) / self.half_life)
+        return failures ** self.alpha * recency
+
+    def append(self, task):
+        if not self.capacity:
+            return
+        self.t += 1
+        if (self.t - self.t0) / self.half_life > 512:
+            self.rescale()
+        key = task
+        failures = self.failures.pop(key, 0) + 1
+        self.failures[key] = failures
+        if len(self.failures) > 2 * self.capacity:
+            self.failures.popitem(last=False)
+        slot = self.slots.get(key)
+        if slot is None:
+            if not self.free:
+                self.remove(self.min_tree.find_min_idx())
+            slot = self.free.pop()
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.tasks[slot] = task
+        self.update(slot, self.priority(failures))
+
+    def update(self, slot, priority):
+        self.sum_tree[slot] = priority
+        self.min_tree[slot] = priority
+
+    def remove(self, slot):
+        task = self.tasks[slot]
+        del self.slots[self.keys[slot]]
+        self.tasks[slot] = self.keys[slot] = None
+        self.sum_tree[slot] = 0.0
+        self.min_tree[slot] = float("inf")
+        self.free.append(slot)
+        return task
+
+    def sample(self, random):
+        """Removes and returns a task, sampled in proportion to priority."""
+        assert len(self) > 0
+        while True:
+            mass = random.random() * self.sum_tree.sum()
+            slot = self.sum_tree.find_prefixsum_idx(mass)
+            if slot < self.capacity and self.tasks[slot] is not None:
+                return self.remove(slot)
+
+    def rescale(self):
+        scale = 2 ** (-(self.t - self.t0) / self.half_life)
+        for slot in self.slots.values():
+            self.update(slot, self.sum_tree[slot] * scale)
+        self.t0 = self.t
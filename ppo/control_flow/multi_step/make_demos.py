@@ -0,0 +1,83 @@
+import argparse
+import functools
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from rl_utils import hierarchical_parse_args
+from tqdm import tqdm
+
+from ppo.control_flow.multi_step.demos import Demonstrations, demo_dtype
+from ppo.control_flow.multi_step.env import Env, build_parser
+from ppo.control_flow.multi_step.oracle import Oracle
+
+
+def collect(worker, out, steps_per_worker, seed, env_args):
+    """
+    Follows the oracle for `steps_per_worker` steps and writes every step.
+    Episodes whose active subtask cannot be completed are cut short.
+    """
+    env = Env(rank=worker, seed=seed + worker, lower_level="train-alone", **env_args)
+    oracle = Oracle(env)
+    records = np.zeros(
+        steps_per_worker, dtype=demo_dtype(env.world_shape, len(env.items))
+    )
+
+    def next_action():
+        while True:
+            if not env.state.done:
+                action = oracle.act(env.state)
+                if action is not None:
+                    return action
+            env.reset()
+
+    env.reset()
+    for i in tqdm(range(steps_per_worker), desc=f"worker {worker}", position=worker):
+        action = next_action()
+        state = env.state
+        records[i] = (
+            np.packbits(state.world > 0),
+            env.preprocess_line(state.lines[state.ptr]),
+            [state.inventory[item] for item in env.items],
+            action,
+        )
+        env.step(np.array([action]))
+    Demonstrations.write(out, worker, records)
+
+
+def main(out, num_workers, steps_per_worker, seed, **env_args):
+    env_args.update(eval_suite=None)
+    env = Env(rank=0, lower_level="train-alone", **env_args)
+    Demonstrations.write_meta(
+        out,
+        world_shape=env.world_shape,
+        lower_level_actions=[
+            a if type(a) is str else a.tolist() for a in env.lower_level_actions
+        ],
+        seed=seed,
+        steps_per_worker=steps_per_worker,
+        **env_args,
+    )
+    with Pool(num_workers) as pool:
+        pool.map(
+            functools.partial(
+                collect,
+                out=out,
+                steps_per_worker=steps_per_worker,
+                seed=seed,
+                env_args=env_args,
+            ),
+            range(num_workers),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    build_parser(parser)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--num-workers", type=int, required=True)
+    parser.add_argument("--steps-per-worker", type=int, required=True)
+    parser.add_argument("--min-eval-lines", type=int, required=True)
+    parser.add_argument("--max-eval-lines", type=int, required=True)
+    parser.add_argument("--seed", default=0, type=int)
+    main(**hierarchical_parse_args(parser))
@@ -0,0 +1,42 @@
+import argparse
+from collections import defaultdict
+from pathlib import Path
+
+from rl_utils import hierarchical_parse_args
+from tqdm import tqdm
+
+from ppo.control_flow.multi_step.env import Env, build_parser
+from ppo.control_flow.multi_step.eval_suite import EvalSuite, stratum
+
+
+def main(out, tasks_per_stratum, num_samples, seed, **env_args):
+    env_args.update(task_bank=None, eval_suite=None)
+    env = Env(rank=0, seed=seed, evaluating=True, lower_level="hardcoded", **env_args)
+    strata = defaultdict(list)
+    for _ in tqdm(range(num_samples), desc="sampling"):
+        lines, objects, agent_pos, *_ = env.sample_task()
+        records = strata[stratum(lines)]
+        if len(records) < tasks_per_stratum:
+            records.append(env.encode_task(lines, objects, agent_pos))
+    EvalSuite.write(
+        out,
+        strata,
+        n_items=len(env.items),
+        seed=seed,
+        tasks_per_stratum=tasks_per_stratum,
+        **env_args,
+    )
+    for name, records in sorted(strata.items()):
+        print(f"{name:>20} {len(records)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    build_parser(parser)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--tasks-per-stratum", type=int, required=True)
+    parser.add_argument("--num-samples", type=int, required=True)
+    parser.add_argument("--min-eval-lines", type=int, required=True)
+    parser.add_argument("--max-eval-lines", type=int, required=True)
+    parser.add_argument("--seed", default=0, type=int)
+    main(**hierarchical_parse_args(parser))
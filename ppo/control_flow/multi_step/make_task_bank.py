@@ -0,0 +1,47 @@
+import argparse
+from pathlib import Path
+
+from rl_utils import hierarchical_parse_args
+from tqdm import tqdm
+
+from ppo.control_flow.multi_step.env import Env, build_parser
+from ppo.control_flow.multi_step.task_bank import TaskBank
+
+
+def main(out, num_ranks, tasks_per_rank, eval_tasks_per_rank, seed, **env_args):
+    env_args.update(task_bank=None, eval_suite=None)
+    TaskBank.write_meta(out, seed=seed, **env_args)
+    for evaluating, num_tasks in [(False, tasks_per_rank), (True, eval_tasks_per_rank)]:
+        for rank in range(num_ranks):
+            env = Env(
+                rank=rank,
+                seed=seed + rank,
+                evaluating=evaluating,
+                lower_level="hardcoded",
+                **env_args,
+            )
+            records = [
+                env.encode_task(*env.sample_task()[:3])
+                for _ in tqdm(range(num_tasks), desc=f"{TaskBank.split(evaluating)}")
+            ]
+            TaskBank.write(
+                out,
+                rank,
+                evaluating,
+                records,
+                world_size=env.world_size,
+                n_items=len(env.items),
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    build_parser(parser)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--num-ranks", type=int, required=True)
+    parser.add_argument("--tasks-per-rank", type=int, required=True)
+    parser.add_argument("--eval-tasks-per-rank", type=int, required=True)
+    parser.add_argument("--min-eval-lines", type=int, required=True)
+    parser.add_argument("--max-eval-lines", type=int, required=True)
+    parser.add_argument("--seed", default=0, type=int)
+    main(**hierarchical_parse_args(parser))
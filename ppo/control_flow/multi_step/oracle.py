@@ -0,0 +1,84 @@
+from collections import deque
+
+from ppo.control_flow.multi_step.env import objective
+
+
+class Oracle:
+    """
+    Shortest sequences of lower-level actions that complete the active
+    subtask of a `multi_step.env.Env` with `lower_level="train-alone"`, found
+    by breadth-first search over (agent position, items held, cells emptied
+    so far). Walls are impassable and water can only be entered while holding
+    wood, which the bridge uses up. Wood (and the item to sell, for `sell`
+    subtasks) can be mined on the way.
+
+    `act` follows the plan until the subtask is complete and then plans for
+    the next one.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        actions = [a if type(a) is str else tuple(a) for a in env.lower_level_actions]
+        self.index = {a: i for i, a in enumerate(actions)}
+        self.moves = [a for a in actions if type(a) is tuple and any(a)]
+        self.state = None
+        self.plan = deque()
+
+    def act(self, state):
+        """
+        Index into `env.lower_level_actions` of the next action in `state`,
+        or None if the active subtask cannot be completed.
+        """
+        if state is not self.state or not self.plan:
+            self.state = state
+            self.plan = self.search(state)
+            if self.plan is None:
+                self.plan = deque()
+                return None
+        return self.plan.popleft()
+
+    def search(self, state):
+        env = self.env
+        interaction, item = state.lines[state.ptr].id
+        goal = objective(interaction, item)
+        objects = state.objects
+        # items worth holding: wood for bridges and the item to sell
+        wanted = {env.wood, item} if interaction == env.sell else {env.wood}
+        held = frozenset(i for i in wanted if state.inventory[i] > 0)
+        start = (tuple(state.agent_pos), held, frozenset())
+        parents = {start: None}
+        queue = deque([start])
+
+        def visit(child, node, action):
+            if child not in parents:
+                parents[child] = node, action
+                queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            pos, held, emptied = node
+            here = None if pos in emptied else objects.get(pos, None)
+            if here == goal and (interaction != env.sell or item in held):
+                plan = deque([self.index[interaction]])
+                while parents[node] is not None:
+                    node, action = parents[node]
+                    plan.appendleft(action)
+                return plan
+            if here in wanted and here not in held:
+                child = (pos, held | {here}, emptied | {pos})
+                visit(child, node, self.index[env.mine])
+            for move in self.moves:
+                i, j = pos[0] + move[0], pos[1] + move[1]
+                if not (0 <= i < env.world_size and 0 <= j < env.world_size):
+                    continue
+                there = None if (i, j) in emptied else objects.get((i, j), None)
+                if there == env.wall:
+                    continue
+                if there == env.water:
+                    if env.wood in held:
+                        # build a bridge
+                        child = ((i, j), held - {env.wood}, emptied | {(i, j)})
+                        visit(child, node, self.index[move])
+                else:
+                    visit(((i, j), held, emptied), node, self.index[move])
+        return None
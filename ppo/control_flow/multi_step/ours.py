@@ -13,6 +13,7 @@ from ppo.agent import Agent
 from ppo.control_flow.env import Action
 from ppo.control_flow.multi_step.env import Obs
 from ppo.distributions import FixedCategorical, Categorical
+from ppo.layers import ObjectList
 from ppo.utils import init_
 
 RecurrentState = namedtuple(
@@ -81,16 +82,22 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
         )
         self.conv_hidden_size = conv_hidden_size
         abstract_recurrence.Recurrence.__init__(self)
-        d, h, w = observation_space.obs.shape
-        self.kernel_size = min(d, kernel_size)
-        padding = optimal_padding(h, kernel_size, stride) + 1
-        self.conv = nn.Conv2d(
-            in_channels=d,
-            out_channels=conv_hidden_size,
-            kernel_size=self.kernel_size,
-            stride=stride,
-            padding=padding,
-        )
+        # object-list observations replace the convolutions with per-object
+        # features that are summed over objects
+        self.sparse = len(observation_space.obs.shape) == 2
+        if self.sparse:
+            self.conv = ObjectList(observation_space.obs, conv_hidden_size, nn.ReLU())
+        else:
+            d, h, w = observation_space.obs.shape
+            self.kernel_size = min(d, kernel_size)
+            padding = optimal_padding(h, kernel_size, stride) + 1
+            self.conv = nn.Conv2d(
+                in_channels=d,
+                out_channels=conv_hidden_size,
+                kernel_size=self.kernel_size,
+                stride=stride,
+                padding=padding,
+            )
         self.embed_lower = nn.Embedding(
             self.action_space_nvec.lower + 1, lower_embed_size
         )
@@ -107,20 +114,25 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
         self.zeta = init_(
             nn.Linear(conv_hidden_size + m_size + inventory_hidden_size, hidden_size)
         )
-        output_dim = conv_output_dimension(
-            h=h, padding=padding, kernel=kernel_size, stride=stride
-        )
-        self.gate_padding = optimal_padding(h, gate_conv_kernel_size, gate_stride)
-        output_dim2 = conv_output_dimension(
-            h=output_dim,
-            padding=self.gate_padding,
-            kernel=self.gate_kernel_size,
-            stride=self.gate_stride,
-        )
+        if self.sparse:
+            output_dim2 = 1
+            gate_kernel_area = 1
+        else:
+            output_dim = conv_output_dimension(
+                h=h, padding=padding, kernel=kernel_size, stride=stride
+            )
+            self.gate_padding = optimal_padding(h, gate_conv_kernel_size, gate_stride)
+            output_dim2 = conv_output_dimension(
+                h=output_dim,
+                padding=self.gate_padding,
+                kernel=self.gate_kernel_size,
+                stride=self.gate_stride,
+            )
+            gate_kernel_area = gate_conv_kernel_size ** 2
         z2_size = m_size + hidden2 + gate_hidden_size * output_dim2 ** 2
         self.d_gate = Categorical(z2_size, 2)
         self.linear1 = nn.Linear(
-            m_size, conv_hidden_size * gate_conv_kernel_size ** 2 * gate_hidden_size
+            m_size, conv_hidden_size * gate_kernel_area * gate_hidden_size
         )
         self.conv_bias = nn.Parameter(torch.zeros(gate_hidden_size))
         self.linear2 = nn.Linear(m_size + lower_embed_size, hidden2)
@@ -201,6 +213,54 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
             )
         )
 
+    def gate_conv(self, conv_output, m, obs):
+        """
+        Convolves the world features with kernels computed from the memory
+        `m`. For object lists the kernel is applied to every object and the
+        results are summed, giving a [N, gate_hidden_size, 1, 1] output.
+        """
+        N = m.size(0)
+        if self.sparse:
+            kernel = self.linear1(m).view(
+                N, self.gate_hidden_size, self.conv_hidden_size
+            )
+            h1 = (conv_output @ kernel.transpose(1, 2) + self.conv_bias).relu()
+            h1 = (h1 * ObjectList.mask(obs)).sum(1)
+            return h1.view(N, self.gate_hidden_size, 1, 1)
+        conv_kernel = self.linear1(m).view(
+            N,
+            self.gate_hidden_size,
+            self.conv_hidden_size,
+            self.gate_kernel_size,
+            self.gate_kernel_size,
+        )
+        return torch.cat(
+            [
+                F.conv2d(
+                    input=o.unsqueeze(0),
+                    weight=k,
+                    bias=self.conv_bias,
+                    stride=self.gate_stride,
+                    padding=self.gate_padding,
+                )
+                for o, k in zip(conv_output.unbind(0), conv_kernel.unbind(0))
+            ],
+            dim=0,
+        ).relu()
+
+    def standing_on(self, obs, channel_index):
+        """
+        Number of objects in channel `channel_index` under the agent.
+        """
+        if self.sparse:
+            same_cell = (obs[..., 1:] == obs[:, :1, 1:]).all(-1)
+            in_channel = obs[..., 0] == channel_index.unsqueeze(-1) + 1
+            return (same_cell & in_channel).sum(-1).float()
+        R = torch.arange(obs.size(0), device=obs.device)
+        channel = obs[R, channel_index]
+        agent_channel = obs[R, -1]
+        return (channel * agent_channel).view(obs.size(0), -1).sum(-1)
+
     def inner_loop(self, raw_inputs, rnn_hxs):
         T, N, dim = raw_inputs.shape
         inputs = self.parse_input(raw_inputs)
@@ -237,8 +297,12 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
 
         for t in range(T):
             self.print("p", p)
-            conv_output = self.conv(state.obs[t]).relu()
-            obs_conv_output = conv_output.sum(-1).sum(-1).view(N, -1)
+            if self.sparse:
+                conv_output = self.conv(state.obs[t])
+                obs_conv_output = conv_output.sum(1)
+            else:
+                conv_output = self.conv(state.obs[t]).relu()
+                obs_conv_output = conv_output.sum(-1).sum(-1).view(N, -1)
             inventory = self.embed_inventory(state.inventory[t])
             m = torch.cat([P, h], dim=-1) if self.no_pointer else M[R, p]
             zeta_input = torch.cat([m, obs_conv_output, inventory], dim=-1)
@@ -265,12 +329,8 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
                 ac, be, it, _ = lines[t][R, p].long().unbind(-1)  # N, 2
                 sell = (be == 2).long()
                 channel_index = 3 * sell + (it - 1) * (1 - sell)
-                channel = state.obs[t][R, channel_index]
-                agent_channel = state.obs[t][R, -1]
-                # self.print("channel", channel)
-                # self.print("agent_channel", agent_channel)
                 is_subtask = (ac == 0).flatten()
-                standing_on = (channel * agent_channel).view(N, -1).sum(-1)
+                standing_on = self.standing_on(state.obs[t], channel_index)
                 # correct_action = ((be - 1) == L[t]).float()
                 # self.print("be", be)
                 # self.print("L[t]", L[t])
@@ -291,27 +351,8 @@ class Recurrence(abstract_recurrence.Recurrence, recurrence.Recurrence):
             embedded_lower = self.embed_lower(lt.clone())
             self.print("L[t]", L[t])
             self.print("lines[R, p]", lines[t][R, p])
-            conv_kernel = self.linear1(m).view(
-                N,
-                self.gate_hidden_size,
-                self.conv_hidden_size,
-                self.gate_kernel_size,
-                self.gate_kernel_size,
-            )
             h2 = self.linear2(torch.cat([m, embedded_lower], dim=-1)).relu()
-            h1 = torch.cat(
-                [
-                    F.conv2d(
-                        input=o.unsqueeze(0),
-                        weight=k,
-                        bias=self.conv_bias,
-                        stride=self.gate_stride,
-                        padding=self.gate_padding,
-                    )
-                    for o, k in zip(conv_output.unbind(0), conv_kernel.unbind(0))
-                ],
-                dim=0,
-            ).relu()
+            h1 = self.gate_conv(conv_output, m, state.obs[t])
             z2 = torch.cat([h1.view(N, -1), h2, m], dim=-1)
             d_gate = self.d_gate(z2)
             self.sample_new(DG[t], d_gate)
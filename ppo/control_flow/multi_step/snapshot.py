@@ -0,0 +1,70 @@
+import numpy as np
+
+# state of a numpy.random.RandomState (MT19937)
+RANDOM_DTYPE = np.dtype(
+    [
+        ("key", np.uint32, (624,)),
+        ("pos", np.int32),
+        ("has_gauss", np.int8),
+        ("cached_gaussian", np.float64),
+    ]
+)
+
+
+def task_dtype(n_lines, world_size, n_items):
+    """
+    Layout of a task with an `n_lines` program: the lines as encoded by
+    `Env.preprocess_line`, the world as one object index (+ 1, 0 for empty)
+    per cell, the agent position and the inventory count of every item.
+    """
+    return np.dtype(
+        [
+            ("lines", np.int8, (n_lines, 4)),
+            ("world", np.int8, (world_size, world_size)),
+            ("agent_pos", np.int8, (2,)),
+            ("inventory", np.int8, (n_items,)),
+        ]
+    )
+
+
+def pack(lines, world, agent_pos, inventory, random_state=None) -> bytes:
+    """
+    Packs a task (and optionally a `RandomState.get_state()`) as
+
+        n_lines: uint8 | has_random: uint8 | task_dtype record | RANDOM_DTYPE record
+    """
+    record = np.zeros((), dtype=task_dtype(len(lines), len(world), len(inventory)))
+    record["lines"] = lines
+    record["world"] = world
+    record["agent_pos"] = agent_pos
+    record["inventory"] = inventory
+    data = bytes([len(lines), random_state is not None]) + record.tobytes()
+    if random_state is not None:
+        _, key, pos, has_gauss, cached_gaussian = random_state
+        random_record = np.array(
+            (key, pos, has_gauss, cached_gaussian), dtype=RANDOM_DTYPE
+        )
+        data += random_record.tobytes()
+    return data
+
+
+def unpack(data: bytes, world_size, n_items):
+    """
+    Returns the task record and the RandomState state (or None) packed by
+    `pack`.
+    """
+    n_lines, has_random = data[0], data[1]
+    dtype = task_dtype(n_lines, world_size, n_items)
+    record = np.frombuffer(data, dtype=dtype, count=1, offset=2)[0]
+    random_state = None
+    if has_random:
+        offset = 2 + dtype.itemsize
+        r = np.frombuffer(data, dtype=RANDOM_DTYPE, count=1, offset=offset)[0]
+        random_state = (
+            "MT19937",
+            r["key"].copy(),
+            int(r["pos"]),
+            int(r["has_gauss"]),
+            float(r["cached_gaussian"]),
+        )
+    return record, random_state
@@ -0,0 +1,72 @@
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from ppo.control_flow.multi_step.snapshot import task_dtype
+
+
+class TaskBank:
+    """
+    Pre-generated tasks in the layout of `snapshot.task_dtype`, stored as one
+    memory-mapped .npy file per program length:
+
+        <path>/meta.json
+        <path>/{train,eval}/rank<rank>/<program length>.npy
+
+    Shards are read in order, so the same bank and seed always produce the
+    same sequence of tasks.
+    """
+
+    def __init__(self, path, rank, evaluating):
+        with Path(path, "meta.json").open() as f:
+            self.meta = json.load(f)
+        ranks = sorted(Path(path, self.split(evaluating)).glob("rank*"))
+        assert ranks, f"No shards in {path} for {self.split(evaluating)}"
+        directory = ranks[rank % len(ranks)]
+        self.shards = {
+            int(p.stem): np.load(p, mmap_mode="r") for p in directory.glob("*.npy")
+        }
+        self.cursors = Counter()
+
+    @staticmethod
+    def split(evaluating):
+        return "eval" if evaluating else "train"
+
+    def sample(self, random, min_lines, max_lines):
+        """
+        Returns the next record of a program length in [min_lines, max_lines]
+        (chosen in proportion to shard size), or None if there is none.
+        """
+        lengths = [n for n in sorted(self.shards) if min_lines <= n <= max_lines]
+        if not lengths:
+            return None
+        sizes = np.array([len(self.shards[n]) for n in lengths])
+        n = lengths[random.choice(len(lengths), p=sizes / sizes.sum())]
+        record = self.shards[n][self.cursors[n] % len(self.shards[n])]
+        self.cursors[n] += 1
+        return record
+
+    @staticmethod
+    def write(path, rank, evaluating, records, world_size, n_items):
+        """
+        `records` are (lines, world, agent_pos) triples as produced by
+        `Env.encode_task`. Inventories start empty.
+        """
+        directory = Path(path, TaskBank.split(evaluating), f"rank{rank}")
+        directory.mkdir(parents=True, exist_ok=True)
+        shards = defaultdict(list)
+        for lines, world, agent_pos in records:
+            shards[len(lines)].append((lines, world, agent_pos, np.zeros(n_items)))
+        for n, shard in shards.items():
+            array = np.array(shard, dtype=task_dtype(n, world_size, n_items))
+            np.save(Path(directory, f"{n}.npy"), array)
+
+    @staticmethod
+    def write_meta(path, **meta):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        with Path(path, "meta.json").open("w") as f:
+            json.dump(
+                meta, f, indent=2, default=lambda x: getattr(x, "__name__", str(x))
+            )
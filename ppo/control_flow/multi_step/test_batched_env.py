@@ -0,0 +1,32 @@
+import unittest
+
+from ppo.control_flow.multi_step.batched_env import check
+from ppo.control_flow.multi_step.test_env import make_env
+
+
+class TestBatchedEnv(unittest.TestCase):
+    def check(self, **kwargs):
+        for seed in range(3):
+            with self.subTest(seed=seed, **kwargs):
+                check(
+                    lambda **k: make_env(**k, **kwargs),
+                    num_envs=6,
+                    num_steps=300,
+                    seed=10 * seed,
+                )
+
+    def test_train_alone(self):
+        self.check(lower_level="train-alone")
+
+    def test_hardcoded(self):
+        self.check(lower_level="hardcoded")
+
+    def test_macro_step(self):
+        self.check(lower_level="hardcoded", macro_step=True)
+
+    def test_pre_trained(self):
+        self.check(lower_level="pre-trained")
+
+
+if __name__ == "__main__":
+    unittest.main()
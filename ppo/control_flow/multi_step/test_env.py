@@ -0,0 +1,321 @@
+import copy
+import pickle
+import unittest
+
+import numpy as np
+import torch
+from torch import nn
+
+from ppo.layers import ObjectList
+from ppo.control_flow.lines import Subtask, If, Else, While
+from ppo.control_flow.multi_step import snapshot
+from ppo.control_flow.multi_step.env import Env, feasibility, object_list
+
+
+def make_env(seed=0, **kwargs):
+    args = dict(
+        min_eval_lines=1,
+        max_eval_lines=10,
+        min_lines=1,
+        max_lines=10,
+        flip_prob=0.5,
+        num_subtasks=12,
+        max_nesting_depth=1,
+        eval_condition_size=False,
+        single_control_flow_type=False,
+        no_op_limit=30,
+        time_to_waste=3,
+        subtasks_only=False,
+        break_on_fail=False,
+        max_loops=3,
+        rank=0,
+        lower_level="train-alone",
+        control_flow_types=[Subtask, If, Else, While],
+        seed=seed,
+        evaluating=False,
+        temporal_extension=True,
+        term_on=[Env.mine, Env.sell],
+        max_world_resamples=50,
+        max_while_loops=10,
+        use_water=True,
+        max_failure_sample_prob=0.3,
+        one_condition=False,
+        failure_buffer_size=500,
+        reject_while_prob=0.6,
+        long_jump=False,
+        world_size=6,
+    )
+    args.update(kwargs)
+    return Env(**args)
+
+
+def flatten(x):
+    if isinstance(x, dict):
+        x = list(x.values())
+    if isinstance(x, (list, tuple)):
+        for y in x:
+            yield from flatten(y)
+    else:
+        yield x
+
+
+class TestFeasibility(unittest.TestCase):
+    def sample_program(self, env):
+        n_lines = env.random.randint(env.min_lines, env.max_lines + 1)
+        line_types = env.sample_line_types(
+            n_lines, legal_lines=env.control_flow_types
+        )
+        lines = list(env.assign_line_ids(line_types))
+        return lines, env.compile(lines)
+
+    def sample_counts(self, env, size=8):
+        counts = env.random.randint(
+            4, size=(size, len(env.world_contents)), dtype=np.int64
+        )
+        counts[:, env.object_index[env.agent]] = 1
+        return counts
+
+    def test_cached_matches_uncached(self):
+        env = make_env()
+        rules = env.feasibility_rules
+        for _ in range(200):
+            _, program = self.sample_program(env)
+            for c in self.sample_counts(env):
+                c = c.tobytes()
+                expected = feasibility.__wrapped__(program, c, rules)
+                self.assertEqual(feasibility(program, c, rules), expected)
+                # second lookup is served from the cache
+                self.assertEqual(feasibility(program, c, rules), expected)
+        self.assertGreater(feasibility.cache_info().hits, 0)
+
+    def test_env_can_be_copied(self):
+        env = make_env()
+        for _ in range(5):
+            env.reset()
+        for copy_env in (copy.deepcopy, lambda e: pickle.loads(pickle.dumps(e))):
+            clone = copy_env(env)
+            self.assertEqual(clone.snapshot(), env.snapshot())
+            self.assertEqual(clone.feasibility_rules, env.feasibility_rules)
+            clone.reset()
+            env.reset()
+            self.assertEqual(clone.snapshot(), env.snapshot())
+
+    def test_feasible_picks_first_feasible_world(self):
+        env = make_env(reject_while_prob=0)
+        rules = env.feasibility_rules
+        for _ in range(100):
+            lines, program = self.sample_program(env)
+            counts = self.sample_counts(env)
+            expected = next(
+                (
+                    k
+                    for k, c in enumerate(counts)
+                    if feasibility(program, c.tobytes(), rules)[0]
+                ),
+                None,
+            )
+            self.assertEqual(env.feasible(counts, lines), expected)
+
+
+class TestWorldSize(unittest.TestCase):
+    def test_records_sampled_world_size(self):
+        env = make_env(min_world_size=3)
+        sizes = set()
+        for _ in range(100):
+            env.reset()
+            size = env.state.world_size
+            sizes.add(size)
+            for (i, j), o in env.state.objects.items():
+                if max(i, j) >= size:
+                    self.assertEqual(o, Env.wall)
+        self.assertEqual(sizes, {3, 4, 5, 6})
+
+    def test_decoded_tasks_have_no_world_size(self):
+        env = make_env()
+        env.reset()
+        env.restore(env.snapshot())
+        self.assertIsNone(env.state.world_size)
+
+
+def dense_world(objects, world_shape):
+    """
+    Inverts `object_list` for the objects that it kept.
+    """
+    world = np.zeros(world_shape, dtype=np.float32)
+    for c, i, j in objects[objects[:, 0] > 0].astype(int):
+        world[c - 1, i, j] = 1
+    return world
+
+
+class TestObjectList(unittest.TestCase):
+    def test_matches_dense_observation(self):
+        dense = make_env(seed=0, lower_level="hardcoded")
+        capacity = dense.world_size ** 2 * len(Env.world_contents)
+        sparse = make_env(seed=0, lower_level="hardcoded", sparse_obs=capacity)
+        nvec = dense.action_space.nvec
+        random = np.random.RandomState(0)
+        obs1, obs2 = dense.reset(), sparse.reset()
+        for _ in range(300):
+            world, objects = obs1["obs"], obs2["obs"]
+            self.assertEqual(objects.shape, (capacity, 3))
+            self.assertTrue(sparse.observation_space.spaces["obs"].contains(objects))
+            self.assertTrue(np.array_equal(dense_world(objects, world.shape), world))
+            # the agent comes first and everything after the objects is padding
+            agent = Env.object_index[Env.agent]
+            self.assertEqual(
+                objects[0].tolist(), [agent + 1, *np.argwhere(world[agent])[0]]
+            )
+            n = int(world.sum())
+            self.assertTrue((objects[:n, 0] > 0).all())
+            self.assertFalse(objects[n:].any())
+
+            action = random.randint(nvec)
+            obs1, reward1, done1, _ = dense.step(action)
+            obs2, reward2, done2, _ = sparse.step(action)
+            self.assertEqual((reward1, done1), (reward2, done2))
+            if done1:
+                obs1, obs2 = dense.reset(), sparse.reset()
+
+    def test_keeps_nearest_objects(self):
+        agent = Env.object_index[Env.agent]
+        wood, gold = Env.object_index[Env.wood], Env.object_index[Env.gold]
+        world = np.zeros((1, len(Env.world_contents), 5, 5))
+        world[0, agent, 2, 3] = 1
+        world[0, wood, 0, 0] = 1  # distance 3
+        world[0, gold, 2, 1] = 1  # distance 2
+        world[0, wood, 3, 3] = 1  # distance 1
+        world[0, gold, 3, 3] = 1  # distance 1, on the same cell
+        expected = [
+            [agent + 1, 2, 3],
+            [wood + 1, 3, 3],
+            [gold + 1, 3, 3],
+            [gold + 1, 2, 1],
+            [wood + 1, 0, 0],
+        ]
+        for capacity in (1, 3, 5, 8):
+            objects = object_list(world, capacity, agent)
+            self.assertEqual(objects.shape, (1, capacity, 3))
+            padding = [[0, 0, 0]] * max(0, capacity - len(expected))
+            self.assertEqual(objects[0].tolist(), expected[:capacity] + padding)
+
+    def test_agent_only(self):
+        agent = Env.object_index[Env.agent]
+        world = np.zeros((2, len(Env.world_contents), 4, 4))
+        world[0, agent, 3, 0] = 1
+        world[1, agent, 0, 0] = 1
+        objects = object_list(world, 3, agent)
+        self.assertEqual(objects[0].tolist(), [[agent + 1, 3, 0], [0, 0, 0], [0, 0, 0]])
+        # an agent at the origin is told apart from padding by its type
+        self.assertEqual(objects[1].tolist(), [[agent + 1, 0, 0], [0, 0, 0], [0, 0, 0]])
+
+    def test_layer_ignores_padding(self):
+        env = make_env(seed=0, sparse_obs=30)
+        torch.manual_seed(0)
+        layer = ObjectList(env.world_space(), out_size=8, activation=nn.ReLU())
+        objects = np.stack([env.reset()["obs"] for _ in range(4)])
+        n = (objects[..., 0] > 0).sum(-1)
+        features = layer(torch.as_tensor(objects)).detach().numpy()
+        for x, k in zip(features, n):
+            self.assertFalse(x[k:].any())
+        # extra padding leaves the features of the objects unchanged
+        padded = np.pad(objects, ((0, 0), (0, 5), (0, 0)), "constant")
+        padded = layer(torch.as_tensor(padded)).detach().numpy()
+        self.assertTrue(np.allclose(padded[:, : objects.shape[1]], features))
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_pack_unpack(self):
+        random = np.random.RandomState(0)
+        world_size, n_items = 5, 3
+        lines = random.randint(10, size=(7, 4))
+        world = random.randint(8, size=(world_size, world_size))
+        agent_pos = [1, 4]
+        inventory = [0, 2, 1]
+        for random_state in (None, random.get_state()):
+            data = snapshot.pack(lines, world, agent_pos, inventory, random_state)
+            record, unpacked = snapshot.unpack(data, world_size, n_items)
+            self.assertTrue(np.array_equal(record["lines"], lines))
+            self.assertTrue(np.array_equal(record["world"], world))
+            self.assertEqual(record["agent_pos"].tolist(), agent_pos)
+            self.assertEqual(record["inventory"].tolist(), inventory)
+            if random_state is None:
+                self.assertIsNone(unpacked)
+            else:
+                name, key, *rest = random_state
+                self.assertEqual(unpacked[0], name)
+                self.assertTrue(np.array_equal(unpacked[1], key))
+                self.assertEqual(list(unpacked[2:]), rest)
+
+    @staticmethod
+    def rollout(env, obs, actions):
+        trajectory = [obs]
+        for action in actions:
+            obs, reward, done, _ = env.step(action)
+            trajectory.append((obs, reward, done))
+            if done:
+                break
+        return trajectory
+
+    def assertTrajectoriesEqual(self, trajectory1, trajectory2):
+        self.assertEqual(len(trajectory1), len(trajectory2))
+        for step1, step2 in zip(flatten(trajectory1), flatten(trajectory2)):
+            self.assertTrue(np.array_equal(step1, step2))
+
+    def test_restore_replays_episode(self):
+        env = make_env(seed=0, lower_level="hardcoded")
+        nvec = env.action_space.nvec
+        random = np.random.RandomState(0)
+        for _ in range(20):
+            obs = env.reset()
+            data = env.snapshot(include_random=True)
+            actions = random.randint(nvec, size=(50, len(nvec)))
+            expected = self.rollout(env, obs, actions)
+            # a fresh env, so that nothing but the snapshot carries over
+            other = make_env(seed=1, lower_level="hardcoded")
+            obs = other.restore(data)
+            self.assertTrajectoriesEqual(self.rollout(other, obs, actions), expected)
+
+    def test_restore_without_random_state(self):
+        env = make_env(seed=0, lower_level="hardcoded")
+        nvec = env.action_space.nvec
+        random = np.random.RandomState(0)
+        for _ in range(20):
+            obs = env.reset()
+            data = env.snapshot()
+            random_state = env.random.get_state()
+            actions = random.randint(nvec, size=(50, len(nvec)))
+            expected = self.rollout(env, obs, actions)
+            env.random.set_state(random_state)
+            obs = env.restore(data)
+            self.assertTrajectoriesEqual(self.rollout(env, obs, actions), expected)
+
+
+class TestSeeding(unittest.TestCase):
+    @staticmethod
+    def tasks(env, n=20):
+        tasks = []
+        for _ in range(n):
+            env.reset()
+            tasks.append(env.snapshot())
+        return tasks
+
+    def test_tasks_depend_only_on_env_seed(self):
+        np.random.seed(0)
+        expected = self.tasks(make_env(seed=3))
+        np.random.seed(1)
+        other = make_env(seed=4)
+        self.tasks(other)
+        self.assertEqual(self.tasks(make_env(seed=3)), expected)
+
+    def test_reseeding_replays_without_touching_global_rng(self):
+        env = make_env()
+        state = np.random.get_state()[1].copy()
+        env.seed(7)
+        expected = self.tasks(env)
+        env.seed(7)
+        self.assertEqual(self.tasks(env), expected)
+        self.assertTrue(np.array_equal(np.random.get_state()[1], state))
+
+
+if __name__ == "__main__":
+    unittest.main()
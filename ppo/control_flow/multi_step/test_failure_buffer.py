@@ -0,0 +1,76 @@
+import copy
+import unittest
+
+import numpy as np
+
+from common.segment_tree import MinSegmentTree
+from ppo.control_flow.multi_step.failure_buffer import FailureBuffer
+
+
+def priorities(buffer):
+    return {key: buffer.sum_tree[slot] for key, slot in buffer.slots.items()}
+
+
+class TestMinSegmentTree(unittest.TestCase):
+    def test_find_min_idx_after_updates(self):
+        random = np.random.RandomState(0)
+        capacity = 16
+        tree = MinSegmentTree(capacity)
+        values = [float("inf")] * capacity
+        for _ in range(500):
+            idx = random.randint(capacity)
+            value = float("inf") if random.random() < 0.2 else random.random()
+            tree[idx] = value
+            values[idx] = value
+            self.assertEqual(tree.min(), min(values))
+            self.assertEqual(values[tree.find_min_idx()], min(values))
+
+
+class TestFailureBuffer(unittest.TestCase):
+    def test_sampling_is_proportional_to_priority(self):
+        buffer = FailureBuffer(capacity=4)
+        for task in [b"a", b"a", b"a", b"b", b"c", b"c"]:
+            buffer.append(task)
+        expected = priorities(buffer)
+        total = sum(expected.values())
+
+        random = np.random.RandomState(0)
+        trials = 5000
+        counts = dict.fromkeys(expected, 0)
+        for _ in range(trials):
+            counts[copy.deepcopy(buffer).sample(random)] += 1
+        for key, priority in expected.items():
+            self.assertAlmostEqual(counts[key] / trials, priority / total, delta=0.03)
+
+    def test_sample_removes_task(self):
+        buffer = FailureBuffer(capacity=4)
+        for task in [b"a", b"b"]:
+            buffer.append(task)
+        random = np.random.RandomState(0)
+        sampled = {buffer.sample(random), buffer.sample(random)}
+        self.assertEqual(sampled, {b"a", b"b"})
+        self.assertEqual(len(buffer), 0)
+
+    def test_evicts_minimum_when_full(self):
+        buffer = FailureBuffer(capacity=3)
+        for task in [b"a", b"a", b"a", b"b", b"c", b"c"]:
+            buffer.append(task)
+        self.assertEqual(len(buffer), 3)
+        before = priorities(buffer)
+        minimum = min(before, key=before.get)
+        self.assertEqual(minimum, b"b")
+
+        buffer.append(b"d")
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(set(buffer.slots), set(before) - {minimum} | {b"d"})
+
+    def test_refailing_task_keeps_its_slot(self):
+        buffer = FailureBuffer(capacity=3)
+        for task in [b"a", b"b", b"a"]:
+            buffer.append(task)
+        self.assertEqual(len(buffer), 2)
+        self.assertGreater(buffer.failures[b"a"], buffer.failures[b"b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import functools
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from ppo.control_flow.lines import Line, Subtask, If, Else, While, Loop, Padding
+
+SUBTASK, IF, ELSE, WHILE, LOOP, PADDING = map(
+    Line.types.index, (Subtask, If, Else, While, Loop, Padding)
+)
+
+
+class Program:
+    """
+    Jump-table form of a control-flow program.
+
+    `next_if_true[i]` / `next_if_false[i]` are the lines that follow line `i`
+    when its condition evaluates True / False. A pointer equal to `len(self)`
+    means the program has terminated. An `Else` ignores the condition bit and
+    takes the negation of the evaluation recorded for the `If` at
+    `matching_if[i]` (the explicit form of the if/else stack that used to
+    live in `Env.line_generator`).
+    """
+
+    def __init__(self, types: Sequence[int], ids=None):
+        types = np.asarray(types, dtype=int)
+        n = len(types)
+        self.types = types
+        self.ids = None if ids is None else np.asarray(ids)
+        self.next_if_true = np.full(n, n)
+        self.next_if_false = np.full(n, n)
+        self.matching_if = np.full(n, -1)
+        conditions = []
+        assigned = np.zeros(n, dtype=bool)
+        for i, t in enumerate(types):
+            line_type = Line.types[t]
+            if line_type is Else:
+                self.matching_if[i] = conditions[-1]
+            if line_type is not Padding:
+                # transitions yield the False target before the True target
+                for _from, _to in line_type.transitions(i, conditions):
+                    if assigned[_from]:
+                        self.next_if_true[_from] = _to
+                    else:
+                        self.next_if_false[_from] = _to
+                        assigned[_from] = True
+
+    def __len__(self):
+        return len(self.types)
+
+    @property
+    def start(self):
+        return 0 if len(self) else None
+
+    def next(self, i, condition, if_evaluations):
+        """
+        Returns the line after `i` (or None on termination).
+        `if_evaluations` is a per-line array recording `If` evaluations.
+        """
+        t = self.types[i]
+        if t == ELSE:
+            condition = not if_evaluations[self.matching_if[i]]
+        else:
+            condition = bool(condition)
+        if t == IF:
+            if_evaluations[i] = condition
+        i = (self.next_if_true if condition else self.next_if_false)[i]
+        return None if i >= len(self) else int(i)
+
+    def spans(self, start, stop):
+        """
+        Yields (i, j) pairs where line `i` has type `start` and `j` is the next
+        line of type `stop`. Pairs do not overlap.
+        """
+        j = -1
+        for i in np.flatnonzero(self.types == start):
+            if i > j:
+                stops = np.flatnonzero(self.types[i + 1 :] == stop)
+                j = len(self) if len(stops) == 0 else i + 1 + stops[0]
+                yield i, (None if j == len(self) else j)
+
+
+@functools.lru_cache(maxsize=10000)
+def compile_program(lines: Tuple[Line, ...], encode=None) -> Program:
+    """
+    Compiles `lines`, caching by program content. `encode` maps a line to the
+    numeric ids stored in `Program.ids` (e.g. `Env.preprocess_line`).
+    """
+    types = [Line.types.index(type(l)) for l in lines]
+    ids = None if encode is None else [encode(l) for l in lines]
+    return Program(types, ids)
+
+
+class Programs:
+    """
+    A batch of programs padded to `n_lines` so that the pointers of the whole
+    batch can be advanced with NumPy indexing. Row `i` holds one program;
+    pointers at or beyond `lengths[i]` are terminal.
+    """
+
+    def __init__(self, n_programs, n_lines, ids_shape=()):
+        shape = (n_programs, n_lines + 1)
+        self.types = np.full(shape, PADDING)
+        self.ids = np.zeros(shape + tuple(ids_shape), dtype=int)
+        self.next_if_true = np.zeros(shape, dtype=int)
+        self.next_if_false = np.zeros(shape, dtype=int)
+        self.matching_if = np.zeros(shape, dtype=int)
+        self.lengths = np.zeros(n_programs, dtype=int)
+
+    def __setitem__(self, i, program: Program):
+        n = len(program)
+        self.lengths[i] = n
+        self.types[i] = PADDING
+        self.types[i, :n] = program.types
+        self.ids[i] = 0
+        if program.ids is not None:
+            self.ids[i, :n] = program.ids
+        self.next_if_true[i] = n
+        self.next_if_true[i, :n] = program.next_if_true
+        self.next_if_false[i] = n
+        self.next_if_false[i, :n] = program.next_if_false
+        self.matching_if[i] = 0
+        self.matching_if[i, :n] = np.maximum(program.matching_if, 0)
+
+    def terminal(self, rows, ptr):
+        return ptr >= self.lengths[rows]
+
+    def next(self, rows, ptr, condition, if_evaluations):
+        """
+        Vectorized `Program.next` for programs `rows` at lines `ptr`.
+        `if_evaluations` has shape [n_programs, n_lines + 1] and is updated
+        in place.
+        """
+        t = self.types[rows, ptr]
+        is_else = t == ELSE
+        matching = if_evaluations[rows, self.matching_if[rows, ptr]]
+        condition = np.where(is_else, ~matching, condition.astype(bool))
+        is_if = t == IF
+        if_evaluations[rows[is_if], ptr[is_if]] = condition[is_if]
+        return np.where(
+            condition, self.next_if_true[rows, ptr], self.next_if_false[rows, ptr]
+        )
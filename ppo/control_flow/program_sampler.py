@@ -0,0 +1,251 @@
+import functools
+from typing import Callable, FrozenSet, List, Optional, Sequence, Type
+
+import numpy as np
+from numpy.random.mtrand import RandomState
+
+from ppo.control_flow.lines import (
+    Line,
+    Subtask,
+    If,
+    Else,
+    EndIf,
+    While,
+    EndWhile,
+    Loop,
+    EndLoop,
+)
+
+ENDS = {If: EndIf, While: EndWhile, Loop: EndLoop}
+
+
+def geometric_weights(_min, _max, p=0.5):
+    """
+    Distribution of `lines.sample(random, _min, _max, p)` over `_min.._max`.
+    """
+    k = np.arange(_max - _min + 1)
+    weights = p * (1 - p) ** k
+    weights[-1] = (1 - p) ** k[-1]
+    return weights
+
+
+class ProgramSampler:
+    """
+    Samples the line types of control-flow programs from precomputed tables.
+
+    `blocks[d, n, mask]` is the total weight of n-line blocks with `d` levels
+    of nesting left whose statements include exactly the `features` in
+    `mask` (bit `i` stands for `features[i]`). A statement's feature is its
+    type, where `If` means an `If` without an `Else`. By default the weight
+    of a block is its probability under `Line.generate_types`, so programs
+    are drawn from the same distribution, conditioned on `accept`. With
+    `uniform=True` the weight is the number of distinct programs, so every
+    program of a given length is equally likely.
+
+    Sampling walks the tables top-down: every choice is drawn in proportion
+    to the weight of the programs that remain reachable, so it never retries
+    and takes time linear in the length of the program.
+    """
+
+    def __init__(
+        self,
+        legal_lines: Sequence[Type[Line]],
+        max_lines: int,
+        max_nesting_depth: int,
+        uniform: bool = False,
+        features: Sequence[Type[Line]] = (),
+    ):
+        assert Subtask in legal_lines
+        self.legal_lines = list(legal_lines)
+        self.max_lines = max_lines
+        self.max_nesting_depth = max_nesting_depth
+        self.uniform = uniform
+        self.features = list(features)
+        self.n_masks = 2 ** len(self.features)
+        masks = np.arange(self.n_masks)
+        self.union = np.bitwise_or.outer(masks, masks)
+
+        shape = (max_nesting_depth + 1, max_lines + 1, self.n_masks)
+        self.blocks = np.zeros(shape)
+        # heads[t][d, m] is the weight of a single t-statement spanning m lines
+        self.heads = {t: np.zeros(shape) for t in self.legal_lines}
+        # terms[d, n] holds the (type, length) choices for the first statement
+        # of an n-line block and their cumulative weights per mask
+        self.terms = {}
+        for d in range(max_nesting_depth + 1):
+            self.blocks[d, 0, 0] = 1
+            for n in range(1, max_lines + 1):
+                for t in self.heads:
+                    self.heads[t][d, n] = self.head(t, n, d)
+                choices, weights = [], []
+                legal = self.legal(n, d)
+                for t in legal:
+                    lengths, w = self.length_weights(t, n, len(legal))
+                    pairs = (
+                        w[:, None, None]
+                        * self.heads[t][d, lengths][:, :, None]
+                        * self.blocks[d, n - lengths][:, None, :]
+                    )
+                    choices += [(t, int(m)) for m in lengths]
+                    weights.append(self.unite(pairs))
+                weights = np.cumsum(np.concatenate(weights), axis=0)
+                self.terms[d, n] = choices, weights
+                self.blocks[d, n] = weights[-1]
+
+    def legal(self, n, d):
+        return [
+            l
+            for l in self.legal_lines
+            if l.required_lines <= n and l.required_depth <= d
+        ]
+
+    def length_weights(self, t, n, n_legal):
+        """
+        Lengths that a t-statement can span at the start of an n-line block,
+        and the weight of choosing each.
+        """
+        if self.uniform:
+            if t is Subtask:
+                return np.array([1]), np.ones(1)
+            lengths = np.arange(t.required_lines, n + 1)
+            return lengths, np.ones(len(lengths))
+        lengths = np.arange(t.required_lines, n + 1)
+        return lengths, geometric_weights(t.required_lines, n) / n_legal
+
+    def split_weights(self, m):
+        """
+        Lengths of the `If` branch of an m-line `Else` statement, and their
+        weights.
+        """
+        lengths = np.arange(1, m - 3)
+        if self.uniform:
+            return lengths, np.ones(len(lengths))
+        return lengths, geometric_weights(1, m - 4)
+
+    def head(self, t, m, d):
+        if t is Subtask:
+            # Subtask.generate_types continues with a block of its own
+            return self.blocks[d, m - 1]
+        if d == 0 or m < t.required_lines:
+            return np.zeros(self.n_masks)
+        if t is Else:
+            lengths, w = self.split_weights(m)
+            pairs = (
+                w[:, None, None]
+                * self.blocks[d - 1, lengths][:, :, None]
+                * self.blocks[d - 1, m - 3 - lengths][:, None, :]
+            )
+            return self.add_feature(self.unite(pairs).sum(0), t)
+        return self.add_feature(self.blocks[d - 1, m - 2], t)
+
+    def unite(self, x):
+        """
+        Sums `x[..., a, b]` into `[..., a | b]`.
+        """
+        return np.stack(
+            [x[..., self.union == mask].sum(-1) for mask in range(self.n_masks)], -1
+        )
+
+    def with_feature(self, mask, t):
+        if t in self.features:
+            return mask | (1 << self.features.index(t))
+        return mask
+
+    def add_feature(self, x, t):
+        y = np.zeros_like(x)
+        for mask in range(self.n_masks):
+            y[..., self.with_feature(mask, t)] += x[..., mask]
+        return y
+
+    def present(self, mask) -> FrozenSet[Type[Line]]:
+        return frozenset(t for i, t in enumerate(self.features) if mask >> i & 1)
+
+    def accepted(self, accept):
+        if accept is None:
+            return np.ones(self.n_masks)
+        return np.array([accept(self.present(m)) for m in range(self.n_masks)], float)
+
+    def weight(self, n, accept=None) -> float:
+        """
+        Number of n-line programs whose features satisfy `accept` (with
+        `uniform=True`), or their probability under `Line.generate_types`.
+        """
+        return float(self.blocks[-1, n] @ self.accepted(accept))
+
+    def sample(
+        self,
+        n: int,
+        random: RandomState,
+        accept: Optional[Callable[[FrozenSet[Type[Line]]], bool]] = None,
+    ) -> List[Type[Line]]:
+        """
+        Line types of an n-line program. `accept` receives the set of
+        `features` present in the program.
+        """
+        assert 0 <= n <= self.max_lines
+        mask = choose(self.blocks[-1, n] * self.accepted(accept), random)
+        return list(self.block(n, self.max_nesting_depth, mask, random))
+
+    def block(self, n, d, mask, random):
+        while n > 0:
+            choices, weights = self.terms[d, n]
+            k = choose_cumulative(weights[:, mask], random)
+            t, m = choices[k]
+            pairs = np.outer(self.heads[t][d, m], self.blocks[d, n - m])
+            pairs *= self.union == mask
+            a, mask = np.unravel_index(choose(pairs, random), pairs.shape)
+            yield from self.statement(t, m, d, a, random)
+            n -= m
+
+    def statement(self, t, m, d, mask, random):
+        if t is Subtask:
+            yield Subtask
+            yield from self.block(m - 1, d, mask, random)
+        elif t is Else:
+            lengths, w = self.split_weights(m)
+            triples = (
+                w[:, None, None]
+                * self.blocks[d - 1, lengths][:, :, None]
+                * self.blocks[d - 1, m - 3 - lengths][:, None, :]
+            )
+            triples *= self.with_feature(self.union, t) == mask
+            i, a, b = np.unravel_index(choose(triples, random), triples.shape)
+            yield If
+            yield from self.block(lengths[i], d - 1, a, random)
+            yield Else
+            yield from self.block(m - 3 - lengths[i], d - 1, b, random)
+            yield EndIf
+        else:
+            masks = np.arange(self.n_masks)
+            weights = self.blocks[d - 1, m - 2] * (self.with_feature(masks, t) == mask)
+            yield t
+            yield from self.block(m - 2, d - 1, choose(weights, random), random)
+            yield ENDS[t]
+
+
+def choose_cumulative(cumulative, random):
+    if cumulative[-1] <= 0:
+        raise RuntimeError("No program satisfies the constraints.")
+    return int(
+        np.searchsorted(cumulative, random.random() * cumulative[-1], side="right")
+    )
+
+
+def choose(weights, random):
+    return choose_cumulative(np.cumsum(weights.ravel()), random)
+
+
+@functools.lru_cache(maxsize=100)
+def program_sampler(
+    legal_lines: tuple,
+    max_lines: int,
+    max_nesting_depth: int,
+    uniform: bool = False,
+    features: tuple = (),
+) -> ProgramSampler:
+    """
+    Shares samplers (and their tables) between the envs of a process.
+    """
+    return ProgramSampler(
+        legal_lines, max_lines, max_nesting_depth, uniform=uniform, features=features
+    )
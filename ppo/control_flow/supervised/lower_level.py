@@ -0,0 +1,151 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.optim as optim
+from gym import spaces
+from rl_utils import hierarchical_parse_args
+from torch.utils.tensorboard import SummaryWriter
+from tqdm import tqdm
+
+import ppo.control_flow.multi_step.env
+from ppo.agent import Agent
+from ppo.control_flow.multi_step.demos import Demonstrations
+from ppo.control_flow.multi_step.env import Env, Obs
+
+
+def main(
+    demos: Path,
+    log_dir: Path,
+    seed: int,
+    batch_size: int,
+    lr: float,
+    num_epochs: int,
+    eval_fraction: float,
+    log_interval: int,
+    no_cuda: bool,
+    network_args: dict,
+    env_args: dict,
+):
+    """
+    Fits `ppo.agent.LowerLevel` to oracle demonstrations (see `make_demos`)
+    by behavior cloning and saves it to <log_dir>/lower.pt, with its config
+    in <log_dir>/lower.json, in the format of `--lower-level-load-path` and
+    `--lower-level-config`.
+    """
+    torch.manual_seed(seed)
+    use_cuda = not no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    writer = SummaryWriter(str(log_dir))
+
+    # the env only provides the observation space and `world_obs`
+    env = Env(rank=0, lower_level="train-alone", **env_args)
+    demos = Demonstrations(demos)
+    assert demos.world_shape == env.world_shape
+    agent = Agent(
+        obs_spaces=env.observation_space,
+        action_space=spaces.Discrete(len(env.lower_level_actions)),
+        entropy_coef=0,
+        lower_level=True,
+        num_layers=1,
+        recurrent=False,
+        **network_args,
+    ).to(device)
+    optimizer = optim.Adam(agent.parameters(), lr=lr)
+
+    def tensor(x):
+        return torch.as_tensor(np.asarray(x, dtype=np.float32), device=device)
+
+    def forward(idx):
+        records = demos.records[idx]
+        inputs = Obs(
+            active=torch.zeros(len(idx), 1, device=device),
+            lines=tensor(records["line"]),
+            obs=tensor(env.world_obs(demos.worlds(idx))),
+            inventory=tensor(records["inventory"]),
+        )
+        actions = torch.as_tensor(records["action"].astype(np.int64), device=device)
+        values = agent(inputs, rnn_hxs=None, masks=None, action=actions[:, None])
+        accuracy = (values.dist.probs.argmax(-1) == actions).float().mean()
+        return -values.action_log_probs.mean(), accuracy
+
+    random = np.random.RandomState(seed)
+    order = random.permutation(len(demos))
+    n_eval = int(eval_fraction * len(demos))
+    eval_idx, train_idx = np.sort(order[:n_eval]), order[n_eval:]
+    step = 0
+    for epoch in range(num_epochs):
+        agent.train()
+        random.shuffle(train_idx)
+        batches = range(0, len(train_idx), batch_size)
+        for start in tqdm(batches, desc=f"epoch {epoch}"):
+            loss, accuracy = forward(np.sort(train_idx[start : start + batch_size]))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if step % log_interval == 0:
+                writer.add_scalar("loss", loss, step)
+                writer.add_scalar("accuracy", accuracy, step)
+            step += 1
+
+        agent.eval()
+        with torch.no_grad():
+            results = [
+                (len(idx), *map(float, forward(idx)))
+                for idx in np.array_split(eval_idx, max(1, n_eval // batch_size))
+                if len(idx)
+            ]
+        if results:
+            n, loss, accuracy = zip(*results)
+            eval_loss = np.average(loss, weights=n)
+            eval_accuracy = np.average(accuracy, weights=n)
+            writer.add_scalar("eval_loss", eval_loss, step)
+            writer.add_scalar("eval_accuracy", eval_accuracy, step)
+            print(f"epoch {epoch}: eval loss {eval_loss:.4f}, acc {eval_accuracy:.4f}")
+
+        save_path = Path(log_dir, "lower.pt")
+        torch.save(dict(step=step, agent=agent.state_dict()), save_path)
+        with Path(log_dir, "lower.json").open("w") as f:
+            json.dump(dict(**network_args, recurrent=False), f, indent=2)
+        print(f"Saved parameters to {save_path}")
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--demos", type=Path, required=True)
+    parser.add_argument("--log-dir", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--num-epochs", type=int, default=10)
+    parser.add_argument(
+        "--eval-fraction",
+        type=float,
+        default=0.05,
+        help="fraction of the demonstrations held out to measure accuracy",
+    )
+    parser.add_argument(
+        "--log-interval",
+        type=int,
+        default=10,
+        help="how many batches to wait before logging training status",
+    )
+    parser.add_argument("--no-cuda", action="store_true")
+    network_parser = parser.add_argument_group("network_args")
+    network_parser.add_argument("--hidden-size", type=int, default=128)
+    network_parser.add_argument("--num-conv-layers", type=int, default=1)
+    network_parser.add_argument("--kernel-size", type=int, default=3)
+    network_parser.add_argument("--stride", type=int, default=1)
+    env_parser = parser.add_argument_group("env_args")
+    ppo.control_flow.multi_step.env.build_parser(env_parser)
+    env_parser.add_argument("--min-eval-lines", type=int, required=True)
+    env_parser.add_argument("--max-eval-lines", type=int, required=True)
+    main(**hierarchical_parse_args(parser))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,328 @@
+import numpy as np
+import torch
+
+from common.vec_env import VecEnv
+from ppo.control_flow.env import Action, Env
+from ppo.control_flow.lines import Padding
+from ppo.control_flow.program import Programs, SUBTASK, IF, ELSE, LOOP
+
+
+class TensorEnv(VecEnv):
+    """
+    Steps N copies of the condition-bit `control_flow.env.Env` as torch
+    tensors on `device`. Pointers, loop counters, `If` evaluations, condition
+    bits, time and no-op budgets all live in [N] / [N, n_lines + 1] tensors
+    and are advanced with one batch of tensor ops per step. The wrapped `Env`
+    instances only sample programs on reset (with their own RNGs), so
+    program sampling is unchanged.
+
+    Observations come out already flattened, in the layout that `VecPyTorch`
+    produces for `Env` (active, lines, condition bit), and actions are taken
+    as tensors, so nothing goes through NumPy or pickle while stepping.
+
+    Condition bits flip with `torch.rand`. With `flips="numpy"`, flips are
+    drawn from each wrapped env's RNG instead, one env at a time, which
+    reproduces `Env` exactly under the same seeds (see `check`).
+
+    Infos are empty except on termination, where they hold the episode
+    scalars of `Env` (and `instruction` at `info_verbosity` 2). The
+    per-step history payloads `actions` and `program_counter` are not
+    recorded, since that would mean a Python append per env per step;
+    `main.process_infos` and `log_result` skip them when absent.
+    """
+
+    accepts_tensors = True
+
+    def __init__(self, env_fns, device="cpu", flips="torch"):
+        self.envs = [fn() for fn in env_fns]
+        env = self.envs[0]
+        assert all(type(e) is Env for e in self.envs)
+        VecEnv.__init__(self, len(self.envs), env.observation_space, env.action_space)
+        assert flips in ("torch", "numpy")
+        self.flips = flips
+        self.env = env
+        self.device = device
+        N, n_lines = self.num_envs, env.n_lines
+        self.programs = Programs(N, n_lines)
+        self.lengths = np.zeros(N, dtype=int)
+        self.encoded_lines = np.zeros((N, n_lines), dtype=int)
+        self.no_op_limits = np.zeros(N)
+        self.instruction = [None] * N
+        self.time_to_waste = env.time_to_waste
+        self.flip_prob = env.flip_prob
+        self.train_alone = env.lower_level == "train-alone"
+        self.to(device)
+
+    def to(self, device):
+        self.device = device
+
+        def tensor(x, dtype=torch.long):
+            return torch.as_tensor(x, dtype=dtype, device=device)
+
+        N = self.num_envs
+        programs = self.programs
+        self.types = tensor(programs.types)
+        self.ids = tensor(programs.ids)
+        self.next_if_true = tensor(programs.next_if_true)
+        self.next_if_false = tensor(programs.next_if_false)
+        self.matching_if = tensor(programs.matching_if)
+        self.program_lengths = tensor(self.lengths)
+        self.lines = tensor(self.encoded_lines)
+        self.no_op_limit = tensor(self.no_op_limits, dtype=torch.float)
+        self.if_evaluations = torch.zeros_like(self.types, dtype=torch.bool)
+        self.ptr = torch.zeros(N, dtype=torch.long, device=device)
+        self.prev = torch.zeros_like(self.ptr)
+        self.loops = torch.full_like(self.ptr, -1)  # -1 means no active loop
+        self.condition_bit = torch.zeros_like(self.ptr)
+        self.time_remaining = torch.zeros_like(self.ptr)
+        self.no_ops = torch.zeros_like(self.ptr)
+        self.cumulative_reward = torch.zeros(N, device=device)
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(int(self.env.random_seed))
+
+    def reset_world(self, i):
+        """
+        Samples a program with the RNG of env `i`, as `Env.initial_state`.
+        """
+        env = self.envs[i]
+        env.i += 1
+        state = env.initial_state()
+        lines, condition_bit = state.lines, state.obs
+        self.programs[i] = env.compile(lines)
+        # subtask ids and loop counts instead of `possible_lines` indices
+        self.programs.ids[i, : len(lines)] = [l.id for l in lines]
+        self.lengths[i] = len(lines)
+        padded = lines + [Padding(0)] * (env.n_lines - len(lines))
+        self.encoded_lines[i] = [env.preprocess_line(l) for l in padded]
+        self.instruction[i] = [env.preprocess_line(l) for l in lines]
+        no_op_limit = 200 if env.evaluating else env.no_op_limit
+        if env.no_op_limit is not None and env.no_op_limit < 0:
+            no_op_limit = len(lines)
+        self.no_op_limits[i] = np.inf if no_op_limit is None else no_op_limit
+        return condition_bit
+
+    def reset_slots(self, idx):
+        """
+        Resets the envs in `idx` (a list of ints) and moves their programs to
+        the device.
+        """
+        bits = [self.reset_world(i) for i in idx]
+        rows = torch.as_tensor(idx, dtype=torch.long, device=self.device)
+        programs = self.programs
+        for name in ("types", "ids", "next_if_true", "next_if_false", "matching_if"):
+            getattr(self, name)[rows] = torch.as_tensor(
+                getattr(programs, name)[idx], device=self.device
+            )
+        self.program_lengths[rows] = torch.as_tensor(
+            self.lengths[idx], device=self.device
+        )
+        self.lines[rows] = torch.as_tensor(self.encoded_lines[idx], device=self.device)
+        self.no_op_limit[rows] = torch.as_tensor(
+            self.no_op_limits[idx], dtype=torch.float, device=self.device
+        )
+        self.condition_bit[rows] = torch.as_tensor(bits, device=self.device)
+        self.if_evaluations[rows] = False
+        self.loops[rows] = -1
+        self.prev[rows] = 0
+        self.no_ops[rows] = 0
+        self.cumulative_reward[rows] = 0
+        self.time_remaining[rows] = self.time_to_waste
+        self.ptr[rows] = 0
+        self.next_subtask(rows, start=True)
+        if not self.train_alone:
+            # `Env.reset` rewards programs that are over before they start
+            self.cumulative_reward[rows] = self.terminal(rows, self.ptr[rows]).float()
+
+    def terminal(self, rows, ptr):
+        return ptr >= self.program_lengths[rows]
+
+    def stopped(self, rows, ptr):
+        return self.terminal(rows, ptr) | (self.types[rows, ptr] == SUBTASK)
+
+    def next(self, rows, ptr, condition):
+        """
+        Tensor version of `Programs.next`.
+        """
+        t = self.types[rows, ptr]
+        matching = self.if_evaluations[rows, self.matching_if[rows, ptr]]
+        condition = torch.where(t == ELSE, ~matching, condition.bool())
+        is_if = t == IF
+        self.if_evaluations[rows[is_if], ptr[is_if]] = condition[is_if]
+        return torch.where(
+            condition, self.next_if_true[rows, ptr], self.next_if_false[rows, ptr]
+        )
+
+    def next_subtask(self, rows, start=False):
+        """
+        Tensor version of `next_subtask` in `Env.generators`: advances the
+        envs in `rows` to their next subtask (or past the end of their
+        program).
+        """
+        ptr = self.ptr[rows]
+        if not start:
+            ptr = self.next(rows, ptr, self.condition_bit[rows])
+        pending = ~self.stopped(rows, ptr)
+        while pending.any():
+            r, l = rows[pending], ptr[pending]
+            loop = self.types[r, l] == LOOP
+            loops = self.loops[r]
+            loops = torch.where(
+                loop, torch.where(loops < 0, self.ids[r, l], loops - 1), loops
+            )
+            condition = torch.where(loop, loops > 0, self.condition_bit[r].bool())
+            l = self.next(r, l, condition)
+            self.loops[r] = torch.where(
+                loop & (loops == 0), torch.full_like(loops, -1), loops
+            )
+            ptr[pending] = l
+            pending[pending] = ~self.stopped(r, l)
+        self.ptr[rows] = ptr
+        self.time_remaining[rows] += 1
+
+    def observation(self):
+        ptr = self.ptr
+        active = torch.where(
+            self.terminal(torch.arange(self.num_envs, device=self.device), ptr),
+            torch.full_like(ptr, self.env.n_lines),
+            ptr,
+        )
+        return torch.cat(
+            [active[:, None], self.lines, self.condition_bit[:, None]], dim=-1
+        ).float()
+
+    def reset(self):
+        self.reset_slots(list(range(self.num_envs)))
+        return self.observation()
+
+    def step_async(self, actions):
+        self._actions = torch.as_tensor(actions, device=self.device).long()
+
+    def step_wait(self):
+        actions = self._actions
+        if actions.dim() == 1:
+            upper = torch.zeros_like(actions)
+        else:
+            upper = Action(*actions.unbind(-1)).upper
+        N = self.num_envs
+        R = torch.arange(N, device=self.device)
+        term = torch.zeros(N, dtype=torch.bool, device=self.device)
+
+        # no-ops
+        no_op = upper == self.env.num_subtasks
+        self.no_ops += no_op.long()
+        term |= no_op & (self.no_ops.float() >= self.no_op_limit)
+
+        # subtasks
+        active = ~no_op & ~self.terminal(R, self.ptr)
+        subtask = self.ids[R, self.ptr]
+        fail = active & ((self.time_remaining == 0) | (upper != subtask))
+        term |= fail
+        rows = R[active & ~fail]
+        if len(rows):
+            self.time_remaining[rows] -= 1
+            if self.flips == "numpy":
+                flip = [self.envs[i].random.rand() for i in rows.tolist()]
+                flip = torch.as_tensor(flip, device=self.device) < self.flip_prob
+            else:
+                u = torch.rand(len(rows), generator=self.generator, device=self.device)
+                flip = u < self.flip_prob
+            self.condition_bit[rows] ^= flip.long()
+            self.prev[rows] = self.ptr[rows]
+            self.next_subtask(rows)
+
+        success = self.terminal(R, self.ptr)
+        term |= success
+        if self.train_alone:
+            reward = torch.zeros(N, device=self.device)
+        else:
+            reward = success.float()
+        self.cumulative_reward += reward
+
+        done = term.cpu().numpy()
+        infos = [{} for _ in range(N)]
+        for i in np.flatnonzero(done):
+            infos[i] = self.info(i, bool(success[i]))
+        obs = self.observation()
+        if done.any():
+            self.reset_slots(np.flatnonzero(done).tolist())
+            obs[term] = self.observation()[term]
+        return obs, reward.cpu(), done, infos
+
+    def info(self, i, success):
+        env = self.envs[i]
+        env.success_count += success
+        n = int(self.lengths[i])
+        prev = int(self.prev[i])
+        info = dict(
+            success=success,
+            cumulative_reward=float(self.cumulative_reward[i]),
+            instruction_len=n,
+            success_line=n if success else prev,
+            progress=1 if success else prev / n,
+            regret=0 if success else 1,
+            # `Env` never completes a subtask in this sense (see `Env.outcome`)
+            subtasks_complete=0,
+            subtasks_attempted=int(not success),
+        )
+        if env.info_verbosity >= 2:
+            info.update(instruction=self.instruction[i])
+        return env.line_specific_info(info, n)
+
+    def render(self, mode="human"):
+        self.envs[0].render(pause=False)
+
+    def evaluate(self):
+        for env in self.envs:
+            env.evaluating = True
+
+    def train(self):
+        for env in self.envs:
+            env.evaluating = False
+
+    def set_curriculum(self, weights):
+        for env in self.envs:
+            env.set_curriculum(weights)
+
+    def seed(self, seeds):
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
+        self.generator.manual_seed(int(self.env.random_seed))
+
+    def close_extras(self):
+        pass
+
+
+def check(env_fn, num_envs, num_steps, seed=0):
+    """
+    Steps `Env` and `TensorEnv(flips="numpy")` side by side on the same
+    seeds and actions and asserts that observations, rewards, terminations
+    and the infos of terminal steps match.
+    """
+    from ppo.wrappers import VecPyTorch
+    from common.vec_env.dummy_vec_env import DummyVecEnv
+
+    env_fns = [lambda i=i: env_fn(seed=seed + i) for i in range(num_envs)]
+    reference = VecPyTorch(DummyVecEnv(env_fns, render=False))
+    tensor_env = TensorEnv(env_fns, flips="numpy")
+    random = np.random.RandomState(seed)
+    obs1, obs2 = reference.reset(), tensor_env.reset()
+    nvec = tensor_env.action_space.nvec
+    for _ in range(num_steps):
+        assert torch.equal(obs1, obs2)
+        # mostly pick the active subtask, so that programs make progress
+        active = obs2[:, 0].long().clamp(max=tensor_env.env.n_lines - 1)
+        line = obs2[torch.arange(num_envs), 1 + active].long()
+        actions = random.randint(nvec, size=(num_envs, len(nvec)))
+        correct = random.rand(num_envs) < 0.8
+        actions[correct, 0] = line.numpy()[correct]
+        actions = torch.as_tensor(actions)
+        obs1, reward1, done1, infos1 = reference.step(actions[:, None])
+        obs2, reward2, done2, infos2 = tensor_env.step(actions)
+        assert torch.equal(reward1, reward2)
+        assert np.array_equal(done1, done2)
+        for i in np.flatnonzero(done2):
+            info1, info2 = infos1[i], infos2[i]
+            assert {k: info1[k] for k in info2} == info2
+            missing = {k.rsplit("_", 1)[0] if k[-1].isdigit() else k for k in info1}
+            missing -= set(info2)
+            assert missing <= set(Env.step_info_keys) | set(Env.info_payloads)
@@ -0,0 +1,92 @@
+import unittest
+from collections import defaultdict
+
+import numpy as np
+
+from ppo.control_flow.lines import Subtask, If, Else, While, Loop
+from ppo.control_flow.program import Programs, compile_program
+from ppo.control_flow.program_sampler import ProgramSampler
+
+LEGAL_LINES = [Subtask, If, Else, While, Loop]
+
+
+def line_generator(lines):
+    """
+    The generator-based interpreter that jump tables replaced: send a
+    condition bit, receive the next line (None on termination).
+    """
+    line_transitions = defaultdict(list)
+    conditions = []
+    for i, line in enumerate(lines):
+        for _from, _to in line.transitions(i, conditions):
+            line_transitions[_from].append(_to)
+    i = 0
+    if_evaluations = []
+    while True:
+        condition_bit = yield None if i >= len(lines) else i
+        if type(lines[i]) is Else:
+            evaluation = not if_evaluations.pop()
+        else:
+            evaluation = bool(condition_bit)
+        if type(lines[i]) is If:
+            if_evaluations.append(evaluation)
+        i = line_transitions[i][evaluation]
+
+
+class TestProgram(unittest.TestCase):
+    max_lines = 10
+    num_programs = 300
+    max_steps = 50
+
+    def sample_programs(self, random):
+        sampler = ProgramSampler(LEGAL_LINES, self.max_lines, 1)
+        for _ in range(self.num_programs):
+            n = random.randint(1, self.max_lines + 1)
+            yield tuple(t(0) for t in sampler.sample(n, random))
+
+    def test_matches_line_generator(self):
+        random = np.random.RandomState(0)
+        for lines in self.sample_programs(random):
+            program = compile_program(lines)
+            expected = line_generator(lines)
+            ptr = next(expected)
+            self.assertEqual(program.start, ptr)
+            if_evaluations = np.zeros(len(lines), dtype=bool)
+            for _ in range(self.max_steps):
+                if ptr is None:
+                    break
+                condition = random.randint(2)
+                expected_ptr = expected.send(condition)
+                ptr = program.next(ptr, condition, if_evaluations)
+                self.assertEqual(ptr, expected_ptr, [str(l) for l in lines])
+
+    def test_programs_match_program(self):
+        random = np.random.RandomState(1)
+        programs = [compile_program(l) for l in self.sample_programs(random)]
+        batch = Programs(len(programs), self.max_lines)
+        for i, program in enumerate(programs):
+            batch[i] = program
+        rows = np.arange(len(programs))
+        ptr = np.zeros(len(programs), dtype=int)
+        if_evaluations = np.zeros((len(programs), self.max_lines + 1), dtype=bool)
+        expected_ptr = [p.start for p in programs]
+        expected_if_evaluations = [np.zeros(len(p), dtype=bool) for p in programs]
+        for _ in range(self.max_steps):
+            active = ~batch.terminal(rows, ptr)
+            self.assertEqual(list(active), [p is not None for p in expected_ptr])
+            if not active.any():
+                break
+            condition = random.randint(2, size=len(programs))
+            ptr[active] = batch.next(
+                rows[active], ptr[active], condition[active], if_evaluations
+            )
+            for i in np.flatnonzero(active):
+                expected_ptr[i] = programs[i].next(
+                    expected_ptr[i], condition[i], expected_if_evaluations[i]
+                )
+                if expected_ptr[i] is not None:
+                    self.assertEqual(ptr[i], expected_ptr[i])
+
+
+if __name__ == "__main__":
+    unittest.main()
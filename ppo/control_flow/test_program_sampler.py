@@ -0,0 +1,113 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from ppo.control_flow.lines import (
+    Subtask,
+    If,
+    Else,
+    EndIf,
+    While,
+    EndWhile,
+    Loop,
+    EndLoop,
+)
+from ppo.control_flow.program_sampler import ProgramSampler, ENDS
+
+LEGAL_LINES = [Subtask, If, Else, While, Loop]
+FEATURES = [If, Else, While, Loop]
+
+
+def enumerate_blocks(n, d, legal_lines):
+    """
+    Brute-force enumeration of the n-line blocks with `d` levels of nesting
+    left, as (line types, features present) pairs.
+    """
+    if n == 0:
+        yield (), frozenset()
+        return
+    for m in range(1, n + 1):
+        for head, a in enumerate_statements(m, d, legal_lines):
+            for tail, b in enumerate_blocks(n - m, d, legal_lines):
+                yield head + tail, a | b
+
+
+def enumerate_statements(m, d, legal_lines):
+    if m == 1 and Subtask in legal_lines:
+        yield (Subtask,), frozenset()
+    if d == 0:
+        return
+    for t in (If, While, Loop):
+        if t in legal_lines and m >= 3:
+            for body, a in enumerate_blocks(m - 2, d - 1, legal_lines):
+                yield (t, *body, ENDS[t]), a | {t}
+    if Else in legal_lines:
+        for i in range(1, m - 3):
+            for (x, a), (y, b) in itertools.product(
+                enumerate_blocks(i, d - 1, legal_lines),
+                enumerate_blocks(m - 3 - i, d - 1, legal_lines),
+            ):
+                yield (If, *x, Else, *y, EndIf), a | b | {Else}
+
+
+class TestProgramSampler(unittest.TestCase):
+    max_lines = 8
+
+    def test_counts_match_enumeration(self):
+        for depth in (1, 2):
+            sampler = ProgramSampler(
+                LEGAL_LINES, self.max_lines, depth, uniform=True, features=FEATURES
+            )
+            for n in range(1, self.max_lines + 1):
+                programs = list(enumerate_blocks(n, depth, LEGAL_LINES))
+                self.assertEqual(len(programs), len({p for p, _ in programs}))
+                self.assertEqual(sampler.weight(n), len(programs), (n, depth))
+                for features in itertools.product([False, True], repeat=2):
+
+                    def accept(present):
+                        return (Else in present, While in present) == features
+
+                    expected = sum(accept(f) for _, f in programs)
+                    self.assertEqual(sampler.weight(n, accept), expected)
+
+    def test_subset_of_legal_lines(self):
+        legal_lines = [Subtask, If, While]
+        sampler = ProgramSampler(legal_lines, self.max_lines, 1, uniform=True)
+        for n in range(1, self.max_lines + 1):
+            programs = list(enumerate_blocks(n, 1, legal_lines))
+            self.assertEqual(sampler.weight(n), len(programs))
+
+    def test_weights_are_probabilities(self):
+        sampler = ProgramSampler(LEGAL_LINES, self.max_lines, 2)
+        for n in range(1, self.max_lines + 1):
+            self.assertAlmostEqual(sampler.weight(n), 1)
+
+    def test_constrained_samples(self):
+        random = np.random.RandomState(0)
+        depth = 1
+        programs = {
+            n: {p for p, _ in enumerate_blocks(n, depth, LEGAL_LINES)}
+            for n in range(1, self.max_lines + 1)
+        }
+        for uniform in (False, True):
+            sampler = ProgramSampler(
+                LEGAL_LINES, self.max_lines, depth, uniform=uniform, features=FEATURES
+            )
+            for _ in range(300):
+                n = random.randint(5, self.max_lines + 1)
+                line_types = sampler.sample(
+                    n, random, accept=lambda present: bool(present & {Else, While})
+                )
+                self.assertIn(tuple(line_types), programs[n])
+                self.assertTrue(Else in line_types or While in line_types)
+
+    def test_unsatisfiable_constraint(self):
+        sampler = ProgramSampler(LEGAL_LINES, self.max_lines, 1, features=FEATURES)
+        with self.assertRaises(RuntimeError):
+            # an Else needs at least five lines
+            sampler.sample(4, np.random.RandomState(0), lambda p: Else in p)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from ppo.control_flow.env import Env
+from ppo.control_flow.lines import Subtask, If, Else, While, Loop
+from ppo.control_flow.tensor_env import check
+
+
+def make_env(seed, **kwargs):
+    args = dict(
+        min_eval_lines=1,
+        max_eval_lines=10,
+        min_lines=1,
+        max_lines=10,
+        flip_prob=0.5,
+        num_subtasks=12,
+        max_nesting_depth=1,
+        eval_condition_size=False,
+        single_control_flow_type=False,
+        no_op_limit=3,
+        time_to_waste=2,
+        subtasks_only=False,
+        break_on_fail=False,
+        max_loops=3,
+        rank=0,
+        lower_level="hardcoded",
+        control_flow_types=[Subtask, If, Else, While, Loop],
+        seed=seed,
+    )
+    args.update(kwargs)
+    return Env(**args)
+
+
+class TestTensorEnv(unittest.TestCase):
+    def check(self, **kwargs):
+        for seed in range(4):
+            with self.subTest(seed=seed, **kwargs):
+                check(
+                    lambda **k: make_env(**k, **kwargs),
+                    num_envs=6,
+                    num_steps=300,
+                    seed=10 * seed,
+                )
+
+    def test_matches_env(self):
+        self.check()
+
+    def test_flips(self):
+        self.check(flip_prob=0.9)
+
+    def test_time_to_waste(self):
+        self.check(time_to_waste=0)
+
+    def test_no_op_limit_per_line(self):
+        self.check(no_op_limit=-1)
+
+    def test_train_alone(self):
+        self.check(lower_level="train-alone", info_verbosity=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+import argparse
+import functools
+import inspect
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import torch
+from torch import nn
+
+import ppo.control_flow.agent
+import ppo.control_flow.env
+import ppo.control_flow.multi_step.env
+from common.vec_env.shmem_vec_env import ShmemVecEnv
+from ppo.control_flow import recurrence
+from ppo.control_flow.main import main
+from ppo.control_flow.multi_step.batched_env import BatchedEnv
+from ppo.control_flow.multi_step.test_env import make_env
+from ppo.control_flow.tensor_env import TensorEnv
+from ppo.train import Train, TrainBase
+from ppo.wrappers import VecPyTorch, VecPyTorchPipeline
+
+LOWER_LEVEL_CONFIG = Path(__file__).parents[2] / "checkpoint" / "lower.json"
+
+
+class Collector(TrainBase):
+    """
+    The collectors of `TrainBase` with a given agent, without `setup`.
+    """
+
+    def __init__(self, agent=None):
+        self.agent = agent
+
+    def make_batched_env(self, env_fns, **env_args):
+        raise NotImplementedError
+
+    def get_device(self):
+        return "cpu"
+
+
+def build_agent(envs):
+    torch.manual_seed(0)
+    return ppo.control_flow.agent.Agent(
+        entropy_coef=0.015,
+        observation_space=envs.observation_space,
+        no_op_coef=0,
+        action_space=envs.action_space,
+        lower_level="hardcoded",
+        eval_lines=10,
+        activation=nn.ReLU(),
+        hidden_size=32,
+        num_layers=0,
+        hidden2=16,
+        conv_hidden_size=16,
+        task_embed_size=16,
+        lower_embed_size=8,
+        gate_hidden_size=8,
+        gate_stride=1,
+        gate_conv_kernel_size=3,
+        gate_coef=0.01,
+        kernel_size=2,
+        stride=1,
+        num_edges=3,
+        num_encoding_layers=0,
+        critic_type="z",
+        fuzz=False,
+        debug=False,
+        no_scan=False,
+        no_roll=False,
+        no_pointer=False,
+        transformer=False,
+        olsk=False,
+        log_dir=None,
+        lower_level_config=LOWER_LEVEL_CONFIG,
+        lower_level_load_path=None,
+    )
+
+
+def sample_mode(x, dist):
+    # act greedily, so that acting for each group of envs separately draws
+    # the same actions as acting for all of them at once
+    new = x < 0
+    x[new] = dist.mode()[new].flatten()
+
+
+class TestCollectPipelined(unittest.TestCase):
+    num_envs = 4
+    num_steps = 40
+
+    def collect(self, pipelined):
+        env_fns = [
+            functools.partial(make_env, seed=i, lower_level="hardcoded")
+            for i in range(self.num_envs)
+        ]
+        if pipelined:
+            half = self.num_envs // 2
+            envs = VecPyTorchPipeline(
+                [
+                    VecPyTorch(ShmemVecEnv(group))
+                    for group in (env_fns[:half], env_fns[half:])
+                ]
+            )
+        else:
+            envs = VecPyTorch(ShmemVecEnv(env_fns))
+        try:
+            collector = Collector(build_agent(envs))
+            collect = collector.collect_pipelined if pipelined else collector.collect
+            rnn_hxs = torch.zeros(
+                self.num_envs, collector.agent.recurrent_hidden_state_size
+            )
+            masks = torch.zeros(self.num_envs, 1)
+            with mock.patch.object(
+                recurrence.Recurrence, "sample_new", staticmethod(sample_mode)
+            ):
+                # the next step overwrites observations in shared memory
+                return [
+                    (act, obs.clone(), *step)
+                    for act, obs, *step in collect(
+                        envs.reset(), rnn_hxs, masks, self.num_steps, envs
+                    )
+                ]
+        finally:
+            envs.close()
+
+    def test_matches_collect(self):
+        expected = self.collect(pipelined=False)
+        actual = self.collect(pipelined=True)
+        self.assertEqual(len(actual), len(expected))
+        for step1, step2 in zip(expected, actual):
+            act1, obs1, reward1, done1, infos1, masks1 = step1
+            act2, obs2, reward2, done2, infos2, masks2 = step2
+            self.assertTrue(torch.equal(act1.action, act2.action))
+            self.assertTrue(torch.allclose(act1.value, act2.value, atol=1e-5))
+            self.assertTrue(torch.allclose(act1.rnn_hxs, act2.rnn_hxs, atol=1e-5))
+            self.assertTrue(torch.equal(obs1, obs2))
+            self.assertTrue(torch.equal(reward1, reward2))
+            self.assertTrue(np.array_equal(done1, done2))
+            self.assertTrue(torch.equal(masks1, masks2))
+            self.assertEqual([sorted(i) for i in infos1], [sorted(i) for i in infos2])
+
+            self.assertEqual(set(act1.log), set(act2.log))
+            # per-env logs stay tensors that main.process_infos can index
+            P1, P2 = act1.log["P"], act2.log["P"]
+            self.assertEqual(P1.shape, P2.shape)
+            self.assertTrue(torch.allclose(P1, P2, atol=1e-5))
+            self.assertEqual(len(P2[done2]), done2.sum())
+            self.assertAlmostEqual(
+                float(act1.log["entropy"]), float(act2.log["entropy"]), places=5
+            )
+
+
+class TestSetup(unittest.TestCase):
+    @staticmethod
+    def setup_args(**kwargs):
+        params = inspect.signature(TrainBase.setup).parameters
+        args = {
+            k: None
+            for k, p in params.items()
+            if k != "self" and p.default is inspect.Parameter.empty
+        }
+        return {**args, **kwargs}
+
+    def test_pipeline_rejects_frame_stack(self):
+        with self.assertRaises(ValueError):
+            Collector().setup(
+                **self.setup_args(pipeline=True, env_args=dict(num_frame_stack=4))
+            )
+
+    def test_pipeline_rejects_batched_env(self):
+        with self.assertRaises(ValueError):
+            Collector().setup(
+                **self.setup_args(pipeline=True, env_args=dict(batched_env=True))
+            )
+
+
+class TestMakeVecEnvs(unittest.TestCase):
+    num_processes = 3
+
+    @staticmethod
+    def env_args(*argv):
+        # the env arguments that `main.control_flow_args` parses
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--gridworld", action="store_true")
+        parser.add_argument("--batched-env", action="store_true")
+        ppo.control_flow.multi_step.env.build_parser(parser)
+        return vars(
+            parser.parse_args(
+                [
+                    *("--min-lines", "1", "--max-lines", "10"),
+                    *("--time-to-waste", "2", "--no-op-limit", "3"),
+                    *("--control-flow-types", "Subtask", "If", "Else", "While"),
+                    *("--max-failure-sample-prob", "0.3"),
+                    *("--failure-buffer-size", "500", "--reject-while-prob", "0.6"),
+                    *("--max-world-resamples", "50", "--max-while-loops", "10"),
+                    *("--world-size", "6", "--term-on", "mine", "sell"),
+                    *argv,
+                ]
+            )
+        )
+
+    def make_vec_envs(self, env_args, synchronous=False):
+        with mock.patch.object(Train, "__init__", lambda self, **kwargs: None):
+            with mock.patch.object(Train, "run", autospec=True) as run:
+                main(
+                    log_dir=None,
+                    seed=0,
+                    min_eval_lines=1,
+                    max_eval_lines=10,
+                    one_line=False,
+                    lower_level="hardcoded",
+                    lower_level_load_path=None,
+                    render=False,
+                    num_processes=self.num_processes,
+                    env_args=env_args,
+                )
+        (train,), _ = run.call_args
+        return train.make_vec_envs(
+            num_processes=self.num_processes,
+            gamma=0.99,
+            render=False,
+            synchronous=synchronous,
+            env_id=None,
+            add_timestep=False,
+            seed=0,
+            evaluation=False,
+            time_limit=None,
+            **env_args,
+        )
+
+    def step(self, envs):
+        try:
+            obs = envs.reset()
+            self.assertEqual(obs.size(0), self.num_processes)
+            nvec = envs.action_space.nvec
+            random = np.random.RandomState(0)
+            for _ in range(20):
+                actions = random.randint(nvec, size=(self.num_processes, len(nvec)))
+                obs, reward, done, infos = envs.step(torch.as_tensor(actions))
+                self.assertEqual(obs.size(0), self.num_processes)
+        finally:
+            envs.close()
+
+    def test_tensor_env(self):
+        envs = self.make_vec_envs(self.env_args("--batched-env"))
+        self.assertIsInstance(envs.venv, TensorEnv)
+        self.step(envs)
+
+    def test_batched_env(self):
+        envs = self.make_vec_envs(self.env_args("--batched-env", "--gridworld"))
+        self.assertIsInstance(envs.venv, BatchedEnv)
+        self.step(envs)
+
+    def test_control_flow_env(self):
+        envs = self.make_vec_envs(self.env_args(), synchronous=True)
+        self.assertIsInstance(envs.venv.envs[0], ppo.control_flow.env.Env)
+        self.step(envs)
+
+
+if __name__ == "__main__":
+    unittest.main()
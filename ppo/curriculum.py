@@ -0,0 +1,55 @@
+from collections import Counter
+
+import numpy as np
+
+
+class LearningProgress:
+    """
+    Sampling weights over buckets of tasks, in proportion to learning
+    progress: the absolute difference between a fast and a slow moving
+    average of success in each bucket. Buckets whose success has stopped
+    changing (solved or hopeless) get little weight.
+
+    A share `exploration` of the weight goes to the None bucket, which stands
+    for the env's usual task distribution, so that every bucket keeps being
+    sampled and new buckets are found.
+    """
+
+    def __init__(self, fast=0.1, slow=0.02, exploration=0.2, min_episodes=20):
+        self.fast_rate = fast
+        self.slow_rate = slow
+        self.exploration = exploration
+        self.min_episodes = min_episodes
+        self.fast = {}
+        self.slow = {}
+        self.episodes = Counter()
+
+    def update(self, bucket, success):
+        success = float(success)
+        self.episodes[bucket] += 1
+        for average, rate in [(self.fast, self.fast_rate), (self.slow, self.slow_rate)]:
+            previous = average.get(bucket, success)
+            average[bucket] = previous + rate * (success - previous)
+
+    def progress(self):
+        return {
+            bucket: abs(self.fast[bucket] - self.slow[bucket])
+            for bucket, n in self.episodes.items()
+            if n >= self.min_episodes
+        }
+
+    def weights(self):
+        progress = self.progress()
+        total = sum(progress.values())
+        if not total:
+            return {None: 1.0}
+        weights = {b: (1 - self.exploration) * p / total for b, p in progress.items()}
+        weights[None] = self.exploration
+        return weights
+
+    def log(self):
+        progress = list(self.progress().values())
+        return dict(
+            curriculum_buckets=len(progress),
+            curriculum_progress=np.mean(progress) if progress else np.nan,
+        )
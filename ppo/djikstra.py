@@ -1,7 +1,8 @@
+import heapq
 import itertools
 import unittest
 from collections import defaultdict
-from typing import Dict, TypeVar, Set, List, Callable
+from typing import Dict, TypeVar, Set, List, Callable, Iterable
 
 from string import ascii_lowercase
 import numpy as np
@@ -34,15 +35,14 @@ def get_length(path: List[X], graph: Graph):
 
 def shortest_path(src: X, graph: Graph, stopping_criterion: Callable[[X], bool]):
     explored = set()
-    distances = defaultdict(lambda: np.inf)
-    distances[src] = 0
+    distances = {src: 0}
     prev = {src: None}
-    while True:
-        if not distances:
-            return None, None
-        distance, value = min(
-            [(d, v) for v, d in distances.items()], key=lambda p: p[0]
-        )  # TODO: not efficient
+    heap = [(0, 0, src)]
+    counter = itertools.count(1)  # breaks ties between incomparable nodes
+    while heap:
+        distance, _, value = heapq.heappop(heap)
+        if value in explored:
+            continue
         if stopping_criterion(value):  # done (_to is minimum distance)
 
             def generator(v):
@@ -53,15 +53,89 @@ def shortest_path(src: X, graph: Graph, stopping_criterion: Callable[[X], bool])
             return list(reversed(list(generator(value)))), distance
 
         explored.add(value)
-        del distances[value]
         if value in graph:
             for adjacent, edge_length in graph[value].items():
-                if (
-                    adjacent not in explored
-                    and distance + edge_length < distances[adjacent]
+                if adjacent not in explored and distance + edge_length < distances.get(
+                    adjacent, np.inf
                 ):
                     distances[adjacent] = distance + edge_length
                     prev[adjacent] = value
+                    heapq.heappush(heap, (distances[adjacent], next(counter), adjacent))
+    return None, None
+
+
+def multi_source_shortest_paths(sources: Iterable[X], graph: Graph):
+    """
+    Distances from the nearest of `sources` to every reachable node, and for
+    each node the previous node on a shortest path from that source (None for
+    the sources themselves). On an undirected graph, `prev[x]` is the first
+    step from `x` toward its nearest source.
+    """
+    distances = {}
+    prev = {}
+    heap = []
+    counter = itertools.count()
+    for src in sources:
+        distances[src] = 0
+        prev[src] = None
+        heap.append((0, next(counter), src))
+    heapq.heapify(heap)
+    explored = set()
+    while heap:
+        distance, _, value = heapq.heappop(heap)
+        if value in explored:
+            continue
+        explored.add(value)
+        for adjacent, edge_length in graph.get(value, {}).items():
+            if distance + edge_length < distances.get(adjacent, np.inf):
+                distances[adjacent] = distance + edge_length
+                prev[adjacent] = value
+                heapq.heappush(heap, (distances[adjacent], next(counter), adjacent))
+    return distances, prev
+
+
+# (0, 0) first, so that cells without a closer neighbor stay put
+GRID_MOVES = np.array(
+    [(0, 0)] + [(i, j) for i in range(-1, 2) for j in range(-1, 2) if i or j]
+)
+
+
+def _neighbors(array: np.ndarray, fill):
+    """Stacks the 3x3 neighborhood (in GRID_MOVES order) of every cell."""
+    H, W = array.shape[-2:]
+    pad = [(0, 0)] * (array.ndim - 2) + [(1, 1), (1, 1)]
+    padded = np.pad(array, pad, constant_values=fill)
+    return np.stack(
+        [padded[..., 1 + i : 1 + i + H, 1 + j : 1 + j + W] for i, j in GRID_MOVES]
+    )
+
+
+def grid_distances(sources: np.ndarray, passable: np.ndarray):
+    """
+    Multi-source breadth-first search on an 8-connected grid, batched over
+    any leading dimensions: returns the number of moves from every cell of
+    `sources[..., H, W]` to its nearest nonzero cell, passing only through
+    cells where `passable` (broadcast against `sources`) is true. Unreachable
+    cells are inf.
+    """
+    distances = np.where(sources, 0.0, np.inf)
+    passable = np.broadcast_to(passable, distances.shape)
+    while True:
+        nearest = _neighbors(distances, np.inf).min(0) + 1
+        updated = np.where(passable, np.minimum(distances, nearest), distances)
+        if np.array_equal(updated, distances):
+            return distances
+        distances = updated
+
+
+def grid_moves(distances: np.ndarray):
+    """
+    First move of a shortest path from every cell, given `grid_distances`:
+    an [..., H, W, 2] array of offsets to the neighbor closest to a source,
+    (0, 0) on sources and on unreachable cells.
+    """
+    closest = _neighbors(distances, np.inf).argmin(0)
+    return GRID_MOVES[closest]
 
 
 def brute_force(src: X, graph: Graph, stopping_criterion: Callable[[X], bool]):
@@ -141,6 +215,56 @@ class TestDjikstra(unittest.TestCase):
                 _from, _to = np.random.choice(nodes, size=2)
                 self.check_paths(_from, _to, graph)
 
+    def test_multi_source(self):
+        np.random.seed(0)
+        alpha = ascii_lowercase[:10]
+        for _ in range(200):
+            nodes = list(alpha[: np.random.randint(1, len(alpha))])
+            graph = defaultdict(dict)
+            for f, t in itertools.combinations(nodes, 2):
+                if np.random.randint(2):
+                    graph[f][t] = graph[t][f] = np.random.randint(10)
+            sources = set(np.random.choice(nodes, size=np.random.randint(1, 4)))
+            distances, prev = multi_source_shortest_paths(sources, graph)
+            for node in nodes:
+                with self.subTest(graph=graph, sources=sources, node=node):
+                    _, distance = brute_force(
+                        src=node, graph=graph, stopping_criterion=sources.__contains__
+                    )
+                    self.assertEqual(distances.get(node), distance)
+                    if distance:
+                        step = prev[node]
+                        self.assertEqual(graph[node][step] + distances[step], distance)
+
+    def test_grid(self):
+        np.random.seed(0)
+        moves = [tuple(m) for m in GRID_MOVES]
+        for _ in range(20):
+            B, K, H, W = 3, 2, 7, 5
+            passable = np.random.random((B, 1, H, W)) < 0.7
+            sources = np.random.random((B, K, H, W)) < 0.05
+            distances = grid_distances(sources, passable)
+            first_moves = grid_moves(distances)
+            for b, k in itertools.product(range(B), range(K)):
+                graph = {
+                    (i, j): {
+                        (i + di, j + dj): 1
+                        for di, dj in moves[1:]
+                        if 0 <= i + di < H
+                        and 0 <= j + dj < W
+                        and passable[b, 0, i + di, j + dj]
+                    }
+                    for i, j in itertools.product(range(H), range(W))
+                }
+                expected, _ = multi_source_shortest_paths(
+                    zip(*np.nonzero(sources[b, k])), graph
+                )
+                for (i, j), d in np.ndenumerate(distances[b, k]):
+                    self.assertEqual(d, expected.get((i, j), np.inf))
+                    if 0 < d < np.inf:
+                        di, dj = first_moves[b, k, i, j]
+                        self.assertEqual(distances[b, k, i + di, j + dj], d - 1)
+
     def check_paths(self, src, dest, graph):
         def stopping_criterion(x):
             return x == dest
@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+
+class EvalCache:
+    """
+    Evaluation results on disk, keyed by a hash of the agent's parameters,
+    the version of the evaluation tasks and the flags that affect evaluation,
+    so that evaluating the same checkpoint again is a lookup:
+
+        <directory>/<key>.pkl
+    """
+
+    def __init__(self, directory, version, **flags):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.flags = json.dumps(flags, sort_keys=True, default=str)
+
+    def key(self, agent):
+        h = hashlib.sha256()
+        for name, tensor in agent.state_dict().items():
+            h.update(name.encode())
+            h.update(tensor.detach().cpu().numpy().tobytes())
+        h.update(str(self.version).encode())
+        h.update(self.flags.encode())
+        return h.hexdigest()[:32]
+
+    def path(self, key):
+        return Path(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        try:
+            with self.path(key).open("rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, result):
+        # write then rename, so that concurrent runs never read partial files
+        tmp = self.path(f"{key}.{os.getpid()}")
+        with tmp.open("wb") as f:
+            pickle.dump(result, f)
+        tmp.replace(self.path(key))
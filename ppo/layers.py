@@ -77,6 +77,36 @@ class ShallowCopy(nn.Module):
         return (x,) * self.n
 
 
+class ObjectList(nn.Module):
+    """
+    Encodes worlds observed as zero-padded lists [N, K, 3] of (type id + 1,
+    row, col) rows (see `multi_step.env.object_list`). Each object is the
+    embedding of its type plus a projection of its position, absolute and
+    relative to the first object (the agent), passed through a linear layer.
+    Returns per-object features [N, K, out_size], zero for padding rows, so
+    cost grows with K rather than with the area of the world.
+    """
+
+    def __init__(self, obs_space, out_size, activation):
+        super().__init__()
+        n_types, *high = obs_space.high[0]
+        self.scale = float(max(1, *high))
+        self.embed = nn.Embedding(int(n_types) + 1, out_size)
+        self.position = nn.Linear(4, out_size)
+        self.linear = nn.Sequential(nn.Linear(out_size, out_size), activation)
+
+    def forward(self, objects):
+        position = objects[..., 1:]
+        relative = position - position[:, :1]
+        position = torch.cat([position, relative], dim=-1) / self.scale
+        x = self.embed(objects[..., 0].long()) + self.position(position)
+        return self.linear(x) * self.mask(objects)
+
+    @staticmethod
+    def mask(objects):
+        return (objects[..., :1] > 0).float()
+
+
 class Concat(torch.jit.ScriptModule):
     def __init__(self, **kwargs):
         self.kwargs = kwargs
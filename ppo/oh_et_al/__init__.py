@@ -1,2 +1,3 @@
 from ppo.oh_et_al.gridworld import GridWorld
+from ppo.oh_et_al.batched_gridworld import BatchedGridWorld
 from ppo.oh_et_al.wrappers import DebugWrapper, Wrapper
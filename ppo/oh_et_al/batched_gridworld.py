@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from common.vec_env import VecEnv
+from ppo.oh_et_al.gridworld import GridWorld
+
+
+class BatchedGridWorld(VecEnv):
+    """
+    Steps N copies of `GridWorld` in a single process. Agent positions,
+    objects, obstacles and observations of all copies live in shared arrays,
+    so that moves, pick-ups and transforms are applied to every world at
+    once. The wrapped `GridWorld` instances are only used to sample tasks on
+    reset, so sampling semantics are unchanged.
+    """
+
+    def __init__(self, env_fns):
+        self.envs = [fn() for fn in env_fns]
+        env = self.envs[0]
+        assert all(isinstance(e, GridWorld) for e in self.envs)
+        VecEnv.__init__(self, len(self.envs), env.observation_space, env.action_space)
+        self.specs = [e.spec for e in self.envs]
+        self.env = env
+        N = self.num_envs
+        H, W = env.desc.shape
+        self.n_transitions = len(env.transitions)
+        self.no_op = env.action_space.n - 1
+        self.transformed = len(env.object_types)
+        self.visit, self.pick_up, self.transform = [
+            env.interactions == i for i in ["visit", "pick-up", "transform"]
+        ]
+
+        self.pos = np.zeros((N, 2), dtype=int)
+        self.objects = np.full((N, H, W), -1)  # -1 means empty
+        self.obstacles = np.zeros((N, H, W), dtype=bool)
+        self.subtasks = np.zeros((N, env.n_subtasks, 3), dtype=int)
+        self.n_subtasks = np.zeros(N, dtype=int)
+        self.subtask_idx = np.zeros(N, dtype=int)
+        self.count = np.zeros(N, dtype=int)
+        self.obs = np.zeros((N, *env.obs.shape))
+        self._actions = None
+
+    def reset_world(self, i):
+        env = self.envs[i]
+        env.reset()
+        self.pos[i] = env.pos
+        self.objects[i] = -1
+        for p, t in env.objects.items():
+            self.objects[(i, *p)] = t
+        self.obstacles[i] = env.obstacles_one_hot
+        subtasks = np.array(env.subtasks).reshape(-1, 3)
+        self.subtasks[i, : len(subtasks)] = subtasks
+        self.n_subtasks[i] = len(subtasks)
+        self.subtask_idx[i] = env.subtask_idx
+        self.count[i] = env.count
+        self.obs[i] = env.obs
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions)
+
+    def step_wait(self):
+        a = self._actions.astype(int).reshape(self.num_envs)
+        R = np.arange(self.num_envs)
+        i, j = self.pos.T
+        obj = self.objects[R, i, j]
+        interaction, _, target = self.subtasks[R, self.subtask_idx].T
+
+        # interact
+        touching = (a != self.no_op) & (obj >= 0)
+        pick_up = touching & (a == self.n_transitions)
+        transform = touching & (a == self.n_transitions + 1)
+        iterate = (touching & self.visit[interaction]) | (
+            pick_up & self.pick_up[interaction]
+        )
+        iterate |= transform & self.transform[interaction]
+        iterate &= obj == target
+        interacted = pick_up | transform
+        self.obs[R[interacted], 1 + obj[interacted], i[interacted], j[interacted]] = 0
+        self.objects[R[pick_up], i[pick_up], j[pick_up]] = -1
+        self.objects[R[transform], i[transform], j[transform]] = self.transformed
+        self.obs[R[transform], 1 + self.transformed, i[transform], j[transform]] = 1
+        advance = iterate & (self.count == 0)
+        self.subtask_idx += advance
+        self.count -= iterate & ~advance
+
+        # move
+        moving = a < self.n_transitions
+        transitions = self.env.transitions[np.where(moving, a, 0)]
+        pos = np.clip(self.pos + transitions, 0, self.env.max_pos)
+        moving &= ~self.obstacles[R, pos[:, 0], pos[:, 1]]
+        m = R[moving]
+        self.obs[m, -1, i[moving], j[moving]] = 0
+        self.obs[m, -1, pos[moving, 0], pos[moving, 1]] = 1
+        self.pos[m] = pos[moving]
+
+        done = self.subtask_idx >= self.n_subtasks
+        reward = np.where(done, 1.0, -0.1)
+        obs = self.observation()
+        for k in np.flatnonzero(done):
+            self.reset_world(k)
+            self.write_observation(obs, k)
+        return obs, reward, done, [{} for _ in range(self.num_envs)]
+
+    def observation(self):
+        return OrderedDict(
+            base=self.obs.copy(),
+            subtask=self.subtask_idx.copy(),
+            subtasks=self.subtasks.copy(),
+        )
+
+    def write_observation(self, obs, i):
+        obs["base"][i] = self.obs[i]
+        obs["subtask"][i] = self.subtask_idx[i]
+        obs["subtasks"][i] = self.subtasks[i]
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_world(i)
+        return self.observation()
+
+    def render(self, mode="human"):
+        env = self.env
+        env.pos = self.pos[0]
+        env.objects = {
+            tuple(p): self.objects[(0, *p)] for p in np.argwhere(self.objects[0] >= 0)
+        }
+        env.subtask_idx = self.subtask_idx[0]
+        env.render(mode=mode)
+
+    def close_extras(self):
+        pass
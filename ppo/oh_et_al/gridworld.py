@@ -14,7 +14,7 @@ import six
 from ppo.utils import set_index, GREEN, RESET
 
 Subtask = namedtuple("Subtask", "interaction count object")
-Obs = namedtuple("Obs", "base subtask control_flow")
+Obs = namedtuple("Obs", "base subtask subtasks")
 
 
 class GridWorld(gym.Env):
@@ -53,8 +53,13 @@ class GridWorld(gym.Env):
         self.random_obstacles = random_obstacles
 
         # set on initialize
+        h, w = self.desc.shape
+        self.cells = cartesian_product(np.arange(h), np.arange(w))
+        self.obstacle_choices = self.cells[np.all(self.cells % 2 != 0, axis=-1)]
         self.obstacles_one_hot = np.zeros(self.desc.shape, dtype=bool)
         self.obstacles = None
+        self.open_spaces = None
+        self.set_obstacles(np.zeros((0, 2), dtype=int))
 
         self.possible_subtasks = np.array(
             list(
@@ -133,13 +138,12 @@ class GridWorld(gym.Env):
                 return string
 
         self.Subtask = _Subtask
-        self.object_one_hots = np.vstack(
-            [
-                np.eye(1 + len(self.object_types)),
-                np.zeros((1, 1 + len(self.object_types))),
-            ]
-        )
-        self.layer_one_hots = np.eye(h * w).reshape(-1, h, w)
+        self.max_pos = np.array(self.desc.shape) - 1
+        # observation, updated in place: obstacles, objects (the last object
+        # channel holds transformed objects) and agent
+        self.obs = np.zeros(self.observation_space.spaces["base"].shape)
+        self.obs_view = self.obs.view()
+        self.obs_view.flags.writeable = False
 
     @property
     def subtask(self):
@@ -149,16 +153,19 @@ class GridWorld(gym.Env):
             return None
 
     def randomize_obstacles(self):
-        h, w = self.desc.shape
-        choices = cartesian_product(np.arange(h), np.arange(w))
-        choices = choices[np.all(choices % 2 != 0, axis=-1)]
         randoms = self.np_random.choice(
-            len(choices), replace=False, size=self.n_obstacles
+            len(self.obstacle_choices), replace=False, size=self.n_obstacles
         )
-        self.obstacles = choices[randoms]
+        self.set_obstacles(self.obstacle_choices[randoms])
+
+    def set_obstacles(self, obstacles):
+        self.obstacles = obstacles
         self.obstacles_one_hot[:] = 0
         set_index(self.obstacles_one_hot, self.obstacles, True)
-        self.obstacles = np.array(list(self.obstacles))
+        # a cell is closed if both of its coordinates occur among the
+        # coordinates of the obstacles
+        closed = np.isin(np.arange(max(self.desc.shape)), self.obstacles)
+        self.open_spaces = self.cells[~np.all(closed[self.cells], axis=-1)]
 
     @property
     def transition_strings(self):
@@ -222,62 +229,43 @@ class GridWorld(gym.Env):
             yield from [subtask.object] * (subtask.count + 1)
 
     def reset(self):
-        if self.random_obstacles:
-            self.randomize_obstacles()
+        while True:
+            if self.random_obstacles:
+                self.randomize_obstacles()
 
-        if self.random_task:
-            self.subtasks = list(self.subtasks_generator())
+            if self.random_task:
+                self.subtasks = list(self.subtasks_generator())
 
-        h, w = self.desc.shape
-        ij = cartesian_product(np.arange(h), np.arange(w))
-        open_spaces = ij[np.logical_not(np.all(np.isin(ij, self.obstacles), axis=-1))]
-
-        types = list(self.get_required_objects(self.subtasks))
-        self.np_random.shuffle(types)
+            types = list(self.get_required_objects(self.subtasks))
+            self.np_random.shuffle(types)
 
-        try:
+            if len(types) + 1 > len(self.open_spaces):  # + 1 for agent
+                continue
             randoms = self.np_random.choice(
-                len(open_spaces), replace=False, size=len(types) + 1  # + 1 for agent
+                len(self.open_spaces), replace=False, size=len(types) + 1
             )
-        except ValueError:
-            return self.reset()
-        *objects_pos, self.pos = open_spaces[randoms]
+            *objects_pos, self.pos = self.open_spaces[randoms]
 
-        self.objects = {tuple(p): t for p, t in zip(objects_pos, types)}
+            self.objects = {tuple(p): t for p, t in zip(objects_pos, types)}
 
-        self.subtask_idx = None
-        self.subtask_idx = self.get_next_subtask()
-        if self.subtask is None:
-            return self.reset()
+            self.subtask_idx = None
+            self.subtask_idx = self.get_next_subtask()
+            if self.subtask is not None:
+                break
         self.count = self.subtask.count
         self.last_terminal = False
         self.last_action = None
+        self.obs[:] = 0
+        self.obs[0] = self.obstacles_one_hot
+        for (i, j), t in self.objects.items():
+            self.obs[1 + t, i, j] = 1
+        self.obs[(-1, *self.pos)] = 1
         return self.get_observation()
 
     def get_observation(self):
-        agent_one_hot = np.zeros_like(self.desc, dtype=bool)
-        set_index(agent_one_hot, self.pos, True)
-
-        objects_desc = np.full(self.desc.shape, -1)
-        for k, v in self.objects.items():
-            objects_desc[k] = v
-
-        obstacles = self.layer_one_hots[
-            np.ravel_multi_index(self.obstacles.T, self.desc.shape)
-        ].sum(0)
-        objects = self.object_one_hots[objects_desc]
-        agent = self.layer_one_hots[np.ravel_multi_index(self.pos, self.desc.shape)]
-
-        obs = np.dstack(
-            [
-                np.expand_dims(obstacles, 2),
-                objects,
-                np.expand_dims(agent, 2),
-                # np.dstack([obstacles, agent]),
-            ]
-        ).transpose(2, 0, 1)
-
-        return Obs(base=obs, subtask=self.subtask_idx, subtasks=self.subtasks)._asdict()
+        return Obs(
+            base=self.obs_view, subtask=self.subtask_idx, subtasks=self.subtasks
+        )._asdict()
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -302,10 +290,13 @@ class GridWorld(gym.Env):
             if a >= n_transitions:
                 if a - n_transitions == 0:  # pick up
                     del self.objects[pos]
+                    self.obs[(1 + object_type, *pos)] = 0
                     if "pick-up" == interaction and object_type == self.subtask.object:
                         iterate = True
                 elif a - n_transitions == 1:  # transform
                     self.objects[pos] = len(self.object_types)
+                    self.obs[(1 + object_type, *pos)] = 0
+                    self.obs[(1 + len(self.object_types), *pos)] = 1
                     if (
                         "transform" == interaction
                         and object_type == self.subtask.object
@@ -319,12 +310,11 @@ class GridWorld(gym.Env):
 
         if a < n_transitions:
             # move
-            pos = self.pos + self.transitions[a]
-            if any(np.all(self.obstacles == pos, axis=-1)):
-                pos = self.pos
-            a_min = np.zeros(2)
-            a_max = np.array(self.desc.shape) - 1
-            self.pos = np.clip(pos, a_min, a_max).astype(int)
+            pos = np.clip(self.pos + self.transitions[a], 0, self.max_pos)
+            if not self.obstacles_one_hot[tuple(pos)]:
+                self.obs[(-1, *self.pos)] = 0
+                self.obs[(-1, *pos)] = 1
+                self.pos = pos
 
         self.last_terminal = t = self.subtask is None
         r = 1.0 if t else -0.1
@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+
+from ppo.oh_et_al import BatchedGridWorld, GridWorld
+
+
+def make_env(seed, world_size=5, n_subtasks=3, random_obstacles=True):
+    env = GridWorld(
+        text_map=[" " * world_size] * world_size,
+        min_objects=1,
+        n_obstacles=world_size // 2,
+        random_obstacles=random_obstacles,
+        n_subtasks=n_subtasks,
+        interactions=["visit", "pick-up", "transform"],
+        max_task_count=2,
+        object_types=["pig", "sheep", "cat", "greenbot"],
+    )
+    env.seed(seed)
+    return env
+
+
+def act(env, random, epsilon=0.3):
+    """
+    Heads for an object of the type of the current subtask and interacts with
+    it, or acts randomly with probability `epsilon`.
+    """
+    n_transitions = len(env.transitions)
+    targets = [p for p, t in env.objects.items() if t == env.subtask.object]
+    if random.random() < epsilon or not targets:
+        return random.randint(env.action_space.n)
+    pos = tuple(env.pos)
+    if pos in targets:
+        interaction = env.interactions[env.subtask.interaction]
+        return dict(visit=0, transform=n_transitions + 1).get(
+            interaction, n_transitions
+        )
+    delta = np.sign(np.array(targets[0]) - env.pos)
+    moves = [k for k, t in enumerate(env.transitions) if t @ delta > 0]
+    return random.choice(moves)
+
+
+class TestBatchedGridWorld(unittest.TestCase):
+    num_envs = 6
+    num_steps = 1000
+
+    def check(self, **kwargs):
+        fns = [lambda i=i: make_env(i, **kwargs) for i in range(self.num_envs)]
+        envs = [fn() for fn in fns]
+        batched = BatchedGridWorld(fns)
+        obs = batched.reset()
+        expected = [env.reset() for env in envs]
+        self.assertObsEqual(obs, expected)
+
+        random = np.random.RandomState(0)
+        episodes = 0
+        for _ in range(self.num_steps):
+            actions = [act(env, random) for env in envs]
+            obs, reward, done, infos = batched.step(actions)
+            expected = []
+            for i, (env, a) in enumerate(zip(envs, actions)):
+                ob, r, d, _ = env.step(a)
+                self.assertEqual(r, reward[i])
+                self.assertEqual(d, done[i])
+                expected.append(env.reset() if d else ob)
+            self.assertObsEqual(obs, expected)
+            self.assertEqual(len(infos), self.num_envs)
+            episodes += done.sum()
+        self.assertGreater(episodes, 5 * self.num_envs)
+
+    def assertObsEqual(self, obs, expected):
+        for i, ob in enumerate(expected):
+            n = len(ob["subtasks"])
+            self.assertTrue(np.array_equal(obs["base"][i], ob["base"]))
+            self.assertEqual(obs["subtask"][i], ob["subtask"])
+            self.assertTrue(np.array_equal(obs["subtasks"][i, :n], ob["subtasks"]))
+
+    def test_matches_gridworld(self):
+        self.check()
+
+    def test_fixed_obstacles(self):
+        self.check(random_obstacles=False, world_size=4, n_subtasks=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
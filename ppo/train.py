@@ -19,13 +19,21 @@ from tqdm import tqdm
 
 from common.atari_wrappers import wrap_deepmind
 from common.vec_env.dummy_vec_env import DummyVecEnv
-from common.vec_env.subproc_vec_env import SubprocVecEnv
+from common.vec_env.shmem_vec_env import ShmemVecEnv, concatenate_infos, info_items
 from ppo.agent import Agent, AgentValues
 from ppo.control_flow.hdfstore import HDF5Store
+from ppo.curriculum import LearningProgress
+from ppo.eval_cache import EvalCache
 from ppo.storage import RolloutStorage
 from ppo.update import PPO
 from ppo.utils import k_scalar_pairs, get_n_gpu, get_random_gpu
-from ppo.wrappers import AddTimestep, TransposeImage, VecPyTorch, VecPyTorchFrameStack
+from ppo.wrappers import (
+    AddTimestep,
+    TransposeImage,
+    VecPyTorch,
+    VecPyTorchFrameStack,
+    VecPyTorchPipeline,
+)
 
 
 # noinspection PyAttributeOutsideInit
@@ -56,6 +64,10 @@ class TrainBase(abc.ABC):
         env_args,
         success_reward,
         use_tqdm,
+        eval_cache_dir=None,
+        curriculum_interval=None,
+        envs_per_worker=1,
+        pipeline=False,
     ):
         # Properly restrict pytorch to not consume extra resources.
         #  - https://github.com/pytorch/pytorch/issues/975
@@ -63,6 +75,10 @@ class TrainBase(abc.ABC):
         torch.set_num_threads(1)
         os.environ["OMP_NUM_THREADS"] = "1"
 
+        if pipeline and env_args.get("num_frame_stack") is not None:
+            raise ValueError("--pipeline does not support frame stacking")
+        if pipeline and env_args.get("batched_env"):
+            raise ValueError("--pipeline does not support --batched-env")
         if render_eval and not render:
             eval_interval = 1
         if render or render_eval:
@@ -93,6 +109,8 @@ class TrainBase(abc.ABC):
             synchronous=True if render else synchronous,
             evaluation=False,
             num_processes=num_processes,
+            envs_per_worker=envs_per_worker,
+            pipeline=pipeline,
             time_limit=time_limit,
         )
         self.make_eval_envs = functools.partial(
@@ -104,8 +122,33 @@ class TrainBase(abc.ABC):
             synchronous=True if render else synchronous,
             evaluation=True,
             num_processes=num_processes,
+            envs_per_worker=envs_per_worker,
+            pipeline=pipeline,
             time_limit=time_limit,
         )
+        # made on the first evaluation and kept alive, see `evaluate`
+        self.eval_envs = None
+        # reseeding with the seeds that `make_env` gives them makes every
+        # evaluation replay the same tasks
+        self.eval_seeds = [seed + rank for rank in range(num_processes)]
+
+        self.eval_cache = None
+        if eval_cache_dir is not None:
+            self.eval_cache = EvalCache(
+                eval_cache_dir,
+                version=self.eval_version(env_args),
+                seed=seed,
+                num_processes=num_processes,
+                eval_steps=eval_steps,
+                time_limit=time_limit,
+                env_args=env_args,
+                agent_args=agent_args,
+            )
+
+        self.curriculum = None
+        self.curriculum_interval = curriculum_interval
+        if curriculum_interval is not None:
+            self.curriculum = LearningProgress()
 
         self.envs.to(self.device)
         self.agent = self.build_agent(envs=self.envs, **agent_args)
@@ -171,30 +214,19 @@ class TrainBase(abc.ABC):
             #     vec_norm.ob_rms = get_vec_normalize(envs).ob_rms
 
             # self.envs.evaluate()
-            eval_masks = torch.zeros(num_processes, 1, device=self.device)
-            eval_counter = Counter()
-            envs = self.make_eval_envs()
-            envs.to(self.device)
-            with self.agent.recurrent_module.evaluating(envs.observation_space):
-                eval_recurrent_hidden_states = torch.zeros(
-                    num_processes,
-                    self.agent.recurrent_hidden_state_size,
-                    device=self.device,
-                )
-
-                eval_result = self.run_epoch(
-                    obs=envs.reset(),
-                    rnn_hxs=eval_recurrent_hidden_states,
-                    masks=eval_masks,
-                    num_steps=eval_steps,
-                    # max(num_steps, time_limit) if time_limit else num_steps,
-                    counter=eval_counter,
+            eval_result = None
+            if self.eval_cache is not None:
+                eval_key = self.eval_cache.key(self.agent)
+                eval_result = self.eval_cache.get(eval_key)
+            if eval_result is None:
+                eval_result = self.evaluate(
+                    num_processes=num_processes,
+                    eval_steps=eval_steps,
                     success_reward=success_reward,
                     use_tqdm=use_tqdm,
-                    rollouts=None,
-                    envs=envs,
                 )
-            envs.close()
+                if self.eval_cache is not None:
+                    self.eval_cache.put(eval_key, eval_result)
             eval_result = {f"eval_{k}": v for k, v in eval_result.items()}
         else:
             eval_result = {}
@@ -237,6 +269,12 @@ class TrainBase(abc.ABC):
             self.rollouts.compute_returns(next_value=next_value)
             train_results = self.ppo.update(self.rollouts)
             self.rollouts.after_update()
+            if self.curriculum is not None:
+                # envs without buckets never hear of the curriculum
+                interval = self.curriculum_interval
+                if self.i % interval == 0 and self.curriculum.progress():
+                    self.envs.set_curriculum(self.curriculum.weights())
+                epoch_counter.update(self.curriculum.log())
             if log_progress is not None:
                 log_progress.update()
             if self.i % log_interval == 0:
@@ -247,6 +285,58 @@ class TrainBase(abc.ABC):
                     tick=tick, fps=fps, **epoch_counter, **train_results, **eval_result
                 )
 
+    def evaluate(self, num_processes, eval_steps, success_reward, use_tqdm):
+        eval_masks = torch.zeros(num_processes, 1, device=self.device)
+        eval_counter = Counter()
+        if self.eval_envs is None:
+            self.eval_envs = self.make_eval_envs()
+            self.eval_envs.to(self.device)
+        envs = self.eval_envs
+        envs.seed(self.eval_seeds)
+        with self.agent.recurrent_module.evaluating(envs.observation_space):
+            eval_recurrent_hidden_states = torch.zeros(
+                num_processes,
+                self.agent.recurrent_hidden_state_size,
+                device=self.device,
+            )
+
+            eval_result = self.run_epoch(
+                obs=envs.reset(),
+                rnn_hxs=eval_recurrent_hidden_states,
+                masks=eval_masks,
+                num_steps=eval_steps,
+                # max(num_steps, time_limit) if time_limit else num_steps,
+                counter=eval_counter,
+                success_reward=success_reward,
+                use_tqdm=use_tqdm,
+                rollouts=None,
+                envs=envs,
+            )
+        return eval_result
+
+    def close(self):
+        """
+        Closes the training envs and the eval envs, if an evaluation made
+        them.
+        """
+        self.envs.close()
+        if self.eval_envs is not None:
+            self.eval_envs.close()
+            self.eval_envs = None
+
+    def eval_version(self, env_args):
+        """
+        Identifies the evaluation tasks, as part of the key of `EvalCache`.
+        """
+        return None
+
+    def episode_bucket(self, info):
+        """
+        Curriculum bucket of an episode, from the info of its last step, or
+        None to leave the episode out of the curriculum.
+        """
+        return None
+
     def run_epoch(
         self,
         obs,
@@ -261,17 +351,19 @@ class TrainBase(abc.ABC):
     ):
         # noinspection PyTypeChecker
         episode_counter = defaultdict(list)
-        iterator = range(num_steps)
+        collect = self.collect
+        if isinstance(envs, VecPyTorchPipeline):
+            collect = self.collect_pipelined
+        iterator = collect(obs, rnn_hxs, masks, num_steps, envs)
         if use_tqdm:
-            iterator = tqdm(iterator, desc="evaluating")
-        for _ in iterator:
-            with torch.no_grad():
-                act = self.agent(
-                    inputs=obs, rnn_hxs=rnn_hxs, masks=masks
-                )  # type: AgentValues
-
-            # Observe reward and next obs
-            obs, reward, done, infos = envs.step(act.action)
+            iterator = tqdm(iterator, total=num_steps, desc="evaluating")
+        for act, obs, reward, done, infos, masks in iterator:
+            if rollouts is not None and self.curriculum is not None:
+                for i in np.flatnonzero(done):
+                    info = infos[i]
+                    bucket = self.episode_bucket(info)
+                    if bucket is not None:
+                        self.curriculum.update(bucket, info["success"])
             self.process_infos(episode_counter, done, infos, **act.log)
 
             # track rewards
@@ -287,11 +379,6 @@ class TrainBase(abc.ABC):
             counter["reward"][done] = 0
             counter["time_step"][done] = 0
 
-            # If done then clean the history of observations.
-            masks = torch.tensor(
-                1 - done, dtype=torch.float32, device=obs.device
-            ).unsqueeze(1)
-            rnn_hxs = act.rnn_hxs
             if rollouts is not None:
                 rollouts.insert(
                     obs=obs,
@@ -305,11 +392,102 @@ class TrainBase(abc.ABC):
 
         return dict(episode_counter)
 
+    def collect(self, obs, rnn_hxs, masks, num_steps, envs):
+        """
+        Steps `envs` with the agent `num_steps` times, yielding the agent's
+        output, the results of each step and the masks that follow it.
+        """
+        for _ in range(num_steps):
+            with torch.no_grad():
+                act = self.agent(
+                    inputs=obs, rnn_hxs=rnn_hxs, masks=masks
+                )  # type: AgentValues
+
+            # Observe reward and next obs
+            obs, reward, done, infos = envs.step(act.action)
+
+            # If done then clean the history of observations.
+            masks = torch.tensor(
+                1 - done, dtype=torch.float32, device=obs.device
+            ).unsqueeze(1)
+            rnn_hxs = act.rnn_hxs
+            yield act, obs, reward, done, infos, masks
+
+    def collect_pipelined(self, obs, rnn_hxs, masks, num_steps, envs):
+        """
+        `collect` for a `VecPyTorchPipeline`: the agent acts for each group of
+        envs while the others step, and the groups' results are joined into
+        one step.
+        """
+        groups = envs.groups
+        obs, rnn_hxs, masks = (
+            [x[s] for s in envs.slices] for x in (obs, rnn_hxs, masks)
+        )
+
+        def act(g):
+            with torch.no_grad():
+                values = self.agent(
+                    inputs=obs[g], rnn_hxs=rnn_hxs[g], masks=masks[g]
+                )  # type: AgentValues
+            groups[g].step_async(values.action)
+            return values
+
+        acts = [act(g) for g in range(len(groups))]
+        for i in range(num_steps):
+            steps = []
+            for g, group in enumerate(groups):
+                ob, reward, done, infos = group.step_wait()
+                # the group steps again before the join reads its shared memory
+                obs[g] = ob.clone()
+                masks[g] = torch.tensor(
+                    1 - done, dtype=torch.float32, device=ob.device
+                ).unsqueeze(1)
+                rnn_hxs[g] = acts[g].rnn_hxs
+                steps.append((acts[g], reward, done, infos))
+                if i + 1 < num_steps:
+                    acts[g] = act(g)
+            values, reward, done, infos = zip(*steps)
+            yield (
+                AgentValues(
+                    value=torch.cat([v.value for v in values]),
+                    action=torch.cat([v.action for v in values]),
+                    action_log_probs=torch.cat([v.action_log_probs for v in values]),
+                    aux_loss=None,
+                    rnn_hxs=torch.cat([v.rnn_hxs for v in values]),
+                    log=self.join_logs(values),
+                    dist=None,
+                ),
+                torch.cat(obs),
+                torch.cat(reward),
+                np.concatenate(done),
+                concatenate_infos(infos),
+                torch.cat(masks),
+            )
+
+    @staticmethod
+    def join_logs(values):
+        """
+        Joins the `log`s of the `AgentValues` of several groups of envs:
+        per-env tensors (like the control-flow agent's `P`) are concatenated
+        and scalars are averaged over all envs.
+        """
+        sizes = [len(v.action) for v in values]
+        log = {}
+        for k in values[0].log:
+            xs = [v.log[k] for v in values]
+            if torch.is_tensor(xs[0]) and xs[0].dim() > 0:
+                log[k] = torch.cat(xs)
+            else:
+                log[k] = sum(float(x) * n for x, n in zip(xs, sizes)) / sum(sizes)
+        return log
+
     @staticmethod
     def process_infos(episode_counter, done, infos, **act_log):
-        for d in infos:
-            for k, v in d.items():
-                episode_counter[k] += v if type(v) is list else [float(v)]
+        for k, v in info_items(infos):
+            if isinstance(v, (list, np.ndarray)):
+                episode_counter[k] += list(v)
+            else:
+                episode_counter[k] += [float(v)]
         for k, v in act_log.items():
             episode_counter[k] += v if type(v) is list else [float(v)]
 
@@ -358,6 +536,9 @@ class TrainBase(abc.ABC):
         evaluation,
         time_limit,
         num_frame_stack=None,
+        batched_env=False,
+        envs_per_worker=1,
+        pipeline=False,
         **env_args,
     ):
         envs = [
@@ -375,10 +556,20 @@ class TrainBase(abc.ABC):
             for i in range(num_processes)
         ]
 
-        if len(envs) == 1 or sys.platform == "darwin" or synchronous:
+        if batched_env:
+            envs = self.make_batched_env(envs, **env_args)
+        elif len(envs) == 1 or sys.platform == "darwin" or synchronous:
             envs = DummyVecEnv(envs, render=render)
+        elif pipeline:
+            half = len(envs) // 2
+            return VecPyTorchPipeline(
+                [
+                    VecPyTorch(ShmemVecEnv(group, envs_per_worker=envs_per_worker))
+                    for group in (envs[:half], envs[half:])
+                ]
+            )
         else:
-            envs = SubprocVecEnv(envs)
+            envs = ShmemVecEnv(envs, envs_per_worker=envs_per_worker)
 
         # if (
         # envs.observation_space.shape
@@ -398,6 +589,14 @@ class TrainBase(abc.ABC):
 
         return envs
 
+    @abc.abstractmethod
+    def make_batched_env(self, env_fns, **env_args):
+        """
+        One VecEnv that steps the envs of `env_fns` together in this process
+        (--batched-env).
+        """
+        raise NotImplementedError
+
     def _save(self, checkpoint_dir):
         modules = dict(
             optimizer=self.ppo.optimizer, agent=self.agent
@@ -454,14 +653,17 @@ class Train(TrainBase):
         self.last_save = time.time()  # dummy save
 
     def run(self):
-        for _ in itertools.count():
-            for result in self.make_train_iterator():
-                if self.writer is not None:
-                    self.log_result(result)
-
-                if self.log_dir and self.i % self.save_interval == 0:
-                    self._save(str(self.log_dir))
-                    self.last_save = time.time()
+        try:
+            for _ in itertools.count():
+                for result in self.make_train_iterator():
+                    if self.writer is not None:
+                        self.log_result(result)
+
+                    if self.log_dir and self.i % self.save_interval == 0:
+                        self._save(str(self.log_dir))
+                        self.last_save = time.time()
+        finally:
+            self.close()
 
     def log_result(self, result):
         total_num_steps = (self.i + 1) * self.num_processes * self.num_steps
@@ -4,7 +4,8 @@ from gym.spaces import Box
 import numpy as np
 import torch
 
-from common.vec_env import VecEnvWrapper
+from common.vec_env import VecEnv, VecEnvWrapper
+from common.vec_env.shmem_vec_env import concatenate_infos
 from common.vec_env.vec_normalize import VecNormalize as VecNormalize_
 from rl_utils import onehot
 
@@ -65,19 +66,25 @@ class VecPyTorch(VecEnvWrapper):
         assert len(obs) == 1
         return obs[0]
 
+    def to_tensor(self, obs):
+        if not torch.is_tensor(obs):  # envs like TensorEnv already return tensors
+            # shares memory with float32 arrays, such as ShmemVecEnv observations
+            obs = torch.from_numpy(self.extract_numpy(obs))
+        return obs.float().to(self.device)
+
     def reset(self):
-        obs = self.extract_numpy(self.venv.reset())
-        return torch.from_numpy(obs).float().to(self.device)
+        return self.to_tensor(self.venv.reset())
 
     def step_async(self, actions):
-        actions = actions.squeeze(1).cpu().numpy()
+        actions = actions.squeeze(1)
+        if not getattr(self.venv, "accepts_tensors", False):
+            actions = actions.cpu().numpy()
         self.venv.step_async(actions)
 
     def step_wait(self):
         obs, reward, done, info = self.venv.step_wait()
-        obs = self.extract_numpy(obs)
-        obs = torch.from_numpy(obs).float().to(self.device)
-        reward = torch.from_numpy(reward).float()
+        obs = self.to_tensor(obs)
+        reward = torch.as_tensor(reward).float()
         return obs, reward, done, info
 
     def to(self, device):
@@ -90,8 +97,11 @@ class VecPyTorch(VecEnvWrapper):
     def train(self):
         self.venv.train()
 
-    def increment_curriculum(self):
-        self.venv.increment_curriculum()
+    def set_curriculum(self, weights):
+        self.venv.set_curriculum(weights)
+
+    def seed(self, seeds):
+        self.venv.seed(seeds)
 
 
 class VecNormalize(VecNormalize_):
@@ -160,6 +170,61 @@ class VecPyTorchFrameStack(VecEnvWrapper):
         self.venv.to(device)
 
 
+class VecPyTorchPipeline(VecEnv):
+    """
+    Groups of `VecPyTorch` envs that `TrainBase.run_epoch` steps in turn,
+    letting the agent act for one group while the others step. As a VecEnv,
+    it steps all groups together.
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        offsets = np.cumsum([0] + [group.num_envs for group in groups])
+        self.slices = [slice(a, b) for a, b in zip(offsets[:-1], offsets[1:])]
+        VecEnv.__init__(
+            self,
+            num_envs=int(offsets[-1]),
+            observation_space=groups[0].observation_space,
+            action_space=groups[0].action_space,
+        )
+
+    def reset(self):
+        return torch.cat([group.reset() for group in self.groups])
+
+    def step_async(self, actions):
+        for group, s in zip(self.groups, self.slices):
+            group.step_async(actions[s])
+
+    def step_wait(self):
+        obs, reward, done, infos = zip(*[group.step_wait() for group in self.groups])
+        infos = concatenate_infos(infos)
+        return torch.cat(obs), torch.cat(reward), np.concatenate(done), infos
+
+    def close_extras(self):
+        for group in self.groups:
+            group.close()
+
+    def to(self, device):
+        for group in self.groups:
+            group.to(device)
+
+    def evaluate(self):
+        for group in self.groups:
+            group.evaluate()
+
+    def train(self):
+        for group in self.groups:
+            group.train()
+
+    def set_curriculum(self, weights):
+        for group in self.groups:
+            group.set_curriculum(weights)
+
+    def seed(self, seeds):
+        for group, s in zip(self.groups, self.slices):
+            group.seed(seeds[s])
+
+
 class OneHotWrapper(gym.Wrapper):
     def wrap_observation(self, obs, observation_space=None):
         if observation_space is None: